@@ -0,0 +1,59 @@
+"""
+Benchmark graphs with many attribute and subscript chains.
+
+Each chain is evaluated as a single operation, instead of one
+operation per attribute or subscript like in pythonflow.
+
+    PYTHONPATH=. python benchmarks/bench_access.py
+"""
+
+import timeit
+from types import SimpleNamespace
+
+import pythonflow as pf
+from slipform import slipform
+
+
+@slipform
+def features(batch):
+    a = batch['x'][0].shape[1]
+    b = batch['x'][1].meta.scale
+    c = batch['y'][0][1]
+    d = batch['y'][1][0]
+    total = a + b + c + d
+
+
+with pf.Graph() as pf_features:
+    batch = pf.placeholder('batch')
+    a = batch['x'][0].shape[1]
+    b = batch['x'][1].meta.scale
+    c = batch['y'][0][1]
+    d = batch['y'][1][0]
+    total = (a + b + c + d).set_name('total')
+
+
+def count_ops(graph):
+    tracer = pf.Profiler()
+    graph('total', batch=BATCH, callback=tracer)
+    return len(tracer.times)
+
+
+BATCH = {
+    'x': [SimpleNamespace(shape=(3, 4)), SimpleNamespace(meta=SimpleNamespace(scale=2))],
+    'y': [[1, 2], [3, 4]],
+}
+
+
+def main(number=20000):
+    cases = {
+        'pythonflow': pf_features,
+        'slipform': features,
+    }
+    print(f'{"case":<12} {"ops run":>8} {"time/call (us)":>16}')
+    for name, graph in cases.items():
+        t = timeit.timeit(lambda: graph('total', batch=BATCH), number=number) / number
+        print(f'{name:<12} {count_ops(graph):>8} {t * 1e6:>16.2f}')
+
+
+if __name__ == '__main__':
+    main()
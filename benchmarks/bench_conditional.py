@@ -0,0 +1,52 @@
+"""
+Benchmark lazy evaluation of conditionals on branchy graphs.
+
+Only the branch selected by each predicate should be evaluated, so
+taking the cheap branches never runs any of the expensive operations.
+
+    PYTHONPATH=. python benchmarks/bench_conditional.py
+"""
+
+import timeit
+
+import pythonflow as pf
+from slipform import slipform, cpu_heavy
+
+
+@cpu_heavy
+def expensive(x):
+    total = 0
+    for i in range(20000):
+        total += i % 7
+    return x + total
+
+
+@slipform
+def branchy(x, cheap):
+    a = x + 1 if cheap else expensive(x)
+    b = a + 1 if cheap else expensive(a)
+    c = b + 1 if cheap else expensive(b)
+    d = c + 1 if cheap else expensive(c)
+    e = d + 1 if cheap else expensive(d)
+
+
+def count_ops(fetches, **context):
+    tracer = pf.Profiler()
+    branchy(fetches, callback=tracer, **context)
+    return len(tracer.times)
+
+
+def main(number=200):
+    cases = {
+        'cheap branches':     lambda: branchy('e', x=1, cheap=True),
+        'expensive branches': lambda: branchy('e', x=1, cheap=False),
+    }
+    print(f'{"case":<20} {"ops run":>8} {"time/call (ms)":>16}')
+    for name, fn in cases.items():
+        ops = count_ops('e', x=1, cheap=name.startswith('cheap'))
+        t = timeit.timeit(fn, number=number) / number
+        print(f'{name:<20} {ops:>8} {t * 1000:>16.4f}')
+
+
+if __name__ == '__main__':
+    main()
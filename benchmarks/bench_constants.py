@@ -0,0 +1,62 @@
+"""
+Benchmark building a generated graph that uses the same literals many
+times, eg. ``reduce(x, 0, 'mean')``. Equal literals are interned into a
+single operation per graph, instead of one operation per occurrence.
+
+    PYTHONPATH=. python benchmarks/bench_constants.py
+"""
+
+import importlib.util
+import os
+import tempfile
+import timeit
+import tracemalloc
+
+FEATURES = 200
+
+SOURCE = '''
+import pythonflow as pf
+from slipform import pure
+
+
+@pure
+def reduce(x, axis, how):
+    return x
+
+
+def features(x):
+{body}
+'''
+
+
+def load_features(n=FEATURES):
+    # slipform needs the source of the function, so it is written to a file
+    body = '\n'.join(f"    f{i} = reduce(x, {i % 2}, 'mean') + 1" for i in range(n))
+    path = os.path.join(tempfile.mkdtemp(), 'generated_features.py')
+    with open(path, 'w') as f:
+        f.write(SOURCE.format(body=body))
+    spec = importlib.util.spec_from_file_location('generated_features', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.features
+
+
+def main(number=5):
+    from slipform import slipform
+    from slipform._explain import is_constant
+    features = load_features()
+    graph = slipform(features)
+    constants = sum(1 for op in graph.operations.values() if is_constant(op))
+    t = min(timeit.repeat(lambda: slipform(features), number=number, repeat=3)) / number
+    tracemalloc.start()
+    graph = slipform(features)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'{"operations":<20} {len(graph.operations):>10}')
+    print(f'{"constants":<20} {constants:>10}')
+    print(f'{"build time (ms)":<20} {t * 1000:>10.2f}')
+    print(f'{"memory (MB)":<20} {size / 1e6:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmark fused arithmetic expressions on large arrays.
+
+Each expression is a single operation in slipform, evaluated without
+allocating a temporary array for every operator. pythonflow creates
+one operation and one temporary array per operator.
+
+    PYTHONPATH=. python benchmarks/bench_elementwise.py
+"""
+
+import time
+import tracemalloc
+
+import numpy as np
+import pythonflow as pf
+from slipform import slipform
+
+
+@slipform
+def fused(a, b, c, d, e):
+    y = a * b + c - d / e
+    z = (y - a) * (y + b) / 2
+
+
+with pf.Graph() as unfused:
+    a, b, c, d, e = (pf.placeholder(name) for name in 'abcde')
+    y = (a * b + c - d / e).set_name('y')
+    z = ((y - a) * (y + b) / 2).set_name('z')
+
+
+def measure(fn, number=10):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    t = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return peak, (time.perf_counter() - t) / number
+
+
+def main(size=1_000_000):
+    arrays = {name: np.random.rand(size) for name in 'abcde'}
+    cases = {
+        'pythonflow': lambda: unfused('z', **arrays),
+        'slipform': lambda: fused('z', **arrays),
+    }
+    print(f'{"case":<12} {"peak (MB)":>10} {"time/call (ms)":>16}')
+    for name, fn in cases.items():
+        peak, t = measure(fn)
+        print(f'{name:<12} {peak / 2**20:>10.1f} {t * 1000:>16.2f}')
+
+
+if __name__ == '__main__':
+    main()
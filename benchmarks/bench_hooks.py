@@ -0,0 +1,82 @@
+"""
+Benchmark the overhead of hooks on a graph with many cheap operations.
+
+Graphs without hooks or callbacks are evaluated by a separate path that
+does not check for them around each operation, which should be faster
+than calling even a callback that does nothing.
+
+    PYTHONPATH=. python benchmarks/bench_hooks.py
+"""
+
+import io
+import statistics
+import timeit
+
+import pythonflow as pf
+from slipform import slipform, Hooks, SpanExporter
+
+
+@slipform
+def chain(x):
+    a = x + 1
+    b = a * 2
+    c = b - a
+    d = c + b
+    e = d * c
+    f = e - d
+    g = f + e
+    h = g * 2
+    out = h - g
+
+
+class _Noop:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+_NOOP = _Noop()
+
+
+def noop_callback(operation, context):
+    return _NOOP
+
+
+def measure(cases, number, repeat):
+    times = {name: [] for name in cases}
+    # cases are interleaved so that the machine getting slower or
+    # faster over the run does not favour the cases measured first
+    for _ in range(repeat):
+        for name, (hooks, kwargs) in cases.items():
+            if hooks is not None:
+                chain.add_hooks(hooks)
+            try:
+                t = timeit.timeit(lambda: chain('out', x=1, **kwargs), number=number)
+            finally:
+                if hooks is not None:
+                    chain.remove_hooks(hooks)
+            times[name].append(t / number * 1e6)
+    return times
+
+
+def main(number=2000, repeat=50):
+    cases = {
+        'no hooks': (None, {}),
+        'noop callback': (None, {'callback': noop_callback}),
+        'empty hooks': (Hooks(), {}),
+        'span exporter': (SpanExporter(export=lambda request: None), {}),
+        'span exporter json': (SpanExporter(io.StringIO()), {}),
+    }
+    times = measure(cases, number=number, repeat=repeat)
+    # the minimum is the least affected by noise, the spread shows how much there is
+    print(f'{"case":<20} {"min (us)":>10} {"median (us)":>12} {"max (us)":>10}')
+    for name, ts in times.items():
+        print(f'{name:<20} {min(ts):>10.2f} {statistics.median(ts):>12.2f} {max(ts):>10.2f}')
+    fast, slow = times['no hooks'], times['noop callback']
+    print(f'no hooks is faster than a noop callback in {sum(f < s for f, s in zip(fast, slow))}/{repeat} rounds')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Benchmark repeated calls of a slipform graph with the same placeholder
+values, with and without memoization.
+
+    PYTHONPATH=. python benchmarks/bench_memoize.py
+"""
+
+import timeit
+
+import numpy as np
+import pythonflow as pf  # used by the generated graphs
+from slipform import slipform, memoize
+
+
+@slipform
+def graph(x, scale, offset):
+    a = x * scale
+    b = a + offset
+    c = b * b
+    d = c.sum()
+
+
+def main(number=2000):
+    x = np.random.rand(1000)
+    cases = {
+        'graph': graph,
+        'memoize content': memoize(graph),
+        'memoize identity': memoize(graph, array_hash='identity'),
+    }
+    print(f'{"case":<18} {"time/call (us)":>16}')
+    for name, fn in cases.items():
+        t = timeit.timeit(lambda: fn('d', x=x, scale=2.0, offset=1.0), number=number) / number
+        print(f'{name:<18} {t * 1e6:>16.2f}')
+
+
+if __name__ == '__main__':
+    main()
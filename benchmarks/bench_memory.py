@@ -0,0 +1,64 @@
+"""
+Benchmark peak memory when evaluating deep graphs of large arrays.
+
+pythonflow keeps every intermediate value alive until the call returns,
+slipform releases them after their last use, and can optionally reuse
+the buffers of intermediate values for numpy binary operations.
+
+    PYTHONPATH=. python benchmarks/bench_memory.py
+"""
+
+import time
+import tracemalloc
+
+import numpy as np
+import pythonflow as pf  # used by the generated graphs
+from slipform import slipform
+
+
+def deep(x):
+    a = x * 2
+    b = a + 1
+    c = b * 3
+    d = c - 4
+    e = d / 2
+    f = e + 3
+    g = f * 5
+    h = g - 1
+    i = h / 4
+    j = i + x
+
+
+graphs = {
+    'slipform': slipform(deep),
+    'slipform inplace': slipform(deep, inplace=True),
+}
+
+
+def measure(fn, number=5):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    t = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return peak, (time.perf_counter() - t) / number
+
+
+def main(size=1_000_000):
+    x = np.random.rand(size)
+    cases = {
+        # pythonflow evaluation of the same graph, keeping all intermediate values
+        'pythonflow': lambda: pf.Graph.apply(graphs['slipform'], 'j', x=x),
+        **{name: (lambda graph=graph: graph('j', x=x)) for name, graph in graphs.items()},
+    }
+    print(f'{"case":<18} {"peak (MB)":>10} {"time/call (ms)":>16}')
+    for name, fn in cases.items():
+        peak, t = measure(fn)
+        print(f'{name:<18} {peak / 2**20:>10.1f} {t * 1000:>16.2f}')
+
+
+if __name__ == '__main__':
+    main()
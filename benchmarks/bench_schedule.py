@@ -0,0 +1,58 @@
+"""
+Benchmark the concurrent evaluation of ``io`` and ``cpu_heavy`` operations.
+
+Independent ``io`` calls should overlap in threads, and ``cpu_heavy``
+calls should run in parallel in processes, instead of one after the other.
+
+    PYTHONPATH=. python benchmarks/bench_schedule.py
+"""
+
+import time
+
+import pythonflow as pf  # used by the generated graphs
+from slipform import slipform, io, cpu_heavy, Scheduler
+
+
+@io
+def fetch(x):
+    time.sleep(0.02)
+    return x
+
+
+@cpu_heavy
+def expensive(x):
+    total = 0
+    for i in range(500_000):
+        total += i % 7
+    return x + total
+
+
+def graph(x):
+    a = fetch(x)
+    b = fetch(x + 1)
+    c = fetch(x + 2)
+    d = fetch(x + 3)
+    e = expensive(a)
+    f = expensive(b)
+    g = expensive(c)
+    h = expensive(d)
+    total = e + f + g + h
+
+
+def main(number=10):
+    with Scheduler(max_workers=4) as scheduler:
+        cases = {
+            'sequential': slipform(scheduler=Scheduler(io=False, cpu_heavy=False))(graph),
+            'scheduled':  slipform(scheduler=scheduler)(graph),
+        }
+        print(f'{"case":<12} {"time/call (ms)":>16}')
+        for name, func in cases.items():
+            func('total', x=0)  # start the workers
+            start = time.perf_counter()
+            for i in range(number):
+                func('total', x=i)
+            print(f'{name:<12} {(time.perf_counter() - start) / number * 1000:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark serving a CPU bound slipform graph from a process pool.
+
+Threads are limited to a single core by the GIL, while the process
+pool should scale with the number of workers up to the number of cores.
+
+    PYTHONPATH=. python benchmarks/bench_serve.py
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pythonflow as pf  # used by the generated graphs
+from slipform import slipform, cpu_heavy, Scheduler
+from slipform.serve import ProcessPoolGraphRunner
+
+
+@cpu_heavy
+def expensive(x):
+    total = 0
+    for i in range(200_000):
+        total += i % 7
+    return x + total
+
+
+# evaluated by the calling thread, like the workers of the runner
+@slipform(scheduler=Scheduler(cpu_heavy=False))
+def graph(x):
+    y = expensive(x)
+
+
+def threads_throughput(workers, calls):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda i: graph('y', x=i), range(calls)))
+    return calls / (time.perf_counter() - start)
+
+
+def processes_throughput(workers, calls):
+    with ProcessPoolGraphRunner(graph, max_workers=workers) as runner:
+        runner.submit('y', x=0).result()  # wait for the workers to start
+        start = time.perf_counter()
+        futures = [runner.submit('y', x=i) for i in range(calls)]
+        for future in futures:
+            future.result()
+        return calls / (time.perf_counter() - start)
+
+
+def main(calls_per_worker=20):
+    print(f'{"workers":>8} {"threads calls/s":>16} {"processes calls/s":>18}')
+    for workers in (1, 2, 4, 8, 16, 32):
+        if workers > (os.cpu_count() or 1) * 2:
+            break
+        calls = workers * calls_per_worker
+        print(f'{workers:>8} {threads_throughput(workers, calls):>16.1f} {processes_throughput(workers, calls):>18.1f}')
+
+
+if __name__ == '__main__':
+    main()
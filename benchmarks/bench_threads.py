@@ -0,0 +1,56 @@
+"""
+Benchmark evaluating a single slipform graph from many threads.
+
+Graphs are frozen once built and each thread reuses its own scratch
+context, so throughput of I/O bound graphs scales with the number of
+threads. Pure python operations are still limited by the GIL.
+
+    PYTHONPATH=. python benchmarks/bench_threads.py
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pythonflow as pf  # used by the generated graphs
+from slipform import slipform, io
+
+
+@io
+def fetch(x):
+    time.sleep(0.001)
+    return x
+
+
+@slipform
+def io_graph(x):
+    a = fetch(x)
+    b = a * 2 + 1
+
+
+@slipform
+def cpu_graph(x):
+    a = x * 2
+    b = a + 1
+    c = b * b - a
+
+
+def throughput(graph, fetches, threads, calls):
+    def worker(i):
+        for j in range(calls):
+            graph(fetches, x=j)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, range(threads)))
+    return threads * calls / (time.perf_counter() - start)
+
+
+def main(calls=200):
+    print(f'{"threads":>8} {"io calls/s":>14} {"cpu calls/s":>14}')
+    for threads in (1, 2, 4, 8, 16, 32, 64):
+        io_rate = throughput(io_graph, 'b', threads, calls)
+        cpu_rate = throughput(cpu_graph, 'c', threads, calls * 10)
+        print(f'{threads:>8} {io_rate:>14.0f} {cpu_rate:>14.0f}')
+
+
+if __name__ == '__main__':
+    main()
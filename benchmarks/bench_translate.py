@@ -0,0 +1,49 @@
+"""
+Benchmark the import time of slipform and the time
+taken to translate a function into a graph.
+
+    PYTHONPATH=. python benchmarks/bench_translate.py
+"""
+
+import copy
+import subprocess
+import sys
+import timeit
+
+import pythonflow as pf
+from slipform import slipform
+from slipform._ast_utils import ast_decompile_func
+from slipform._translate import SlipformTransformer
+
+
+def vae(x, x_target, encoder, decoder, mse):
+    import torch
+    import torch.nn.functional as F
+    z_params = encoder(x)
+    z = z_params.z_mean
+    x_pre_recon = decoder(z)
+    x_recon = x_pre_recon if mse else torch.sigmoid(x_pre_recon)
+    loss = F.mse_loss(x_recon, x_target) if mse else F.binary_cross_entropy_with_logits(x_pre_recon, x_target)
+
+
+def import_time_us(module='slipform', repeats=5):
+    # cumulative import time reported by ``python -X importtime``
+    times = []
+    for _ in range(repeats):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True)
+        lines = [line for line in proc.stderr.splitlines() if line.rstrip().endswith(f'| {module}')]
+        times.append(int(lines[-1].split('|')[1]))
+    return min(times)
+
+
+def main(number=200):
+    print(f'{"import slipform (us)":<28} {import_time_us():>10}')
+    node = ast_decompile_func(vae)
+    t = timeit.timeit(lambda: SlipformTransformer().visit(copy.deepcopy(node)), number=number) / number
+    print(f'{"transform vae ast (ms)":<28} {t * 1000:>10.4f}')
+    t = timeit.timeit(lambda: slipform(vae), number=number) / number
+    print(f'{"translate vae (ms)":<28} {t * 1000:>10.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -7,37 +7,88 @@ https://github.com/nmichlo/slipform
 __version__ = "0.0.1-alpha2"
 
 
-from pythonflow import Graph as _Graph
-from pythonflow import constant as _constant
-from slipform._ast_utils import ast_rewrite_function as _ast_rewrite_function, ast_decompile_func, ast_compile_func
-from slipform._translate import SlipformTransformer as _SlipformTransformer
+# pythonflow and the translator are only imported on first use, so
+# that ``import slipform`` stays cheap, see ``__getattr__`` below.
 
 
 ORIG_FN_NAME = '_orig_fn'
 
 
-def slipform(*args, node_transformer=None, add_scope=None, debug=False, **kwargs):
+def slipform(*args, node_transformer=None, add_scope=None, debug=False, optimize=None, inplace=False, scheduler=None, **kwargs):
     assert 0 <= len(args) <= 1, 'no args are supported yet'
     assert not kwargs, 'no kwargs are supported yet'
+    # strip assertions like ``python -O`` does
+    if optimize is None:
+        optimize = not __debug__
 
-    def _slipform_wrapper(func) -> _Graph:
+    def _slipform_wrapper(func) -> 'SlipformGraph':
+        from slipform._ast_utils import ast_rewrite_function as _ast_rewrite_function
+        from slipform._graph import build_graph as _build_graph
+        from slipform._translate import SlipformTransformer as _SlipformTransformer
+        from slipform import _runtime
         # transform the function into its pythonflow equivalent
-        transformer = node_transformer if node_transformer is not None else _SlipformTransformer()
-        graph_generator = _ast_rewrite_function(func, node_transformer=transformer, add_scope=add_scope, debug=debug)
-        # generate the dataflow graph using the transformed function
-        with _Graph() as graph:
-            graph_generator()
-            # make sure we can access the original function
-            # insert the function both as an operation on the graph
-            assert ORIG_FN_NAME not in graph.operations, f'{ORIG_FN_NAME} operation is reserved'
-            _constant(func, name=ORIG_FN_NAME)
-            # insert the function both as an attribute of the graph
-            assert not hasattr(graph, ORIG_FN_NAME), f'{ORIG_FN_NAME} attribute is reserved'
-            setattr(graph, ORIG_FN_NAME, func)
-        return graph
+        transformer = node_transformer if node_transformer is not None else _SlipformTransformer(optimize=optimize)
+        scope = {_runtime.RUNTIME_NAME: _runtime, **(add_scope if add_scope is not None else {})}
+        graph_generator = None
+        # use the builder compiled ahead-of-time by ``python -m slipform compile``
+        if (node_transformer is None) and not debug:
+            from slipform._ast_utils import FunctionScope as _FunctionScope
+            from slipform._cache import load_builder as _load_builder
+            graph_generator = _load_builder(func, optimize, _FunctionScope.from_function(func, add_scope=scope))
+        if graph_generator is None:
+            graph_generator = _ast_rewrite_function(func, node_transformer=transformer, add_scope=scope, debug=debug)
+        # generate the dataflow graph using the transformed function,
+        # the graph is also accessible via ``graph._orig_fn``
+        return _build_graph(graph_generator, orig_fn=func, add_scope=add_scope, inplace=inplace, scheduler=scheduler)
 
     if args:
         return _slipform_wrapper(args[0])
     else:
         return _slipform_wrapper
 
+
+# ========================================================================= #
+# Lazy Imports                                                              #
+# ========================================================================= #
+
+
+_LAZY_ATTRS = {
+    'ast_decompile_func': 'slipform._ast_utils',
+    'ast_compile_func': 'slipform._ast_utils',
+    'pure': 'slipform._runtime',
+    'io': 'slipform._runtime',
+    'cpu_heavy': 'slipform._runtime',
+    'stochastic': 'slipform._runtime',
+    'MarkedFunction': 'slipform._runtime',
+    'inline': 'slipform._runtime',
+    'Spec': 'slipform._runtime',
+    'get_placeholder_specs': 'slipform._runtime',
+    'SlipformGraph': 'slipform._graph',
+    'FrozenGraphError': 'slipform._graph',
+    'fuse': 'slipform._graph',
+    'Scheduler': 'slipform._execute',
+    'SlipformSyntaxError': 'slipform._translate',
+    'Profiler': 'slipform._explain',
+    'memoize': 'slipform._memoize',
+    'MemoizedGraph': 'slipform._memoize',
+    'Hooks': 'slipform._trace',
+    'OperationInfo': 'slipform._trace',
+    'SpanExporter': 'slipform._trace',
+    'seeded': 'slipform._replay',
+    'record': 'slipform._replay',
+    'replay': 'slipform._replay',
+    'Trace': 'slipform._replay',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(__import__(_LAZY_ATTRS[name], fromlist=[name]), name)
+    # cache the attribute so that __getattr__ is not called again
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted({*globals(), *_LAZY_ATTRS})
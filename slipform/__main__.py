@@ -0,0 +1,73 @@
+"""
+Command line interface of slipform.
+
+    python -m slipform compile mypkg/ [other.py ...] [--jobs N]
+
+Translates all functions decorated with ``@slipform`` or ``@inline`` in
+the given modules and packages ahead-of-time, see ``slipform._cache``.
+"""
+
+import argparse
+import concurrent.futures
+import os
+import sys
+
+from slipform._cache import compile_file
+
+
+def iter_modules(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != '__pycache__')
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    yield os.path.join(root, name)
+
+
+def _mentions_slipform(path):
+    # cheap check before parsing the module
+    with open(path, 'rb') as f:
+        return b'slipform' in f.read()
+
+
+def compile_paths(paths, jobs=None, verbose=True):
+    modules = [path for path in iter_modules(paths) if _mentions_slipform(path)]
+    compiled, errors = 0, []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(compile_file, path) for path in modules]
+        for path, future in zip(modules, futures):
+            # failures of one module do not stop the others
+            try:
+                count, errs = future.result()
+            except Exception as e:  # pylint: disable=W0703
+                count, errs = 0, [f'{os.path.abspath(path)}: {type(e).__name__}: {e}']
+            compiled += count
+            errors.extend(errs)
+            if verbose and count:
+                print(f'compiled {count} function(s) in {path}')
+    for error in errors:
+        print(error, file=sys.stderr)
+    if verbose:
+        print(f'compiled {compiled} slipform function(s) in {len(modules)} module(s), {len(errors)} error(s)')
+    return compiled, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m slipform', description='slipform command line tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    compile_parser = commands.add_parser('compile', help='translate all slipform functions in modules or packages ahead-of-time')
+    compile_parser.add_argument('paths', nargs='+', help='python files or directories')
+    compile_parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes, defaults to the number of cpus')
+    compile_parser.add_argument('-q', '--quiet', action='store_true', help='only print errors')
+    args = parser.parse_args(argv)
+    if args.command == 'compile':
+        _, errors = compile_paths(args.paths, jobs=args.jobs, verbose=not args.quiet)
+        return 1 if errors else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,12 +14,12 @@ def is_comment_line(line):
     line = line.strip()
     return not line or line.startswith('#')
 
-def inspect_get_source(func, unindent=True, strip_decorators=True):
-    lines, _ = inspect.getsourcelines(func)
+def format_source_lines(lines, unindent=True, strip_decorators=True):
     if unindent:
         indents = min(len(line) - len(line.lstrip()) for line in lines if not is_comment_line(line))
         # this is a bit hacky, should modify indents of comments
-        lines = [line[indents:] for line in lines if not is_comment_line(line)]
+        # comments are kept as empty lines so that line numbers match the original source
+        lines = ['\n' if is_comment_line(line) else line[indents:] for line in lines]
     if strip_decorators:
         i = 0
         while lines[i].lstrip().startswith('@'):
@@ -28,20 +28,44 @@ def inspect_get_source(func, unindent=True, strip_decorators=True):
     return ''.join(lines)
 
 
-def ast_decompile_func(func, unindent=True, strip_decorators=True) -> ast.Module:
-    source = inspect_get_source(func, unindent=unindent, strip_decorators=strip_decorators)
-    ast_module = ast.parse(source)
-    ast_assert_single_func(ast_module)
+def inspect_get_source(func, unindent=True, strip_decorators=True):
+    lines, _ = inspect.getsourcelines(func)
+    return format_source_lines(lines, unindent=unindent, strip_decorators=strip_decorators)
+
+
+def ast_decompile_lines(lines, lineno, unindent=True, strip_decorators=True) -> ast.Module:
+    """
+    Parse the source lines of a function, as returned by ``inspect.getsourcelines``,
+    with the locations of the nodes matching those of the original file.
+    """
+    # decorators are removed from the AST instead of the source, so that
+    # line numbers of the nodes correspond to those of the original file
+    ast_module = ast.parse(format_source_lines(lines, unindent=unindent, strip_decorators=False))
+    if strip_decorators:
+        ast_assert_single_func(ast_module).decorator_list = []
+    ast.increment_lineno(ast_module, max(lineno - 1, 0))
+    # columns also correspond to the original, indented source
+    if unindent:
+        indents = min(len(line) - len(line.lstrip()) for line in lines if not is_comment_line(line))
+        for node in ast.walk(ast_module):
+            for attr in ('col_offset', 'end_col_offset'):
+                if getattr(node, attr, None) is not None:
+                    setattr(node, attr, getattr(node, attr) + indents)
     return ast_module
 
 
-def ast_compile_func(ast_module, scope=None):
+def ast_decompile_func(func, unindent=True, strip_decorators=True) -> ast.Module:
+    lines, lineno = inspect.getsourcelines(func)
+    return ast_decompile_lines(lines, lineno, unindent=unindent, strip_decorators=strip_decorators)
+
+
+def ast_compile_func(ast_module, scope=None, filename='<string>'):
     if scope is None:
         scope = {}
     # Compile the new method in the old methods scope. If we don't change the
     # name, this actually overrides the old function with the new one
     try:
-        code = compile(ast_module, '<string>', 'exec')
+        code = compile(ast_module, filename, 'exec')
     except Exception as e:
         raise RuntimeError(f'Could not compile transformed node: {ast_module}')
     exec(code, scope)
@@ -50,10 +74,58 @@ def ast_compile_func(ast_module, scope=None):
     return scope[out_func.name]
 
 
+class FunctionScope(dict):
+    """
+    Globals of a translated function. Names that are not assigned by the
+    translated code itself are looked up in the closure of the original
+    function, then in the added names and finally in the globals of its
+    module, none of which are copied. Closure cells are read when the
+    name is looked up, so later assignments in the enclosing function
+    are seen like in python.
+    """
+
+    def __init__(self, globals, add_scope=None, closure=None):  # pylint: disable=W0622
+        super().__init__()
+        self.globals = globals
+        self.add_scope = {} if (add_scope is None) else add_scope
+        self.closure = {} if (closure is None) else closure
+
+    @classmethod
+    def from_function(cls, func, add_scope=None) -> 'FunctionScope':
+        closure = dict(zip(func.__code__.co_freevars, func.__closure__ or ()))
+        return cls(func.__globals__, add_scope=add_scope, closure=closure)
+
+    def __missing__(self, key):
+        cell = self.closure.get(key)
+        if cell is not None:
+            try:
+                return cell.cell_contents
+            except ValueError:
+                pass
+        if key in self.add_scope:
+            return self.add_scope[key]
+        # raises a KeyError, so that builtins are looked up next
+        return self.globals[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
 def ast_rewrite_function(func, node_transformer: Optional[ast.NodeTransformer], scope=None, add_scope=None, debug=False, unindent=True, strip_decorators=True):
     if scope is None:
-        scope = func.__globals__
-    if add_scope is not None:
+        # free variables are resolved without copying the globals of the module
+        scope = FunctionScope.from_function(func, add_scope=add_scope)
+    elif add_scope is not None:
         scope = scope.copy()
         scope.update(add_scope)
     # generate AST for function
@@ -62,10 +134,24 @@ def ast_rewrite_function(func, node_transformer: Optional[ast.NodeTransformer],
     out_node = node_transformer.visit(in_node)
     ast.fix_missing_locations(out_node)
     if debug:
-        import astunparse
-        print('='*100, astunparse.unparse(out_node), '='*100, sep='\n')
-    # compile and return the function
-    return ast_compile_func(out_node, scope=scope)
+        print('='*100, ast.unparse(out_node), '='*100, sep='\n')
+    # compile and return the function, tracebacks and the
+    # stacks of operations then point to the original source
+    return ast_compile_func(out_node, scope=scope, filename=inspect.getsourcefile(func) or '<string>')
+
+
+def ast_parse_unlocated(source, mode='exec'):
+    """
+    Parse generated source without line numbers, so that the nodes
+    take the location of the original code they are inserted into
+    once ``ast.fix_missing_locations`` or ``ast.copy_location`` is used.
+    """
+    module = ast.parse(source, mode=mode)
+    for node in ast.walk(module):
+        for attr in ('lineno', 'col_offset', 'end_lineno', 'end_col_offset'):
+            if hasattr(node, attr):
+                delattr(node, attr)
+    return module
 
 
 def ast_dfs_walk(node):
@@ -0,0 +1,245 @@
+"""
+Ahead-of-time translation of slipform functions.
+
+``python -m slipform compile mypkg/`` finds the functions decorated with
+``@slipform`` or ``@inline`` in the modules of a package without importing
+them, translates them, and writes the compiled builders to a cache file in
+the ``__pycache__`` directory next to each module:
+
+    mypkg/__pycache__/module.cpython-311.slipform
+
+At runtime ``@slipform`` loads the compiled builder from the cache instead
+of translating the function again, if the source of the function, its
+position in the file, the translation options and the sources of slipform's
+translator are unchanged.
+"""
+
+import ast
+import functools
+import hashlib
+import importlib.util
+import inspect
+import marshal
+import os
+import sys
+import threading
+import tokenize
+
+from slipform import __version__
+from slipform._ast_utils import ast_decompile_lines
+
+
+CACHE_SUFFIX = '.slipform'
+
+
+# ========================================================================= #
+# Keys                                                                      #
+# ========================================================================= #
+
+
+def get_cache_path(filename):
+    head, tail = os.path.split(filename)
+    stem = os.path.splitext(tail)[0]
+    return os.path.join(head, '__pycache__', f'{stem}.{sys.implementation.cache_tag}{CACHE_SUFFIX}')
+
+
+# modules whose changes affect the translated code
+_TRANSLATOR_MODULES = ('slipform._ast_utils', 'slipform._translate', 'slipform._runtime')
+
+
+@functools.lru_cache(maxsize=None)
+def get_translator_digest():
+    """
+    Hash of the modules that translate functions, so that compiled builders
+    are invalidated when slipform changes, even without a version bump.
+    """
+    h = hashlib.sha256(__version__.encode())
+    for name in _TRANSLATOR_MODULES:
+        # found without importing, ``_translate`` is slow to import
+        spec = importlib.util.find_spec(name)
+        source = spec.loader.get_source(name)
+        # installs without sources are hashed by their code instead
+        h.update(source.encode() if (source is not None) else marshal.dumps(spec.loader.get_code(name)))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def get_key(filename, lines, lineno, optimize):
+    """
+    Hash of everything that the translated code depends on.
+    """
+    h = hashlib.sha256()
+    for part in (get_translator_digest(), os.path.abspath(filename), str(lineno), str(bool(optimize)), *lines):
+        h.update(part.encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def translate_lines(lines, lineno, filename, optimize=False):
+    """
+    Translate the source lines of a function, returning its name
+    and the code of the module that defines the builder.
+    """
+    from slipform._translate import SlipformTransformer
+    node = SlipformTransformer(optimize=optimize).visit(ast_decompile_lines(lines, lineno))
+    ast.fix_missing_locations(node)
+    return node.body[0].name, compile(node, filename, 'exec')
+
+
+# ========================================================================= #
+# Loading                                                                   #
+# ========================================================================= #
+
+
+_LOADED = {}
+_LOADED_LOCK = threading.Lock()
+
+
+def _load_entries(path):
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    with _LOADED_LOCK:
+        loaded = _LOADED.get(path)
+        if (loaded is None) or (loaded[0] != mtime):
+            try:
+                with open(path, 'rb') as f:
+                    entries = marshal.load(f)
+            except (OSError, EOFError, ValueError, TypeError):
+                entries = {}
+            _LOADED[path] = loaded = (mtime, entries if isinstance(entries, dict) else {})
+    return loaded[1]
+
+
+def load_builder(func, optimize, scope):
+    """
+    Get the compiled builder of a function from its cache file,
+    or ``None`` if the function was not compiled ahead-of-time.
+    """
+    try:
+        filename = inspect.getsourcefile(func)
+    except TypeError:
+        return None
+    if filename is None:
+        return None
+    entries = _load_entries(get_cache_path(filename))
+    if not entries:
+        return None
+    try:
+        lines, lineno = inspect.getsourcelines(func)
+    except OSError:
+        return None
+    entry = entries.get(get_key(filename, lines, lineno, optimize))
+    if entry is None:
+        return None
+    name, code = entry
+    exec(code, scope)  # pylint: disable=W0122
+    return scope[name]
+
+
+# ========================================================================= #
+# Compiling                                                                 #
+# ========================================================================= #
+
+
+def _get_decorator_names(module):
+    # names that refer to the slipform module, or the decorators themselves
+    modules, decorators = set(), set()
+    for node in ast.walk(module):
+        if isinstance(node, ast.Import):
+            modules.update(alias.asname or alias.name for alias in node.names if alias.name == 'slipform')
+        elif isinstance(node, ast.ImportFrom) and (node.module == 'slipform') and not node.level:
+            decorators.update(alias.asname or alias.name for alias in node.names if alias.name in ('slipform', 'inline'))
+    return modules, decorators
+
+
+def _get_options(decorator, modules, decorators):
+    """
+    Get the translation options of a decorator, ``None`` if it is not a
+    slipform decorator or if the options cannot be determined statically.
+    """
+    call = decorator if isinstance(decorator, ast.Call) else None
+    target = decorator.func if (call is not None) else decorator
+    if isinstance(target, ast.Name):
+        matches = target.id in decorators
+    elif isinstance(target, ast.Attribute) and isinstance(target.value, ast.Name):
+        matches = (target.value.id in modules) and (target.attr in ('slipform', 'inline'))
+    else:
+        matches = False
+    if not matches:
+        return None
+    options = {}
+    for keyword in (call.keywords if (call is not None) else ()):
+        if keyword.arg == 'optimize':
+            if not isinstance(keyword.value, ast.Constant):
+                return None
+            options['optimize'] = keyword.value.value
+        elif keyword.arg == 'node_transformer':
+            # custom translations are never cached
+            return None
+    return options
+
+
+def find_functions(source):
+    """
+    Statically find the slipform functions in the source of a module, yields
+    the source lines and line number of each, like ``inspect.getsourcelines``,
+    and their translation options.
+    """
+    module = ast.parse(source)
+    modules, decorators = _get_decorator_names(module)
+    if not (modules or decorators):
+        return
+    all_lines = source.splitlines(keepends=True)
+    for node in ast.walk(module):
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        for decorator in node.decorator_list:
+            options = _get_options(decorator, modules, decorators)
+            if options is not None:
+                lineno = node.decorator_list[0].lineno
+                yield inspect.getblock(all_lines[lineno - 1:]), lineno, options
+                break
+
+
+def compile_file(filename):
+    """
+    Translate all slipform functions in a module and write them to its cache file.
+    Returns the number of compiled functions and the errors of those that failed,
+    or of the module itself if it cannot be read or parsed.
+    """
+    # code objects refer to the file by the same name as ``inspect.getsourcefile``
+    filename = os.path.abspath(filename)
+    try:
+        # same as linecache, which is used by ``inspect.getsourcelines``
+        with tokenize.open(filename) as f:
+            source = f.read()
+        functions = list(find_functions(source))
+    except SyntaxError as e:
+        return 0, [f'{filename}:{e.lineno}: {type(e).__name__}: {e.msg}']
+    except (OSError, ValueError) as e:
+        # ValueError includes undecodable sources
+        return 0, [f'{filename}: {type(e).__name__}: {e}']
+    entries, errors, compiled = {}, [], 0
+    for lines, lineno, options in functions:
+        # optimized variants are compiled too, unless the decorator decides
+        variants = [options['optimize']] if ('optimize' in options) else [False, True]
+        try:
+            for optimize in variants:
+                entries[get_key(filename, lines, lineno, optimize)] = translate_lines(lines, lineno, filename, optimize=optimize)
+        except Exception as e:  # pylint: disable=W0703
+            errors.append(f'{filename}:{lineno}: {type(e).__name__}: {e}')
+        else:
+            compiled += 1
+    path = get_cache_path(filename)
+    if entries:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write atomically, processes importing the module may read it concurrently
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            marshal.dump(entries, f)
+        os.replace(tmp, path)
+    elif os.path.exists(path):
+        os.remove(path)
+    return compiled, errors
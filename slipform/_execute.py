@@ -0,0 +1,521 @@
+"""
+Evaluation of slipform graphs.
+
+Unlike pythonflow, which keeps every intermediate value in the context
+until the call returns, values are dropped as soon as the last operation
+that references them has been evaluated. The number of references to each
+operation is computed once from the static topology of the graph.
+
+Calls to ``io`` and ``cpu_heavy`` functions that are always evaluated
+are started before anything else, as soon as the calls they depend on
+are done, and run concurrently in the executors of a ``Scheduler``.
+"""
+
+import concurrent.futures
+import operator
+import pickle
+import sys
+import threading
+import traceback
+
+import pythonflow as pf
+
+
+# ========================================================================= #
+# Plan                                                                      #
+# ========================================================================= #
+
+
+def iter_refs(value):
+    """
+    Yield the operations referenced by an argument of an operation,
+    including those nested in tuples, lists, dicts and slices.
+    """
+    if isinstance(value, pf.Operation):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            yield from iter_refs(v)
+    elif isinstance(value, dict):
+        for k, v in value.items():
+            yield from iter_refs(k)
+            yield from iter_refs(v)
+    elif isinstance(value, slice):
+        yield from iter_refs((value.start, value.stop, value.step))
+
+
+def get_refs(operation) -> tuple:
+    return (*operation.dependencies, *iter_refs(operation.args), *iter_refs(operation.kwargs))
+
+
+def get_lazy_refs(op):
+    """
+    Split the references of an operation into those that are always
+    evaluated and those that are only evaluated by lazy operations.
+    """
+    if type(op) is pf.conditional:
+        predicate, x, y = op.args
+        return (*op.dependencies, *iter_refs(predicate)), (*iter_refs(x), *iter_refs(y))
+    if type(op) is pf.try_:
+        operation, except_, finally_ = op.args
+        return (*op.dependencies, *iter_refs(operation), *iter_refs(finally_)), tuple(iter_refs(except_))
+    return get_refs(op), ()
+
+
+class Plan:
+    """
+    Static references between the operations needed to compute a set of
+    fetches. Lazy operations count the references of all their branches,
+    values referenced by branches that are not taken are kept until the
+    end of the evaluation.
+    """
+
+    __slots__ = ('refs', 'uses', 'schedule')
+
+    def __init__(self, fetches):
+        self.refs = {}
+        # fetches are never released
+        self.uses = {fetch: 1 for fetch in fetches}
+        stack = list(fetches)
+        while stack:
+            op = stack.pop()
+            if op in self.refs:
+                continue
+            self.refs[op] = refs = get_refs(op)
+            for ref in refs:
+                self.uses[ref] = self.uses.get(ref, 0) + 1
+                stack.append(ref)
+        # concurrent operations that are always evaluated
+        self.schedule = None
+        if any(map(is_concurrent, self.refs)):
+            schedule = Schedule(fetches, self.refs)
+            self.schedule = schedule if schedule.order else None
+
+
+# kinds of operations that run concurrently, see ``slipform._runtime``
+CONCURRENT_KINDS = ('io', 'cpu_heavy')
+
+
+def is_concurrent(op) -> bool:
+    return isinstance(op, pf.func_op) and (vars(op).get('kind') in CONCURRENT_KINDS)
+
+
+class Schedule:
+    """
+    Concurrent operations of a plan that are always evaluated, ie. not
+    only by the branches of lazy operations, in topological order. Each
+    of them waits for the concurrent operations it depends on.
+    """
+
+    __slots__ = ('fetches', 'strict', 'order', 'waits', 'picklable')
+
+    def __init__(self, fetches, refs):
+        self.fetches = tuple(fetches)
+        self.strict = {op: get_lazy_refs(op)[0] for op in refs}
+        # operations in topological order
+        ops, visited, stack = [], set(), [(fetch, False) for fetch in self.fetches]
+        while stack:
+            op, expanded = stack.pop()
+            if expanded:
+                ops.append(op)
+            elif op not in visited:
+                visited.add(op)
+                stack.append((op, True))
+                stack.extend((ref, False) for ref in refs[op])
+        needed = self.get_needed(())
+        self.order = tuple(op for op in ops if (op in needed) and is_concurrent(op))
+        # nearest concurrent operations that each operation depends on
+        waits = {}
+        for op in ops:
+            waits[op] = frozenset().union(*({ref} if is_concurrent(ref) else waits[ref] for ref in refs[op]))
+        self.waits = {op: waits[op] for op in self.order}
+        # operations that can run in other processes
+        self.picklable = frozenset(op for op in self.order if (op.kind == 'cpu_heavy') and _can_pickle(op))
+
+    def get_needed(self, provided) -> set:
+        """
+        Operations that are always evaluated, given values for the provided
+        operations, which only need their dependencies to be evaluated.
+        """
+        needed, stack = set(), list(self.fetches)
+        while stack:
+            op = stack.pop()
+            if op not in needed:
+                needed.add(op)
+                stack.extend(op.dependencies if (op in provided) else self.strict[op])
+        return needed
+
+
+# ========================================================================= #
+# Scheduler                                                                 #
+# ========================================================================= #
+
+
+# threads and processes of schedulers evaluate nested graphs without scheduling
+_worker = threading.local()
+
+
+def _init_worker():
+    _worker.active = True
+
+
+# slipform operations are given the positional and keyword arguments of their target
+def _call(target, args, kwargs):
+    return target(*args, **kwargs)
+
+
+def _can_pickle(op):
+    # only the target and the arguments known when the graph is built are checked
+    args, kwargs = op.args
+    static = [value for value in (*args, *kwargs.values()) if not any(True for _ in iter_refs(value))]
+    try:
+        pickle.dumps((op.target, static))
+    except Exception:  # pylint: disable=W0703
+        return False
+    return True
+
+
+class Scheduler:
+    """
+    Executors of the ``io`` and ``cpu_heavy`` operations of graphs.
+
+    ``io`` operations run in a pool of threads and ``cpu_heavy`` operations
+    in a pool of processes, both created on first use. Either can be given
+    an executor instead, or ``False`` to evaluate them in the calling thread.
+    The functions, arguments and results of ``cpu_heavy`` operations are
+    pickled, those whose function cannot be pickled, eg. closures, run in
+    the executor of ``io`` operations instead.
+
+        @slipform(scheduler=Scheduler(io=ThreadPoolExecutor(64), cpu_heavy=False))
+        def graph(urls):
+            ...
+    """
+
+    def __init__(self, io=True, cpu_heavy=True, *, max_workers=None, mp_context=None):  # pylint: disable=W0621
+        self._executors = {'io': io, 'cpu_heavy': cpu_heavy}
+        self._max_workers = max_workers
+        self._mp_context = mp_context
+        self._owned = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return any(self._executors.values()) and not getattr(_worker, 'active', False)
+
+    def _get_executor(self, kind):
+        executor = self._executors[kind]
+        if executor is not True:
+            return executor or None
+        with self._lock:
+            executor = self._executors[kind]
+            if executor is True:
+                if kind == 'io':
+                    executor = concurrent.futures.ThreadPoolExecutor(self._max_workers, 'slipform-io', initializer=_init_worker)
+                else:
+                    executor = concurrent.futures.ProcessPoolExecutor(self._max_workers, self._mp_context, initializer=_init_worker)
+                self._executors[kind] = executor
+                self._owned.append(executor)
+        return executor
+
+    def submit(self, op, args, kwargs, picklable=False):
+        """
+        Start evaluating an operation given the values of its arguments,
+        returns a future or ``None`` if it is evaluated by the caller.
+        """
+        executor = self._get_executor(op.kind)
+        if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            if picklable:
+                return executor.submit(_call, op.target, *args, **kwargs)
+            executor = self._get_executor('io')
+        if executor is None:
+            return None
+        return executor.submit(op._evaluate, *args, **kwargs)  # pylint: disable=protected-access
+
+    def shutdown(self, wait=True):
+        """
+        Shut down the executors created by the scheduler.
+        """
+        with self._lock:
+            owned, self._owned = self._owned, []
+            for kind, executor in self._executors.items():
+                if executor in owned:
+                    self._executors[kind] = True
+        for executor in owned:
+            executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+def get_default_scheduler() -> Scheduler:
+    """
+    Scheduler of graphs built without one, created on first use.
+    """
+    global _default_scheduler
+    if _default_scheduler is None:
+        with _default_lock:
+            if _default_scheduler is None:
+                _default_scheduler = Scheduler()
+    return _default_scheduler
+
+
+# ========================================================================= #
+# Evaluation                                                                #
+# ========================================================================= #
+
+
+# numpy binary operations that can reuse the buffer of their first argument
+_INPLACE_OPS = {
+    operator.add: operator.iadd,
+    operator.sub: operator.isub,
+    operator.mul: operator.imul,
+    operator.truediv: operator.itruediv,
+    operator.floordiv: operator.ifloordiv,
+    operator.mod: operator.imod,
+    operator.pow: operator.ipow,
+    operator.and_: operator.iand,
+    operator.or_: operator.ior,
+    operator.xor: operator.ixor,
+}
+
+
+def get_result_dtype(func, a, b, np):
+    """
+    Dtype of ``func(a, b)`` on numpy values, the result can only be written
+    into ``a`` if it has the same dtype. True division of integers gives floats.
+    """
+    dtype = np.result_type(a, b)
+    if (func is operator.truediv) and not np.issubdtype(dtype, np.inexact):
+        return np.dtype(np.float64)
+    return dtype
+
+
+def _raise_evaluation_error(operation, ex):
+    # same as ``pf.Operation.evaluate_operation``
+    stack = []
+    interactive = False
+    for frame in reversed(operation._stack):  # pylint: disable=protected-access
+        if 'pythonflow' in frame.filename:
+            continue
+        if interactive and not frame.filename.startswith('<'):
+            break
+        interactive = frame.filename.startswith('<')
+        stack.append(frame)
+    stack = ''.join(traceback.format_list(reversed(stack)))
+    raise ex from pf.EvaluationError('Failed to evaluate operation `%s` defined at:\n\n%s' % (operation, stack))
+
+
+class Evaluation:
+    """
+    State of a single evaluation of a graph.
+
+    Each operation is evaluated at most once, after which the references
+    it holds are released. If ``inplace`` is enabled, numpy binary
+    operations write their result into the buffer of their first argument
+    when nothing else references it anymore.
+
+    Operations are evaluated without any callback, see ``CallbackEvaluation``.
+    """
+
+    __slots__ = ('plan', 'context', 'provided', 'remaining', 'inplace')
+
+    callback = None
+
+    def __init__(self, plan: Plan, context: dict, inplace=False):
+        self.plan = plan
+        self.context = context
+        self.provided = set(context)
+        self.remaining = dict(plan.uses)
+        self.inplace = inplace
+
+    def value(self, value):
+        if isinstance(value, pf.Operation):
+            try:
+                return self.evaluate(value)
+            except Exception as ex:
+                _raise_evaluation_error(value, ex)
+        if isinstance(value, tuple):
+            return tuple(self.value(v) for v in value)
+        if isinstance(value, list):
+            return [self.value(v) for v in value]
+        if isinstance(value, dict):
+            return {self.value(k): self.value(v) for k, v in value.items()}
+        if isinstance(value, slice):
+            return slice(self.value(value.start), self.value(value.stop), self.value(value.step))
+        return value
+
+    def evaluate(self, op):
+        context = self.context
+        if op in context:
+            # pythonflow evaluates dependencies of given values too
+            if op in self.provided:
+                for dep in op.dependencies:
+                    self.evaluate(dep)
+            return context[op]
+        for dep in op.dependencies:
+            self.evaluate(dep)
+        cls = type(op)
+        if cls is pf.conditional:
+            value = self._evaluate_conditional(op)
+        elif cls is pf.try_:
+            value = self._evaluate_try(op)
+        elif cls.evaluate is not pf.Operation.evaluate:
+            # unknown operations with custom evaluation
+            value = op.evaluate(context, self.callback)
+        elif self.inplace and (cls is pf.func_op) and (op.target in _INPLACE_OPS) and (len(op.args) == 2) and not op.kwargs:
+            value = self._evaluate_inplace(op)
+        else:
+            args = [self.value(arg) for arg in op.args]
+            kwargs = {key: self.value(val) for key, val in op.kwargs.items()}
+            value = self._apply(op, op._evaluate, args, kwargs)  # pylint: disable=protected-access
+        self._release(op)
+        return value
+
+    def _apply(self, op, func, args, kwargs):
+        self.context[op] = value = func(*args, **kwargs)
+        return value
+
+    def _release(self, op):
+        remaining, context = self.remaining, self.context
+        for ref in self.plan.refs[op]:
+            remaining[ref] -= 1
+            if not remaining[ref]:
+                context.pop(ref, None)
+
+    def _evaluate_conditional(self, op):
+        predicate, x, y = op.args
+        predicate = self.value(predicate)
+        return self._apply(op, self.value, (x if predicate else y,), {})
+
+    def _evaluate_try(self, op):
+        operation, except_, finally_ = op.args
+        try:
+            self.context[op] = value = self.value(operation)
+            return value
+        except BaseException as ex:  # pylint: disable=W0703
+            for type_, alternative in except_:
+                if isinstance(ex, type_):
+                    self.context[op] = value = self.value(alternative)
+                    return value
+            raise
+        finally:
+            if finally_:
+                self.value(finally_)
+
+    def _evaluate_inplace(self, op):
+        first, second = op.args
+        # the buffer can only be reused if this is the last reference to it
+        reuse = isinstance(first, pf.Operation) and (self.remaining[first] == 1) and (first not in self.provided)
+        a, b = self.value(first), self.value(second)
+        if reuse:
+            self.context.pop(first, None)
+            np = sys.modules.get('numpy')
+            reuse = (np is not None) and isinstance(a, np.ndarray) and (sys.getrefcount(a) <= 2)
+            reuse = reuse and (a.base is None) and a.flags.writeable and (get_result_dtype(op.target, a, b, np) == a.dtype)
+            reuse = reuse and (np.broadcast_shapes(a.shape, np.shape(b)) == a.shape)
+        func = _INPLACE_OPS[op.target] if reuse else op._evaluate  # pylint: disable=protected-access
+        return self._apply(op, func, (a, b), {})
+
+
+class CallbackEvaluation(Evaluation):
+    """
+    Evaluation that calls a pythonflow style ``callback(operation, context)``
+    around each operation, which returns a context manager. Values are stored
+    in the context before the callback exits, like pythonflow.
+
+    This is kept separate from ``Evaluation`` so that graphs called without
+    callbacks or hooks do not pay for them.
+    """
+
+    __slots__ = ('callback',)
+
+    def __init__(self, plan: Plan, context: dict, callback, inplace=False):
+        super().__init__(plan, context, inplace=inplace)
+        self.callback = callback
+
+    def _apply(self, op, func, args, kwargs):
+        with self.callback(op, self.context):
+            self.context[op] = value = func(*args, **kwargs)
+        return value
+
+    def _evaluate_try(self, op):
+        with self.callback(op, self.context):
+            return super()._evaluate_try(op)
+
+
+class _Scheduling:
+    """
+    Start the concurrent operations of the plan before evaluating the
+    fetches. Their arguments are evaluated by the calling thread, and
+    operations waiting for them are started as they become ready.
+    Callbacks are called around waiting for the result of an operation.
+    """
+
+    __slots__ = ()
+
+    def run(self, fetches, scheduler: Scheduler):
+        self.pending = {}
+        try:
+            self._start(scheduler)
+            return tuple(self.value(fetch) for fetch in fetches)
+        finally:
+            # eg. after an error, operations that have not started are dropped
+            for future in self.pending.values():
+                future.cancel()
+
+    def _start(self, scheduler):
+        schedule, context, pending = self.plan.schedule, self.context, self.pending
+        order = schedule.order
+        # operations that are given are not evaluated, nor what only they need
+        if any(self.plan.refs.get(op) for op in self.provided):
+            needed = schedule.get_needed(self.provided)
+            order = [op for op in order if (op in needed) and (op not in context)]
+        waiting = set(order)
+        while order:
+            blocked = []
+            for op in order:
+                if any((dep in waiting) or ((dep in pending) and not pending[dep].done()) for dep in schedule.waits[op]):
+                    blocked.append(op)
+                    continue
+                waiting.discard(op)
+                self._submit(op, scheduler)
+            order = blocked
+            if order:
+                concurrent.futures.wait([future for future in pending.values() if not future.done()], return_when=concurrent.futures.FIRST_COMPLETED)
+
+    def _submit(self, op, scheduler):
+        try:
+            for dep in op.dependencies:
+                self.evaluate(dep)
+            args = [self.value(arg) for arg in op.args]
+            kwargs = {key: self.value(val) for key, val in op.kwargs.items()}
+            future = scheduler.submit(op, args, kwargs, picklable=op in self.plan.schedule.picklable)
+        except Exception as ex:  # pylint: disable=W0703
+            # raised where the operation is needed, eg. inside a ``try_``
+            future = concurrent.futures.Future()
+            future.set_exception(ex)
+        if future is not None:
+            self.pending[op] = future
+
+    def evaluate(self, op):
+        future = self.pending.pop(op, None)
+        if future is None:
+            return super().evaluate(op)
+        value = self._apply(op, future.result, (), {})
+        self._release(op)
+        return value
+
+
+class ScheduledEvaluation(_Scheduling, Evaluation):
+    __slots__ = ('pending',)
+
+
+class ScheduledCallbackEvaluation(_Scheduling, CallbackEvaluation):
+    __slots__ = ('pending',)
@@ -0,0 +1,249 @@
+"""
+Explain the execution plans of slipform graphs.
+
+    profiler = Profiler()
+    graph('loss', x=x, callback=profiler)
+    print(graph.explain('loss', profiler=profiler))
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+import pythonflow as pf
+
+from slipform._execute import get_lazy_refs, iter_refs
+from slipform._graph import is_generated_name
+from slipform._runtime import KIND_PURE, func_op
+
+
+# ========================================================================= #
+# Profiler                                                                  #
+# ========================================================================= #
+
+
+class Profiler(pf.Profiler):
+    """
+    Callback recording the number of evaluations, total time and output
+    size of each operation, accumulated over several calls of a graph.
+    Times of lazy operations include those of the selected branches.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls = {}
+        self.nbytes = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def __call__(self, operation, context):
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        nbytes = get_nbytes(context.get(operation))
+        with self._lock:
+            self.times[operation] = self.times.get(operation, 0) + elapsed
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            self.nbytes[operation] = nbytes
+
+
+def get_nbytes(value):
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    try:
+        return sys.getsizeof(value)
+    except TypeError:
+        return None
+
+
+# ========================================================================= #
+# Plan                                                                      #
+# ========================================================================= #
+
+
+def get_source(graph, op):
+    """
+    Get the ``(filename, lineno, line)`` of the original
+    source that generated the operation, if known.
+    """
+    # operations copied from other graphs, eg. by ``fuse`` or ``specialize``
+    source = getattr(graph, '_sources', {}).get(op)
+    if source is not None:
+        return source
+    code = getattr(graph._builder, '__code__', None)
+    if code is None:
+        return None
+    for frame in reversed(op._stack):  # pylint: disable=protected-access
+        if (frame.filename == code.co_filename) and (frame.name == code.co_name):
+            return frame.filename, frame.lineno, (frame.line or '').strip()
+    return None
+
+
+# ``pf.constant`` is an alias of ``pf.identity``
+_IDENTITY = pf.identity.__wrapped__
+
+
+def is_constant(op):
+    if isinstance(op, pf.lazy_constant):
+        return True
+    return (type(op) is pf.func_op) and (op.target is _IDENTITY) and not any(iter_refs((op.args, op.kwargs)))
+
+
+def _display_name(op):
+    if is_generated_name(op.name):
+        return f'~{op.name[:8]}'
+    return op.name
+
+
+def get_plan_rows(graph, fetches, profiler=None):
+    """
+    Get the operations needed to compute the fetches in the order that
+    they are evaluated, and the edges between them.
+    """
+    fetches, _ = graph.normalize_fetches(fetches)
+    # post-order traversal, references before the operations that use them
+    order, edges, visited = [], [], set()
+    stack = [(fetch, False) for fetch in reversed(fetches)]
+    while stack:
+        op, expanded = stack.pop()
+        if expanded:
+            order.append(op)
+            continue
+        if op in visited:
+            continue
+        visited.add(op)
+        stack.append((op, True))
+        refs, lazy_refs = get_lazy_refs(op)
+        edges.extend((ref, op, False) for ref in refs)
+        edges.extend((ref, op, True) for ref in lazy_refs)
+        stack.extend((ref, False) for ref in reversed((*refs, *lazy_refs)))
+    # operations that are evaluated regardless of the branches taken
+    strict, changed = set(fetches), True
+    while changed:
+        changed = False
+        for ref, op, lazy in edges:
+            if (not lazy) and (op in strict) and (ref not in strict):
+                strict.add(ref)
+                changed = True
+    # generate the rows
+    rows, fetch_ids = [], {id(fetch) for fetch in fetches}
+    for i, op in enumerate(order):
+        flags = []
+        if id(op) in fetch_ids:
+            flags.append('fetch')
+        if op not in strict:
+            flags.append('lazy')
+        if is_constant(op):
+            flags.append('constant')
+        if isinstance(op, func_op) and op.kind is not None:
+            flags.append(op.kind)
+        cache = None
+        if isinstance(op, func_op) and (op.kind == KIND_PURE):
+            flags.append('cached')
+            cache = op._cached_target.cache_info()._asdict()  # pylint: disable=protected-access
+        source = get_source(graph, op)
+        calls = None if (profiler is None) else getattr(profiler, 'calls', {}).get(op, 1 if op in profiler.times else 0)
+        total = None if (profiler is None) else profiler.times.get(op)
+        rows.append(dict(
+            step=i + 1,
+            name=op.name,
+            display_name=_display_name(op),
+            op=type(op).__name__,
+            flags=flags,
+            file=None if (source is None) else source[0],
+            line=None if (source is None) else source[1],
+            source=None if (source is None) else source[2],
+            cache=cache,
+            calls=calls,
+            total_ms=None if (total is None) else total * 1000,
+            mean_ms=None if (total is None) or (not calls) else total * 1000 / calls,
+            nbytes=None if (profiler is None) else getattr(profiler, 'nbytes', {}).get(op),
+        ))
+    names = {op: op.name for op in order}
+    return rows, [(names[ref], names[op], lazy) for ref, op, lazy in edges]
+
+
+# ========================================================================= #
+# Formats                                                                   #
+# ========================================================================= #
+
+
+def _format_text(rows, edges, fetches):
+    columns = [
+        ('#', lambda r: str(r['step'])),
+        ('name', lambda r: r['display_name']),
+        ('op', lambda r: r['op']),
+        ('flags', lambda r: ','.join(r['flags'])),
+        ('line', lambda r: '' if (r['line'] is None) else f"{os.path.basename(r['file'])}:{r['line']}"),
+        ('calls', lambda r: '' if (r['calls'] is None) else str(r['calls'])),
+        ('mean (ms)', lambda r: '' if (r['mean_ms'] is None) else f"{r['mean_ms']:.3f}"),
+        ('total (ms)', lambda r: '' if (r['total_ms'] is None) else f"{r['total_ms']:.3f}"),
+        ('bytes', lambda r: '' if (r['nbytes'] is None) else str(r['nbytes'])),
+        ('source', lambda r: r['source'] or ''),
+    ]
+    # skip profiler columns if there is no profiler
+    columns = [(title, fn) for title, fn in columns if any(fn(r) for r in rows) or title in ('#', 'name', 'op')]
+    table = [[title for title, _ in columns]] + [[fn(r) for _, fn in columns] for r in rows]
+    widths = [max(len(row[i]) for row in table) for i in range(len(columns))]
+    lines = [f'plan for {fetches!r}: {len(rows)} operations']
+    lines.extend('  '.join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip() for row in table)
+    return '\n'.join(lines)
+
+
+def _format_dot(rows, edges, fetches):
+    def quote(s):
+        return '"' + s.replace('"', '\\"') + '"'
+    lines = ['digraph plan {', '    node [shape=box, fontname="monospace"];']
+    for r in rows:
+        label = [r['display_name'], r['op']]
+        if r['line'] is not None:
+            label.append(f"{os.path.basename(r['file'])}:{r['line']}")
+        if r['mean_ms'] is not None:
+            label.append(f"{r['calls']} calls, {r['mean_ms']:.3f} ms")
+        # graphviz line breaks
+        attrs = ['label=' + quote('\\n'.join(label))]
+        if 'fetch' in r['flags']:
+            attrs.append('peripheries=2')
+        if 'lazy' in r['flags']:
+            attrs.append('style=dashed')
+        if 'constant' in r['flags']:
+            attrs.append('color=gray')
+        elif 'cached' in r['flags']:
+            attrs.append('color=blue')
+        lines.append(f"    {quote(r['name'])} [{', '.join(attrs)}];")
+    for ref, op, lazy in edges:
+        lines.append(f'    {quote(ref)} -> {quote(op)}' + (' [style=dashed];' if lazy else ';'))
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def _format_json(rows, edges, fetches):
+    return json.dumps(dict(
+        fetches=fetches,
+        operations=rows,
+        edges=[dict(source=ref, target=op, lazy=lazy) for ref, op, lazy in edges],
+    ), indent=2)
+
+
+_FORMATS = {
+    'text': _format_text,
+    'dot': _format_dot,
+    'json': _format_json,
+}
+
+
+def explain(graph, fetches, format='text', profiler=None) -> str:  # pylint: disable=W0622
+    """
+    Describe the operations that are evaluated to compute the fetches,
+    in order, with the source lines they come from and the timings
+    and output sizes recorded by the ``profiler`` if given.
+    """
+    if format not in _FORMATS:
+        raise ValueError(f'unsupported format: {format!r}, must be one of: {list(_FORMATS)}')
+    rows, edges = get_plan_rows(graph, fetches, profiler=profiler)
+    names = [graph.normalize_operation(f).name for f in graph.normalize_fetches(fetches)[0]]
+    return _FORMATS[format](rows, edges, names)
@@ -0,0 +1,620 @@
+import collections.abc
+import copy
+import inspect
+import itertools
+import threading
+import uuid
+
+import pythonflow as pf
+
+from slipform._execute import CallbackEvaluation, Evaluation, Plan, ScheduledCallbackEvaluation, ScheduledEvaluation, get_default_scheduler
+
+
+# ========================================================================= #
+# Frozen Operations                                                         #
+# ========================================================================= #
+
+
+class FrozenGraphError(RuntimeError):
+    """
+    Raised when trying to modify a graph after it was built.
+    """
+
+
+class _FrozenOperations(dict):
+    """
+    Read-only mapping of operation names to operations. Lookups
+    are as fast as for a normal dict, only writes are prevented.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise FrozenGraphError('slipform graphs are immutable after they are built')
+
+    __setitem__ = __delitem__ = _readonly
+    pop = popitem = clear = update = setdefault = _readonly
+
+    def __reduce__(self):
+        return _FrozenOperations, (dict(self),)
+
+
+# ========================================================================= #
+# Slipform Graph                                                            #
+# ========================================================================= #
+
+
+class SlipformGraph(pf.Graph):
+    """
+    Graph generated by ``@slipform``.
+
+    Once built, the graph is frozen: operations can no longer be added
+    or renamed, so a single graph can safely be evaluated from many
+    threads at the same time. Each thread reuses its own scratch dict
+    to hold the intermediate values of an evaluation, instead of
+    allocating a new context for every call.
+    """
+
+    def __init__(self, orig_fn=None, builder=None, add_scope=None, inplace=False, scheduler=None):
+        super().__init__()
+        self._fn = orig_fn
+        # numpy binary operations may reuse the buffers of intermediate values
+        self.inplace = inplace
+        # executors of ``io`` and ``cpu_heavy`` operations, or the default scheduler
+        self.scheduler = scheduler
+        self._plans = {}
+        # translated function that generates the operations of the graph
+        self._builder = builder
+        self._add_scope = {} if (add_scope is None) else dict(add_scope)
+        # additional names of operations, eg. of merged duplicates
+        self._aliases = {}
+        # placeholders given by the name of an argument other than their own
+        self._inputs = {}
+        # source lines of operations copied from other graphs, see ``slipform._explain.get_source``
+        self._sources = {}
+        self._frozen = False
+        self._local = threading.local()
+        # hooks called around each operation, see ``add_hooks``
+        self._hooks = None
+        # interned literals of the translated function, only used while building
+        self._constants = {}
+
+    @property
+    def _orig_fn(self):
+        return self._fn
+
+    @property
+    def frozen(self):
+        return self._frozen
+
+    def freeze(self):
+        self.operations = _FrozenOperations(self.operations)
+        self.dependencies = tuple(self.dependencies)
+        self._inputs = {name: op for name, op in get_placeholders(self).items() if name != op.name}
+        self._constants = None
+        self._frozen = True
+        return self
+
+    def __enter__(self):
+        if self._frozen:
+            raise FrozenGraphError('cannot add operations to a slipform graph after it is built')
+        return super().__enter__()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        state['_plans'] = {}
+        # hooks are specific to the process, eg. they write to open files
+        state['_hooks'] = None
+        state['scheduler'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    # ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~ #
+    # Evaluation                                                            #
+    # ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~ #
+
+    def _acquire_scratch(self):
+        # reentrant calls from the same thread get a fresh dict
+        scratch = getattr(self._local, 'scratch', None)
+        self._local.scratch = None
+        return {} if (scratch is None) else scratch
+
+    def _release_scratch(self, scratch):
+        scratch.clear()
+        self._local.scratch = scratch
+
+    def normalize_operation(self, operation):  # pylint: disable=W0621
+        if isinstance(operation, str) and (operation in self._aliases):
+            return self._aliases[operation]
+        return super().normalize_operation(operation)
+
+    def __getitem__(self, name):
+        return self.normalize_operation(name)
+
+    def normalize_fetches(self, fetches):
+        if isinstance(fetches, (str, pf.Operation)):
+            return [self.normalize_operation(fetches)], True
+        if isinstance(fetches, collections.abc.Sequence):
+            return [self.normalize_operation(fetch) for fetch in fetches], False
+        raise ValueError('`fetches` must be an `Operation` instance, operation name, or a sequence thereof.')
+
+    def fill_context(self, scratch, context=None, **kwargs):
+        """
+        Like ``normalize_context`` but writes into ``scratch``
+        instead of modifying the given context in-place.
+        """
+        if context is None:
+            context = {}
+        elif not isinstance(context, collections.abc.Mapping):
+            raise ValueError('`context` must be a mapping.')
+        for items in (context.items(), kwargs.items()):
+            for operation, value in items:
+                # the names of reassigned arguments refer to their last version when fetched
+                if isinstance(operation, str) and (operation in self._inputs):
+                    operation = self._inputs[operation]
+                else:
+                    operation = self.normalize_operation(operation)
+                if operation in scratch:
+                    raise ValueError(f"duplicate value for operation '{operation}'")
+                scratch[operation] = value
+        return scratch
+
+    def get_plan(self, fetches) -> Plan:
+        """
+        Get the static references between the operations needed to
+        compute the fetches, plans are cached once the graph is frozen.
+        """
+        key = tuple(fetches)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = Plan(key)
+            if self._frozen:
+                self._plans[key] = plan
+        return plan
+
+    def add_hooks(self, hooks):
+        """
+        Call the methods of a ``slipform.Hooks`` instance around each call of
+        the graph and each operation that it evaluates, eg. a ``SpanExporter``.
+        """
+        from slipform._trace import HooksCallback
+        current = () if (self._hooks is None) else self._hooks.hooks
+        # replaced instead of modified, calls in progress keep the old hooks
+        self._hooks = HooksCallback(self, (*current, hooks))
+        return hooks
+
+    def remove_hooks(self, hooks):
+        from slipform._trace import HooksCallback
+        current = [h for h in self._hooks.hooks if h is not hooks] if (self._hooks is not None) else []
+        self._hooks = HooksCallback(self, current) if current else None
+
+    def apply(self, fetches, context=None, *, callback=None, **kwargs):
+        fetches, single = self.normalize_fetches(fetches)
+        hooks = self._hooks
+        scratch = self._acquire_scratch()
+        try:
+            self.fill_context(scratch, context, **kwargs)
+            plan = self.get_plan(fetches)
+            # ``io`` and ``cpu_heavy`` operations are started first and run concurrently
+            scheduler = None
+            if plan.schedule is not None:
+                scheduler = self.scheduler if (self.scheduler is not None) else get_default_scheduler()
+                scheduler = scheduler if scheduler.enabled else None
+            if hooks is not None:
+                from slipform._trace import ChainedCallback
+                callback = hooks if (callback is None) else ChainedCallback(hooks, callback)
+            # intermediate values are released as soon as they are no longer needed,
+            # and without callbacks or hooks operations are evaluated without any checks
+            if callback is None:
+                evaluation = (Evaluation if (scheduler is None) else ScheduledEvaluation)(plan, scratch, inplace=self.inplace)
+            else:
+                evaluation = (CallbackEvaluation if (scheduler is None) else ScheduledCallbackEvaluation)(plan, scratch, callback, inplace=self.inplace)
+            if scheduler is None:
+                run = lambda: tuple(evaluation.value(fetch) for fetch in fetches)
+            else:
+                run = lambda: evaluation.run(fetches, scheduler)
+            values = run() if (hooks is None) else hooks.call(fetches, run)
+        finally:
+            self._release_scratch(scratch)
+        return values[0] if single else values
+
+    __call__ = apply
+
+    def explain(self, fetches, format='text', profiler=None) -> str:  # pylint: disable=W0622
+        """
+        Describe the operations that are evaluated to compute the fetches
+        in order, as ``'text'``, ``'dot'`` or ``'json'``. Timings and output
+        sizes are included from a ``slipform.Profiler`` used in previous calls.
+        """
+        from slipform._explain import explain
+        return explain(self, fetches, format=format, profiler=profiler)
+
+    def specialize(self, **values) -> 'SlipformGraph':
+        """
+        Get a new graph where the given placeholders are replaced by
+        constants. Conditionals on constants are resolved, operations
+        only needed by the branches that are not taken are removed, and
+        operations that only depend on constants are precomputed.
+
+            fast = graph.specialize(mse=True, encoder=encoder)
+            loss = fast('loss', x=x, x_target=x_target)
+        """
+        return specialize_graph(self, **values)
+
+
+# ========================================================================= #
+# Building                                                                  #
+# ========================================================================= #
+
+
+def build_graph(builder, orig_fn=None, add_scope=None, inplace=False, scheduler=None) -> SlipformGraph:
+    """
+    Generate a frozen graph by calling the translated ``builder``.
+    """
+    from slipform import ORIG_FN_NAME
+    # graphs can be built while building another graph, eg. when
+    # inlining, but pythonflow only supports a single default graph
+    outer = getattr(pf.Graph._globals, 'default_graph', None)  # pylint: disable=protected-access
+    pf.Graph._globals.default_graph = None  # pylint: disable=protected-access
+    try:
+        with SlipformGraph(orig_fn=orig_fn, builder=builder, add_scope=add_scope, inplace=inplace, scheduler=scheduler) as graph:
+            builder()
+            # make sure we can access the original function
+            # insert the function as an operation on the graph
+            assert ORIG_FN_NAME not in graph.operations, f'{ORIG_FN_NAME} operation is reserved'
+            pf.constant(orig_fn, name=ORIG_FN_NAME)
+    finally:
+        pf.Graph._globals.default_graph = outer  # pylint: disable=protected-access
+    # graphs are immutable once built, which makes them safe to share between threads
+    return graph.freeze()
+
+
+# ========================================================================= #
+# Cloning                                                                   #
+# ========================================================================= #
+
+
+def is_generated_name(name):
+    # unnamed operations are given random uuids by pythonflow
+    return (len(name) == 32) and all(c in '0123456789abcdef' for c in name)
+
+
+def get_placeholders(graph) -> dict:
+    """
+    Get the placeholders of a graph by the names of the arguments that they
+    stand for, which differ from their own names for reassigned arguments.
+    """
+    from slipform._runtime import placeholder
+    return {
+        op.argument if (isinstance(op, placeholder) and (op.argument is not None)) else op.name: op
+        for op in graph.operations.values()
+        if isinstance(op, pf.placeholder)
+    }
+
+
+class OperationCloner:
+    """
+    Copy operations and everything they reference into another graph.
+
+    Named operations are renamed to ``prefix + name``. Values can be
+    substituted for operations before cloning, eg. placeholders, by
+    adding them to ``memo``. If ``dedupe`` is enabled, structurally equal
+    operations are only copied once, the names of the duplicates become
+    aliases of the first copy.
+    """
+
+    def __init__(self, graph: pf.Graph, prefix='', dedupe=False):
+        self.graph = graph
+        self.prefix = prefix
+        self.dedupe = dedupe
+        self.memo = {}
+        self.aliases = {}
+        self._keys = {}
+
+    def substitute(self, op, value):
+        self.memo[id(op)] = value
+
+    def clone(self, value):
+        if isinstance(value, pf.Operation):
+            if id(value) not in self.memo:
+                self.memo[id(value)] = self._clone_operation(value)
+            return self.memo[id(value)]
+        if isinstance(value, tuple):
+            return tuple(self.clone(v) for v in value)
+        if isinstance(value, list):
+            return [self.clone(v) for v in value]
+        if isinstance(value, dict):
+            return {self.clone(k): self.clone(v) for k, v in value.items()}
+        if isinstance(value, slice):
+            return slice(self.clone(value.start), self.clone(value.stop), self.clone(value.step))
+        return value
+
+    def copy_source(self, op, new):
+        # copies were not created by the builder of the target graph
+        from slipform._explain import get_source
+        if isinstance(self.graph, SlipformGraph) and isinstance(op.graph, SlipformGraph):
+            source = get_source(op.graph, op)
+            if source is not None:
+                self.graph._sources[new] = source
+
+    def get_name(self, op):
+        return uuid.uuid4().hex if is_generated_name(op.name) else f'{self.prefix}{op.name}'
+
+    def _clone_operation(self, op):
+        args, kwargs = self.clone(op.args), self.clone(op.kwargs)
+        # dependencies of the target graph, eg. from ``pf.control_dependencies``, also apply
+        dependencies = [*(self.clone(dep) for dep in op.dependencies), *self.graph.dependencies]
+        key = self._get_key(op, args, kwargs, dependencies) if self.dedupe else None
+        if key in self._keys:
+            existing = self._keys[key]
+            if not is_generated_name(op.name):
+                self.aliases[self.get_name(op)] = existing
+            return existing
+        new = copy.copy(op)
+        new.__dict__.update(graph=self.graph, _name=None, args=args, kwargs=kwargs, dependencies=dependencies)
+        self.copy_source(op, new)
+        new.set_name(self.get_name(op))
+        if key is not None:
+            self._keys[key] = new
+        return new
+
+    @classmethod
+    def _get_key(cls, op, args, kwargs, dependencies):
+        from slipform._runtime import func_op, KIND_IO, KIND_STOCHASTIC
+        # only deterministic operations without hidden state are merged
+        if type(op) is func_op:
+            if op.kind in (KIND_IO, KIND_STOCHASTIC):
+                return None
+        elif type(op) not in (pf.func_op, pf.conditional, pf.try_):
+            return None
+        try:
+            # missing attributes of operations, eg. of conditionals, would create new operations
+            key = (type(op), id(vars(op).get('target')), op.length, cls._get_value_key(args), cls._get_value_key(kwargs), tuple(map(id, dependencies)))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    @classmethod
+    def _get_value_key(cls, value):
+        if isinstance(value, pf.Operation):
+            return 'op', id(value)
+        if isinstance(value, (tuple, list)):
+            return type(value), tuple(cls._get_value_key(v) for v in value)
+        if isinstance(value, dict):
+            return dict, tuple((cls._get_value_key(k), cls._get_value_key(v)) for k, v in value.items())
+        if isinstance(value, slice):
+            return slice, cls._get_value_key((value.start, value.stop, value.step))
+        try:
+            hash(value)
+        except TypeError:
+            return 'id', id(value)
+        return type(value), value
+
+
+# ========================================================================= #
+# Fusion                                                                    #
+# ========================================================================= #
+
+
+def fuse(*graphs, **named_graphs) -> SlipformGraph:
+    """
+    Merge several slipform graphs into one graph that can be evaluated
+    with a single call. Operations are renamed to ``'<graph>.<name>'``,
+    where graphs passed as positional arguments are named after their
+    original functions. Placeholders with the same name are shared and
+    keep their name, and structurally equal operations, eg. common
+    prefixes of the graphs, are only evaluated once.
+
+        both = fuse(encode, decode)
+        z, x_recon = both(['encode.z', 'decode.x_recon'], x=x)
+    """
+    from slipform import ORIG_FN_NAME
+    # get the names of the graphs
+    named = {}
+    for graph in graphs:
+        if getattr(graph, '_orig_fn', None) is None:
+            raise ValueError(f'graphs without an original function must be passed by name: {graph!r}')
+        named.setdefault(graph._orig_fn.__name__, []).append(graph)
+    for name, graph in named_graphs.items():
+        named.setdefault(name, []).append(graph)
+    duplicates = sorted(name for name, graphs in named.items() if len(graphs) > 1)
+    if duplicates:
+        raise ValueError(f'graphs must have unique names, pass them by name instead: {duplicates}')
+    # clone all the operations into the fused graph
+    fused = SlipformGraph()
+    cloner = OperationCloner(fused, dedupe=True)
+    placeholders = {}
+    for name, (graph,) in named.items():
+        cloner.prefix, cloner.memo = f'{name}.', {}
+        ops = [op for op in graph.operations.values() if op.name != ORIG_FN_NAME]
+        # placeholders are shared between all graphs
+        for argument, op in get_placeholders(graph).items():
+            if argument not in placeholders:
+                cloner.prefix = ''
+                placeholders[argument] = cloner.clone(op)
+                cloner.prefix = f'{name}.'
+            cloner.substitute(op, placeholders[argument])
+            cloner.aliases[f'{name}.{op.name}'] = placeholders[argument]
+        for op in ops:
+            cloner.clone(op)
+    fused._aliases.update(cloner.aliases)
+    return fused.freeze()
+
+
+# ========================================================================= #
+# Specialization                                                            #
+# ========================================================================= #
+
+
+def _is_foldable(op):
+    from slipform._runtime import func_op, KIND_PURE, KIND_CPU_HEAVY
+    # only deterministic operations without hidden state are precomputed
+    if type(op) is func_op:
+        return op.kind in (KIND_PURE, KIND_CPU_HEAVY)
+    return type(op) in (pf.func_op, pf.conditional, pf.try_)
+
+
+class _SpecializingCloner(OperationCloner):
+    """
+    Clone operations, replacing those with known values by constants
+    and resolved conditionals by the branch that is selected.
+    """
+
+    def __init__(self, graph: pf.Graph, folded, resolved):
+        super().__init__(graph)
+        self.folded = folded
+        self.resolved = resolved
+
+    def _clone_operation(self, op):
+        if op in self.folded:
+            constant = pf.constant(self.folded[op], graph=self.graph, name=self.get_name(op))
+            # errors and ``explain`` still point to the original source
+            constant._stack = op._stack  # pylint: disable=protected-access
+            self.copy_source(op, constant)
+            return constant
+        if op in self.resolved:
+            selected = self.clone(self.resolved[op])
+            if not is_generated_name(op.name):
+                # the selected branch takes the name of the conditional if it has none
+                if is_generated_name(selected.name):
+                    selected.set_name(op.name)
+                else:
+                    self.aliases[op.name] = selected
+            return selected
+        return super()._clone_operation(op)
+
+
+def specialize_graph(graph: SlipformGraph, **values) -> SlipformGraph:
+    """
+    Partially evaluate a graph on known placeholder values, see ``SlipformGraph.specialize``.
+    """
+    from slipform._execute import get_refs
+    placeholders = get_placeholders(graph)
+    unknown = sorted(set(values) - set(placeholders))
+    if unknown:
+        raise TypeError(f'graph got unexpected arguments: {unknown}')
+    context = graph.fill_context({}, values)
+    # find the operations that only depend on known values, in post-order
+    static, order, visited = set(context), [], set()
+    for root in graph.operations.values():
+        stack = [(root, False)]
+        while stack:
+            op, expanded = stack.pop()
+            if expanded:
+                order.append(op)
+                if (op not in static) and _is_foldable(op) and all(ref in static for ref in get_refs(op)):
+                    static.add(op)
+            elif op not in visited:
+                visited.add(op)
+                stack.append((op, True))
+                stack.extend((ref, False) for ref in get_refs(op))
+    # conditionals on known predicates select one of their branches
+    evaluation = Evaluation(Plan(list(static)), dict(context))
+    resolved, folded = {}, {}
+    for op in order:
+        if (type(op) is pf.conditional) and (op.args[0] in static or not isinstance(op.args[0], pf.Operation)):
+            try:
+                predicate = evaluation.value(op.args[0])
+            except Exception:  # pylint: disable=W0703
+                continue
+            resolved[op] = op.args[1] if predicate else op.args[2]
+    # precompute the known values, those that fail are evaluated on every call instead
+    for op in order:
+        if (op in static) and (op not in context):
+            try:
+                folded[op] = evaluation.value(op)
+            except Exception:  # pylint: disable=W0703
+                pass
+    folded.update(context)
+    # clone the named operations and everything still reachable from them,
+    # operations only referenced by branches that are not taken are dropped
+    specialized = SlipformGraph(orig_fn=graph._orig_fn, add_scope=graph._add_scope, inplace=graph.inplace, scheduler=graph.scheduler)
+    cloner = _SpecializingCloner(specialized, folded, resolved)
+    referenced = {id(ref) for op in order for ref in get_refs(op)}
+    for op in order:
+        if (id(op) not in referenced) or not is_generated_name(op.name):
+            cloner.clone(op)
+    for name, op in graph._aliases.items():
+        cloner.aliases[name] = cloner.clone(op)
+    specialized._aliases.update(cloner.aliases)
+    return specialized.freeze()
+
+
+# ========================================================================= #
+# Inlining                                                                  #
+# ========================================================================= #
+
+
+class InlinedGraph:
+    """
+    Operations of a graph that was inlined into the graph being built,
+    by their original names. Assigning the result in a slipform function
+    prefixes the names of the copied operations with the assigned name.
+
+        enc = encoder(x)  # operations are named 'enc.h', 'enc.z', ...
+        z = enc.z
+    """
+
+    def __init__(self, operations, owned):
+        self._operations = operations
+        self._owned = owned
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['_operations'][name]
+        except KeyError:
+            raise AttributeError(f'inlined graph has no operation: {name!r}') from None
+
+    def __getitem__(self, name):
+        return self._operations[name]
+
+    def __iter__(self):
+        return iter(self._operations)
+
+    def set_name(self, name):
+        for key, op in self._operations.items():
+            if (id(op) in self._owned) and not is_generated_name(key):
+                op.set_name(f'{name}.{key}')
+        return self
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {list(self._operations)}>'
+
+
+_INLINE_COUNT = itertools.count()
+
+
+def inline_graph(graph: SlipformGraph, *args, **kwargs) -> InlinedGraph:
+    """
+    Copy the operations of ``graph`` into the graph that is being built,
+    replacing its placeholders with the arguments. Arguments are bound to
+    placeholders like a call to the original function, placeholders that
+    are not given keep their defaults.
+    """
+    from slipform import ORIG_FN_NAME
+    placeholders = get_placeholders(graph)
+    if graph._orig_fn is not None:
+        values = inspect.signature(graph._orig_fn).bind(*args, **kwargs).arguments
+    elif args:
+        raise TypeError('arguments of graphs without an original function must be given by name')
+    else:
+        values = kwargs
+    unknown = sorted(set(values) - set(placeholders))
+    if unknown:
+        raise TypeError(f'graph got unexpected arguments: {unknown}')
+    # copy the operations with temporary names
+    cloner = OperationCloner(pf.Graph.get_active_graph(), prefix=f'_slipform_inline{next(_INLINE_COUNT)}.')
+    for name, value in values.items():
+        cloner.substitute(placeholders[name], value)
+    substituted = {id(placeholders[name]) for name in values}
+    operations, owned = {}, set()
+    for op in graph.operations.values():
+        if op.name != ORIG_FN_NAME:
+            operations[op.name] = clone = cloner.clone(op)
+            # only operations created by the inlined graph are renamed, not the arguments
+            if id(op) not in substituted:
+                owned.add(id(clone))
+    return InlinedGraph(operations, owned)
@@ -0,0 +1,166 @@
+"""
+Kernels evaluating fused trees of arithmetic operators.
+
+The translator replaces expressions such as ``a * b + c - 1`` with a
+single operation, described by a tree of operator names and the indices
+of the values at its leaves:
+
+    ('Sub', ('Add', ('Mult', 0, 1), 2), 3)  ->  v0 * v1 + v2 - v3
+
+Scalars are evaluated by a compiled lambda. Numpy arrays are evaluated
+step by step, writing into the temporary arrays of earlier steps instead
+of allocating new ones, or by ``numexpr`` for large arrays if it is installed.
+"""
+
+import functools
+import operator
+import sys
+
+from slipform._execute import _INPLACE_OPS, get_result_dtype
+
+
+# ========================================================================= #
+# Operators                                                                 #
+# ========================================================================= #
+
+
+BINARY_OPS = {
+    'Add': (operator.add, '+'),
+    'Sub': (operator.sub, '-'),
+    'Mult': (operator.mul, '*'),
+    'Div': (operator.truediv, '/'),
+    'FloorDiv': (operator.floordiv, '//'),
+    'Mod': (operator.mod, '%'),
+    'Pow': (operator.pow, '**'),
+    'MatMult': (operator.matmul, '@'),
+    'LShift': (operator.lshift, '<<'),
+    'RShift': (operator.rshift, '>>'),
+    'BitAnd': (operator.and_, '&'),
+    'BitOr': (operator.or_, '|'),
+    'BitXor': (operator.xor, '^'),
+}
+
+UNARY_OPS = {
+    'USub': (operator.neg, '-'),
+    'UAdd': (operator.pos, '+'),
+    'Invert': (operator.invert, '~'),
+}
+
+# operators with the same semantics in numexpr and numpy for float64 arrays
+_NUMEXPR_OPS = {'Add', 'Sub', 'Mult', 'Div', 'Pow', 'USub'}
+
+# binary operations that can write into the buffer of their second argument instead
+_COMMUTATIVE_OPS = {operator.add, operator.mul, operator.and_, operator.or_, operator.xor}
+
+# arrays smaller than this are not worth the overhead of numexpr
+NUMEXPR_MIN_SIZE = 1 << 15
+
+
+def _get_source(tree):
+    if isinstance(tree, int):
+        return f'v{tree}'
+    if len(tree) == 2:
+        return f'({UNARY_OPS[tree[0]][1]}{_get_source(tree[1])})'
+    return f'({_get_source(tree[1])} {BINARY_OPS[tree[0]][1]} {_get_source(tree[2])})'
+
+
+def _iter_ops(tree):
+    if not isinstance(tree, int):
+        yield tree[0]
+        for child in tree[1:]:
+            yield from _iter_ops(child)
+
+
+def _iter_leaves(tree):
+    if isinstance(tree, int):
+        yield tree
+    else:
+        for child in tree[1:]:
+            yield from _iter_leaves(child)
+
+
+@functools.lru_cache(maxsize=None)
+def _import_numexpr():
+    try:
+        import numexpr
+    except ImportError:
+        return None
+    return numexpr
+
+
+# ========================================================================= #
+# Kernel                                                                    #
+# ========================================================================= #
+
+
+class Kernel:
+    """
+    Evaluate a tree of operators on the values at its leaves.
+    """
+
+    __slots__ = ('tree', 'source', 'func', 'use_numexpr')
+
+    def __init__(self, tree):
+        self.tree = tree
+        # without the outer parentheses
+        self.source = _get_source(tree)[1:-1]
+        args = ', '.join(f'v{i}' for i in range(max(_iter_leaves(tree)) + 1))
+        self.func = eval(f'lambda {args}: {self.source}', {})  # pylint: disable=W0123
+        self.use_numexpr = set(_iter_ops(tree)) <= _NUMEXPR_OPS
+
+    def __call__(self, *values):
+        np = sys.modules.get('numpy')
+        if (np is None) or not any(isinstance(v, np.ndarray) for v in values):
+            return self.func(*values)
+        if self.use_numexpr and self._numexpr_supported(values, np):
+            return _import_numexpr().evaluate(self.source, local_dict={f'v{i}': v for i, v in enumerate(values)})
+        return _evaluate(self.tree, values, np)[0]
+
+    @staticmethod
+    def _numexpr_supported(values, np):
+        if _import_numexpr() is None:
+            return False
+        # numexpr casts differently from numpy for other dtypes
+        arrays = [v for v in values if not isinstance(v, (int, float))]
+        if not all((type(v) is np.ndarray) and (v.dtype == np.float64) for v in arrays):
+            return False
+        return max(v.size for v in arrays) >= NUMEXPR_MIN_SIZE
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.source}>'
+
+
+get_kernel = functools.lru_cache(maxsize=None)(Kernel)
+
+
+def _can_write(func, a, b, np):
+    if not isinstance(b, (np.ndarray, np.generic, int, float, complex)):
+        return False
+    return (get_result_dtype(func, a, b, np) == a.dtype) and (np.broadcast_shapes(a.shape, np.shape(b)) == a.shape)
+
+
+def _evaluate(tree, values, np):
+    """
+    Evaluate a tree on numpy arrays, returning the value and whether it is
+    a temporary array owned by the kernel that can be written into.
+    """
+    if isinstance(tree, int):
+        return values[tree], False
+    if len(tree) == 2:
+        value, owned = _evaluate(tree[1], values, np)
+        func = UNARY_OPS[tree[0]][0]
+        if owned and (func is operator.neg):
+            return np.negative(value, out=value), True
+        value = func(value)
+        return value, type(value) is np.ndarray
+    func = BINARY_OPS[tree[0]][0]
+    a, a_owned = _evaluate(tree[1], values, np)
+    b, b_owned = _evaluate(tree[2], values, np)
+    inplace = _INPLACE_OPS.get(func)
+    if inplace is not None:
+        if a_owned and _can_write(func, a, b, np):
+            return inplace(a, b), True
+        if b_owned and (func in _COMMUTATIVE_OPS) and _can_write(func, b, a, np):
+            return inplace(b, a), True
+    value = func(a, b)
+    return value, type(value) is np.ndarray
@@ -0,0 +1,195 @@
+"""
+Memoize the results of slipform graph calls on their placeholder values.
+
+    cached = memoize(graph, maxsize=256, ttl=60)
+    cached('loss', x=x, config=config)  # evaluates the graph
+    cached('loss', x=x, config=config)  # returns the cached result
+"""
+
+import collections
+import hashlib
+import sys
+import threading
+import time
+from typing import NamedTuple
+
+
+# ========================================================================= #
+# Hashing                                                                   #
+# ========================================================================= #
+
+
+class UnhashableError(TypeError):
+    """
+    Raised if a value in the context cannot be used as part of a cache key.
+    """
+
+
+def _hash_array(array, content):
+    if not content:
+        return 'id', id(array)
+    np = sys.modules['numpy']
+    if array.dtype.hasobject:
+        raise UnhashableError('arrays of objects cannot be hashed by content')
+    # the shape is taken before the copy, which turns 0-d arrays into 1-d arrays
+    data = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+    return 'ndarray', array.dtype.str, array.shape, hashlib.blake2b(data.data, digest_size=16).digest()
+
+
+def make_key(value, array_hash='content'):
+    """
+    Get a hashable key for a value in the context. Numpy arrays are hashed
+    either by ``'content'`` or by ``'identity'``, containers are hashed
+    recursively and all other values must be hashable.
+    """
+    np = sys.modules.get('numpy')
+    if (np is not None) and isinstance(value, np.ndarray):
+        return _hash_array(value, array_hash == 'content')
+    if isinstance(value, (tuple, list)):
+        return type(value), tuple(make_key(v, array_hash) for v in value)
+    if isinstance(value, dict):
+        return dict, tuple((make_key(k, array_hash), make_key(v, array_hash)) for k, v in value.items())
+    try:
+        hash(value)
+    except TypeError:
+        raise UnhashableError(f'cannot use value of type {type(value).__name__!r} as part of a cache key') from None
+    # 1 and 1.0 are equal, but can produce different results
+    return type(value), value
+
+
+# ========================================================================= #
+# Cache                                                                     #
+# ========================================================================= #
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    uncacheable: int
+    size: int
+    maxsize: int
+
+
+class _Entry:
+    __slots__ = ('values', 'expires', 'uses', 'refs')
+
+    def __init__(self, values, expires, refs):
+        self.values = values
+        self.expires = expires
+        self.uses = 0
+        # arrays hashed by identity are kept alive, so that their id cannot be reused
+        self.refs = refs
+
+
+class MemoizedGraph:
+    """
+    Front end to a slipform graph that caches the results of calls,
+    keyed on the fetches and the values in the context.
+
+    Cached results are shared between calls and must not be modified.
+    Calls with a callback, or with values that cannot be hashed, are
+    always evaluated.
+
+    Parameters
+    ----------
+    graph : SlipformGraph
+        Graph to evaluate on cache misses.
+    maxsize : int
+        Maximum number of cached results.
+    policy : str
+        Which result to evict when the cache is full, the least
+        recently used ``'lru'`` or the least frequently used ``'lfu'``.
+    ttl : float or None
+        Number of seconds after which cached results expire.
+    array_hash : str
+        Hash numpy arrays by ``'content'``, or much faster by ``'identity'``
+        if arrays are never modified in-place between calls.
+    """
+
+    def __init__(self, graph, maxsize=128, policy='lru', ttl=None, array_hash='content'):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f'unsupported cache policy: {policy!r}, must be one of: {["lru", "lfu"]}')
+        if array_hash not in ('content', 'identity'):
+            raise ValueError(f'unsupported array hash: {array_hash!r}, must be one of: {["content", "identity"]}')
+        if maxsize <= 0:
+            raise ValueError(f'maxsize must be positive, got: {maxsize!r}')
+        self.graph = graph
+        self.maxsize = maxsize
+        self.policy = policy
+        self.ttl = ttl
+        self.array_hash = array_hash
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = self._expirations = self._uncacheable = 0
+
+    def _make_key(self, fetches, context):
+        items = tuple(sorted((op.name, make_key(value, self.array_hash)) for op, value in context.items()))
+        return tuple(fetch.name for fetch in fetches), items
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if (entry.expires is not None) and (entry.expires <= time.monotonic()):
+            del self._entries[key]
+            self._expirations += 1
+            return None
+        entry.uses += 1
+        if self.policy == 'lru':
+            self._entries.move_to_end(key)
+        return entry
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        while len(self._entries) > self.maxsize:
+            if self.policy == 'lru':
+                self._entries.popitem(last=False)
+            else:
+                # least frequently used, ties are broken by age
+                del self._entries[min(self._entries, key=lambda k: self._entries[k].uses)]
+            self._evictions += 1
+
+    def __call__(self, fetches, context=None, *, callback=None, **kwargs):
+        if callback is not None:
+            return self.graph(fetches, context, callback=callback, **kwargs)
+        ops, single = self.graph.normalize_fetches(fetches)
+        filled = self.graph.fill_context({}, context, **kwargs)
+        try:
+            key = self._make_key(ops, filled)
+        except UnhashableError:
+            with self._lock:
+                self._uncacheable += 1
+            key = entry = None
+        else:
+            with self._lock:
+                entry = self._lookup(key)
+                if entry is not None:
+                    self._hits += 1
+        if key is None:
+            values = self.graph(ops, filled)
+            return values[0] if single else values
+        if entry is None:
+            values = self.graph(ops, filled)
+            refs = tuple(filled.values()) if (self.array_hash == 'identity') else ()
+            entry = _Entry(values, None if (self.ttl is None) else time.monotonic() + self.ttl, refs)
+            with self._lock:
+                self._misses += 1
+                self._insert(key, entry)
+        return entry.values[0] if single else entry.values
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions, self._expirations, self._uncacheable, len(self._entries), self.maxsize)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def memoize(graph, maxsize=128, policy='lru', ttl=None, array_hash='content') -> MemoizedGraph:
+    """
+    Cache the results of calls to a slipform graph, see ``MemoizedGraph``.
+    """
+    return MemoizedGraph(graph, maxsize=maxsize, policy=policy, ttl=ttl, array_hash=array_hash)
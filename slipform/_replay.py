@@ -0,0 +1,252 @@
+"""
+Record and replay the outputs of non-deterministic operations, so that
+benchmarks and regression comparisons evaluate graphs on identical work.
+
+    recording = record(graph)
+    recording('loss', x=x)        # evaluates the graph, recording the samples
+    recording.trace.save('loss.trace')
+
+    replaying = replay(graph, Trace.load('loss.trace'))
+    replaying('loss', x=x)        # uses the recorded samples instead of drawing them
+"""
+
+import contextlib
+import pickle
+import random
+import sys
+import threading
+
+from slipform._graph import is_generated_name
+from slipform._runtime import KIND_STOCHASTIC, func_op
+from slipform._trace import ChainedCallback
+
+
+# ========================================================================= #
+# Seeding                                                                   #
+# ========================================================================= #
+
+
+@contextlib.contextmanager
+def seeded(seed):
+    """
+    Seed the global random number generators of python and numpy (if
+    imported), restoring their previous states on exit.
+    """
+    np = sys.modules.get('numpy')
+    state = random.getstate()
+    np_state = None if (np is None) else np.random.get_state()
+    random.seed(seed)
+    if np is not None:
+        np.random.seed(seed % (1 << 32))
+    try:
+        yield
+    finally:
+        random.setstate(state)
+        if np is not None:
+            np.random.set_state(np_state)
+
+
+# ========================================================================= #
+# Trace                                                                     #
+# ========================================================================= #
+
+
+def get_op_keys(graph) -> dict:
+    """
+    Keys of the operations of a graph that are stable when the graph is
+    built again, eg. in another process. Named operations are keyed by
+    their names, unnamed ones, which are given random names, by their
+    position in the graph, prefixed with ``#``.
+    """
+    return {
+        op: f'#{i}' if is_generated_name(name) else name
+        for i, (name, op) in enumerate(graph.operations.items())
+    }
+
+
+# saved with the calls, traces of other versions cannot be loaded
+TRACE_FORMAT = ('slipform-trace', 2)
+
+
+class TraceExhaustedError(RuntimeError):
+    """
+    Raised when a graph is called more often than the calls in its trace.
+    """
+
+
+class Trace:
+    """
+    Outputs of the recorded operations of each call of a graph, keyed by
+    the operations as in ``get_op_keys``, so that traces can be replayed on
+    the same graph built again. Only the operations that were evaluated are
+    recorded, eg. not those in branches that were not taken.
+    """
+
+    def __init__(self, calls=None):
+        self.calls = [] if (calls is None) else list(calls)
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __getitem__(self, i):
+        return self.calls[i]
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump((TRACE_FORMAT, self.calls), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path) -> 'Trace':
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if not (isinstance(data, tuple) and (len(data) == 2) and (data[0] == TRACE_FORMAT)):
+            found = data[0] if isinstance(data, tuple) and data else type(data).__name__
+            raise ValueError(f'{path} is not a trace of format {TRACE_FORMAT}, found: {found!r}')
+        return cls(data[1])
+
+
+# ========================================================================= #
+# Recording                                                                 #
+# ========================================================================= #
+
+
+_NOOP = contextlib.nullcontext()
+
+
+class _RecordScope:
+    __slots__ = ('values', 'op', 'key', 'context')
+
+    def __init__(self, values, op, key, context):
+        self.values = values
+        self.op = op
+        self.key = key
+        self.context = context
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, type_, error, traceback):
+        # values are stored in the context before callbacks exit
+        if error is None:
+            self.values[self.key] = self.context[self.op]
+
+
+class _Recorder:
+    __slots__ = ('keys', 'values')
+
+    def __init__(self, keys):
+        # keys of the operations to record
+        self.keys = keys
+        self.values = {}
+
+    def __call__(self, operation, context):
+        key = self.keys.get(operation)
+        if key is not None:
+            return _RecordScope(self.values, operation, key, context)
+        return _NOOP
+
+
+class RecordingGraph:
+    """
+    Front end to a slipform graph that records the outputs of its
+    non-deterministic operations for each call in ``trace``.
+
+    Parameters
+    ----------
+    graph : SlipformGraph
+        Graph to evaluate.
+    kinds : tuple
+        Kinds of the operations to record, eg. add ``'io'`` to also
+        record the results of I/O, which are then skipped when replayed.
+    names : tuple
+        Names of additional operations to record, eg. of ``pf.func_op``
+        operations calling functions that are not marked as stochastic.
+    seed : int or None
+        If given, the i-th call is evaluated with the random number
+        generators seeded with ``seed + i``, see ``seeded``. Seeded calls
+        are evaluated one at a time because the generators are global.
+    """
+
+    def __init__(self, graph, kinds=(KIND_STOCHASTIC,), names=(), seed=None):
+        self.graph = graph
+        self.seed = seed
+        self.trace = Trace()
+        ops = {op for op in graph.operations.values() if isinstance(op, func_op) and (op.kind in kinds)}
+        ops.update(graph[name] for name in names)
+        self.keys = {op: key for op, key in get_op_keys(graph).items() if op in ops}
+        if not self.keys:
+            raise ValueError(f'the graph has no operations of kinds {kinds} to record, mark the functions that are not deterministic with @stochastic')
+        self._lock = threading.Lock()
+        self._seed_lock = threading.Lock()
+
+    def __call__(self, fetches, context=None, *, callback=None, **kwargs):
+        recorder = _Recorder(self.keys)
+        callback = recorder if (callback is None) else ChainedCallback(recorder, callback)
+        with self._lock:
+            index = len(self.trace.calls)
+            self.trace.calls.append(recorder.values)
+        if self.seed is None:
+            return self.graph(fetches, context, callback=callback, **kwargs)
+        with self._seed_lock, seeded(self.seed + index):
+            return self.graph(fetches, context, callback=callback, **kwargs)
+
+
+def record(graph, kinds=(KIND_STOCHASTIC,), names=(), seed=None) -> RecordingGraph:
+    """
+    Record the outputs of the non-deterministic operations of each call
+    to a slipform graph, see ``RecordingGraph``.
+    """
+    return RecordingGraph(graph, kinds=kinds, names=names, seed=seed)
+
+
+# ========================================================================= #
+# Replaying                                                                 #
+# ========================================================================= #
+
+
+class ReplayingGraph:
+    """
+    Front end to a slipform graph where the i-th call uses the outputs
+    recorded by the i-th call of a ``RecordingGraph``, instead of
+    evaluating the recorded operations and the operations they depend on.
+
+    Values given to a call take precedence over recorded ones. Once all
+    calls in the trace are replayed, further calls raise an error, or
+    start again from the first call if ``cycle`` is enabled.
+    """
+
+    def __init__(self, graph, trace, cycle=False):
+        if not len(trace):
+            raise ValueError('cannot replay an empty trace')
+        self.graph = graph
+        self.trace = trace
+        self.cycle = cycle
+        self._ops = {key: op for op, key in get_op_keys(graph).items()}
+        self._index = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, fetches, context=None, *, callback=None, **kwargs):
+        with self._lock:
+            index = self._index
+            if (index >= len(self.trace)) and not self.cycle:
+                raise TraceExhaustedError(f'all {len(self.trace)} recorded calls have been replayed')
+            self._index += 1
+        filled = self.graph.fill_context({}, context, **kwargs)
+        for key, value in self.trace[index % len(self.trace)].items():
+            op = self._ops.get(key)
+            if op is None:
+                raise KeyError(f'recorded operation {key!r} is not in the graph, it may have changed since it was recorded')
+            filled.setdefault(op, value)
+        return self.graph(fetches, filled, callback=callback)
+
+    def reset(self):
+        with self._lock:
+            self._index = 0
+
+
+def replay(graph, trace, cycle=False) -> ReplayingGraph:
+    """
+    Replay the outputs recorded by ``record`` in calls to a slipform
+    graph, see ``ReplayingGraph``.
+    """
+    return ReplayingGraph(graph, trace, cycle=cycle)
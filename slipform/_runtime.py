@@ -0,0 +1,522 @@
+"""
+Runtime support for translated slipform functions.
+
+The translated code references this module under the
+name ``__slipform__``, for example:
+
+    z = encoder(x)
+becomes:
+    z = __slipform__.call(encoder, x)
+"""
+
+import functools
+import operator
+import random
+import sys
+
+import pythonflow as pf
+
+from slipform._execute import iter_refs
+from slipform._graph import SlipformGraph, get_placeholders, inline_graph
+from slipform._kernel import get_kernel
+
+
+RUNTIME_NAME = '__slipform__'
+
+# placeholder value for names that were never assigned
+UNBOUND = type('Unbound', (), {'__repr__': lambda self: '<unbound>'})()
+
+
+# ========================================================================= #
+# Operation Kinds                                                           #
+# ========================================================================= #
+
+
+KIND_PURE = 'pure'
+KIND_IO = 'io'
+KIND_CPU_HEAVY = 'cpu_heavy'
+KIND_STOCHASTIC = 'stochastic'
+
+KINDS = (KIND_PURE, KIND_IO, KIND_CPU_HEAVY, KIND_STOCHASTIC)
+
+
+class MarkedFunction:
+    """
+    Wrapper of a function marked with an operation kind, the
+    function itself is left untouched. Calls are forwarded to it.
+    """
+
+    def __init__(self, func, kind, options=None):
+        assert kind in KINDS, f'unsupported operation kind: {kind!r}'
+        if not callable(func):
+            raise TypeError(f'only callables can be marked as {kind!r} operations, got: {func!r}')
+        # marking a marked function replaces its kind
+        if isinstance(func, MarkedFunction):
+            func = func.__wrapped__
+        functools.update_wrapper(self, func)
+        self.kind = kind
+        self.options = {} if (options is None) else dict(options)
+
+    def __call__(self, *args, **kwargs):
+        return self.__wrapped__(*args, **kwargs)
+
+    def __get__(self, instance, owner=None):
+        # methods stay marked once bound
+        if instance is None:
+            return self
+        return MarkedFunction(self.__wrapped__.__get__(instance, owner), self.kind, self.options)
+
+    def __reduce__(self):
+        # module level functions are pickled by reference, like functions
+        obj = sys.modules.get(self.__module__)
+        for name in self.__qualname__.split('.'):
+            obj = getattr(obj, name, None)
+        if obj is self:
+            return self.__qualname__
+        return MarkedFunction, (self.__wrapped__, self.kind, self.options)
+
+    def __repr__(self):
+        return f'<slipform.MarkedFunction kind={self.kind} {self.__wrapped__!r}>'
+
+
+INLINE_ATTR = '__slipform_inline__'
+
+
+def inline(func):
+    """
+    Mark a function to be translated like ``@slipform`` and inlined into
+    the graphs of slipform functions that call it, instead of being called.
+    """
+    try:
+        setattr(func, INLINE_ATTR, None)
+    except (AttributeError, TypeError):
+        raise TypeError(f'only python functions can be marked for inlining, got: {func!r}')
+    return func
+
+
+def get_inline_graph(func):
+    """
+    Get the graph of a function marked for inlining, translated on first use.
+    """
+    graph = getattr(func, INLINE_ATTR)
+    if graph is None:
+        from slipform import slipform
+        graph = slipform(func)
+        setattr(func, INLINE_ATTR, graph)
+    return graph
+
+
+# methods of random number generators that do not draw samples
+_RNG_STATE_METHODS = frozenset({'seed', 'getstate', 'setstate', 'get_state', 'set_state', 'spawn'})
+
+
+def _is_rng_method(func):
+    owner = getattr(func, '__self__', None)
+    if (owner is None) or (getattr(func, '__name__', None) in _RNG_STATE_METHODS):
+        return False
+    if isinstance(owner, random.Random):
+        return True
+    np_random = sys.modules.get('numpy.random')
+    return (np_random is not None) and isinstance(owner, (np_random.RandomState, np_random.Generator))
+
+
+def get_kind(func):
+    # operations create new operations for any attribute access
+    if isinstance(func, pf.Operation):
+        return None
+    if isinstance(func, MarkedFunction):
+        return func.kind
+    # sampling from python or numpy generators, eg. ``random.uniform``
+    # or ``np.random.normal``, is stochastic without being marked
+    if _is_rng_method(func):
+        return KIND_STOCHASTIC
+    return None
+
+
+def pure(func=None, *, maxsize=128):
+    """
+    Mark a function as pure. Calls inside slipform functions become
+    operations whose results are cached on the hashed arguments.
+    """
+    if func is None:
+        return functools.partial(pure, maxsize=maxsize)
+    return MarkedFunction(func, KIND_PURE, dict(maxsize=maxsize))
+
+
+def io(func):
+    """
+    Mark a function as I/O bound. Calls inside slipform functions
+    become ``io`` operations, which run concurrently in threads.
+    """
+    return MarkedFunction(func, KIND_IO)
+
+
+def cpu_heavy(func):
+    """
+    Mark a function as CPU bound. Calls inside slipform functions become
+    ``cpu_heavy`` operations, which run concurrently in processes if the
+    function can be pickled, see ``slipform.Scheduler``.
+    """
+    return MarkedFunction(func, KIND_CPU_HEAVY)
+
+
+def stochastic(func):
+    """
+    Mark a function as non-deterministic, eg. sampling. Calls inside
+    slipform functions become ``stochastic`` operations, whose outputs
+    can be recorded and replayed, see ``slipform.record``. Methods of
+    ``random.Random`` and numpy generators, including the functions of
+    the ``random`` and ``np.random`` modules, do not need to be marked.
+    """
+    return MarkedFunction(func, KIND_STOCHASTIC)
+
+
+# ========================================================================= #
+# Operations                                                                #
+# ========================================================================= #
+
+
+class func_op(pf.func_op):  # pylint: disable=C0103
+    """
+    Operation wrapper for functions marked with an operation kind.
+
+    Unlike ``pf.func_op`` the arguments are stored as a tuple and dict
+    so that keyword arguments of the target (eg. ``name``) can never
+    clash with the keyword arguments of ``pf.Operation``.
+    """
+
+    def __init__(self, target, args=(), kwargs=None, *, kind=None, **options):
+        super().__init__(target, tuple(args), {} if kwargs is None else dict(kwargs), **options)
+        self.kind = get_kind(target) if kind is None else kind
+        self._cached_target = self._make_cache()
+
+    def _make_cache(self):
+        # pure functions are cached on their (hashable) arguments
+        if self.kind != KIND_PURE:
+            return None
+        maxsize = self.target.options.get('maxsize', 128) if isinstance(self.target, MarkedFunction) else 128
+        return functools.lru_cache(maxsize=maxsize)(self.target)
+
+    def __getstate__(self):
+        # copies, eg. in fused or specialized graphs, cache their own results
+        state = dict(self.__dict__)
+        state.pop('_cached_target', None)
+        return state
+
+    def __setstate__(self, data):
+        self.__dict__.update(data)
+        self._cached_target = self._make_cache()
+
+    def _evaluate(self, args, kwargs):  # pylint: disable=W0221
+        if self._cached_target is not None:
+            try:
+                hash((args, tuple(kwargs.items())))
+            except TypeError:
+                pass
+            else:
+                return self._cached_target(*args, **kwargs)
+        return self.target(*args, **kwargs)
+
+    def __repr__(self):
+        return "<slipform.func_op '%s' kind=%s target=%s>" % (self.name, self.kind, self.target)
+
+
+# ========================================================================= #
+# Typed Placeholders                                                        #
+# ========================================================================= #
+
+
+class Spec:
+    """
+    Type, shape and dtype of a placeholder, obtained from the argument
+    annotations of slipform functions. Entries of ``shape`` that are
+    ``None`` can vary between calls, eg. the batch dimension.
+
+        @slipform
+        def graph(x: Spec(shape=(None, 3), dtype='float32'), scale: float = 1.0):
+            ...
+    """
+
+    def __init__(self, type=None, shape=None, dtype=None):  # pylint: disable=W0622
+        self.type = type
+        self.shape = None if (shape is None) else tuple(shape)
+        self.dtype = dtype
+
+    @classmethod
+    def from_annotation(cls, annotation):
+        if annotation is None:
+            return None
+        if isinstance(annotation, Spec):
+            return annotation
+        return cls(type=annotation)
+
+    @property
+    def is_array(self):
+        return (self.shape is not None) or (self.dtype is not None) or (getattr(self.type, '__name__', None) == 'ndarray')
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(type={self.type!r}, shape={self.shape!r}, dtype={self.dtype!r})'
+
+
+# suffix of the names of the placeholders of reassigned arguments
+INPUT_SUFFIX = ':input'
+
+
+class placeholder(pf.placeholder):  # pylint: disable=C0103
+    """
+    Placeholder with an optional type annotation and default value.
+    The default is only evaluated if no value is given for the
+    placeholder in the context.
+
+    If ``argument`` is given, values for the placeholder are given by
+    that name instead of the name of the placeholder, eg. for arguments
+    that are reassigned, whose names refer to their last version.
+    """
+
+    def __init__(self, name=None, *, annotation=None, default=UNBOUND, argument=None, **kwargs):  # pylint: disable=W0231
+        pf.Operation.__init__(self, *(() if (default is UNBOUND) else (default,)), name=name, **kwargs)
+        self.annotation = annotation
+        self.argument = argument
+        self.spec = Spec.from_annotation(annotation)
+
+    @property
+    def has_default(self):
+        return bool(self.args)
+
+    def _evaluate(self, *default):  # pylint: disable=W0221
+        if default:
+            return default[0]
+        return super()._evaluate()
+
+    def __repr__(self):
+        return "<slipform.placeholder '%s' annotation=%r>" % (self.name, self.annotation)
+
+
+def get_placeholder_specs(graph):
+    """
+    Get the specs of all annotated placeholders of a graph.
+    """
+    return {
+        name: op.spec
+        for name, op in get_placeholders(graph).items()
+        if isinstance(op, placeholder) and (op.spec is not None)
+    }
+
+
+# ========================================================================= #
+# Translation Helpers                                                       #
+# ========================================================================= #
+
+
+def constant(value):
+    """
+    Operation for a literal of a translated function. Equal literals share
+    a single operation in the graph being built, unless they are evaluated
+    under different control dependencies, eg. inside of an assertion.
+    """
+    graph = pf.Graph.get_active_graph()
+    pool = getattr(graph, '_constants', None)
+    if pool is None:
+        return pf.constant(value)
+    # 1, 1.0 and True are equal, but are different constants
+    key = (type(value), value, tuple(map(id, graph.dependencies)))
+    op = pool.get(key)
+    if op is None:
+        pool[key] = op = pf.constant(value)
+    return op
+
+
+def _raise_unbound(name):
+    raise UnboundLocalError(f"local variable '{name}' referenced before assignment")
+
+
+def unbound(name):
+    """
+    Operation standing in for a name that was not assigned
+    along the branch that was selected during evaluation.
+    """
+    return pf.func_op(_raise_unbound, name)
+
+
+def _pack(*values):
+    return values
+
+
+def pack(*values):
+    """
+    Operation packing values into a tuple. Unlike tuples of operations,
+    failures are reported correctly by pythonflow.
+    """
+    return pf.func_op(_pack, *values)
+
+
+def _unpack(values, i, name):
+    if values[i] is UNBOUND:
+        _raise_unbound(name)
+    return values[i]
+
+
+def unpack(values, i, name):
+    """
+    Operation extracting the value of ``name`` from packed values.
+    """
+    return pf.func_op(_unpack, values, i, name)
+
+
+def select(predicate, x, y):
+    """
+    Select between the values of two branches, lazily if
+    the predicate is an operation, otherwise immediately.
+    """
+    if isinstance(predicate, pf.Operation):
+        return pf.conditional(predicate, x, y)
+    return x if predicate else y
+
+
+ACCESS_ATTR = 'attr'
+ACCESS_ITEM = 'item'
+
+
+def _access(value, path):
+    for kind, key in path:
+        value = getattr(value, key) if (kind == ACCESS_ATTR) else value[key]
+    return value
+
+
+def access(value, *path):
+    """
+    Get a chain of attributes and items, eg. ``batch['x'][0].shape``.
+    Once the value or one of the keys is an operation, the rest of the
+    chain becomes a single operation instead of one operation per step.
+    """
+    for i, (kind, key) in enumerate(path):
+        if isinstance(value, pf.Operation) or any(iter_refs(key)):
+            return pf.func_op(_access, value, path[i:])
+        value = getattr(value, key) if (kind == ACCESS_ATTR) else value[key]
+    return value
+
+
+def elementwise(tree, *values):
+    """
+    Evaluate a fused tree of arithmetic operators, see ``slipform._kernel``.
+    If any of the values is an operation, the whole tree becomes a single
+    operation instead of one operation per operator.
+    """
+    kernel = get_kernel(tree)
+    if any(isinstance(value, pf.Operation) for value in values):
+        return pf.func_op(kernel, *values)
+    return kernel(*values)
+
+
+COMPARE_OPS = {
+    'Eq': operator.eq,
+    'NotEq': operator.ne,
+    'Lt': operator.lt,
+    'LtE': operator.le,
+    'Gt': operator.gt,
+    'GtE': operator.ge,
+    'Is': operator.is_,
+    'IsNot': operator.is_not,
+    'In': lambda a, b: a in b,
+    'NotIn': lambda a, b: a not in b,
+}
+
+
+def _compare(left, comparisons):
+    # same as python, the first false result is returned
+    for name, right in comparisons:
+        result = COMPARE_OPS[name](left, right)
+        if not result:
+            return result
+        left = right
+    return result
+
+
+def compare(left, *comparisons):
+    """
+    Evaluate a chain of comparisons, eg. ``a < b <= c`` or ``a not in b``,
+    as a single operation if any of the operands is an operation.
+    """
+    if isinstance(left, pf.Operation) or any(isinstance(right, pf.Operation) for _, right in comparisons):
+        return pf.func_op(_compare, left, comparisons)
+    return _compare(left, comparisons)
+
+
+# builtins that consume their arguments, eg. the elements of a
+# sequence placeholder, are called once the arguments are known
+_DEFERRED_BUILTINS = {len, sum, min, max, any, all, sorted, list, tuple, set, dict, range}
+# builtins returning iterators return lists instead, so that they can be used more than once
+_DEFERRED_ITERATORS = {zip, map, filter, enumerate, reversed}
+
+
+def _materialize(func, *args, **kwargs):
+    return list(func(*args, **kwargs))
+
+
+_DEFERRED_TARGETS = {
+    **{func: func for func in _DEFERRED_BUILTINS},
+    **{func: functools.partial(_materialize, func) for func in _DEFERRED_ITERATORS},
+}
+
+
+def call(func, /, *args, **kwargs):
+    """
+    Target of all translated function calls. Functions marked with
+    an operation kind become operations, other slipform graphs and
+    functions marked with ``inline`` are inlined, everything else is
+    called directly as before, relying on pythonflow operator overloading.
+    """
+    if isinstance(func, pf.Operation):
+        return func(*args, **kwargs)
+    if get_kind(func) is not None:
+        return func_op(func, args, kwargs)
+    if isinstance(func, SlipformGraph):
+        return inline_graph(func, *args, **kwargs)
+    if hasattr(func, INLINE_ATTR):
+        return inline_graph(get_inline_graph(func), *args, **kwargs)
+    try:
+        target = _DEFERRED_TARGETS.get(func)
+    except TypeError:
+        target = None
+    if (target is not None) and any(True for _ in iter_refs((args, kwargs))):
+        # keyword arguments such as ``name`` are passed to the builtin, not to the operation
+        return func_op(target, args, kwargs)
+    return func(*args, **kwargs)
+
+
+def _unpack_arguments(args, kwargs):
+    unpacked_args, unpacked_kwargs = [], {}
+    for starred, value in args:
+        if starred:
+            unpacked_args.extend(value)
+        else:
+            unpacked_args.append(value)
+    for key, value in kwargs:
+        items = value.items() if (key is None) else [(key, value)]
+        for k, v in items:
+            if k in unpacked_kwargs:
+                raise TypeError(f'got multiple values for keyword argument {k!r}')
+            unpacked_kwargs[k] = v
+    return unpacked_args, unpacked_kwargs
+
+
+def _call_unpacked(func, args, kwargs):
+    args, kwargs = _unpack_arguments(args, kwargs)
+    return func(*args, **kwargs)
+
+
+def call_unpacked(func, args, kwargs):
+    """
+    Target of translated calls that unpack arguments, eg. ``f(a, *xs, **kw)``,
+    given as ``(starred, value)`` and ``(key, value)`` pairs where the key
+    is ``None`` for unpacked mappings. If any of the unpacked values is an
+    operation, eg. a variable positional argument, the call becomes an
+    operation of the same kind as the function.
+    """
+    unpacked = [value for starred, value in args if starred] + [value for key, value in kwargs if key is None]
+    if not any(isinstance(value, pf.Operation) for value in unpacked):
+        args, kwargs = _unpack_arguments(args, kwargs)
+        return call(func, *args, **kwargs)
+    if isinstance(func, SlipformGraph) or hasattr(func, INLINE_ATTR):
+        raise TypeError(f'cannot inline graph {func!r} with arguments that are only known when the graph is evaluated')
+    return func_op(_call_unpacked, (func, args, kwargs), kind=get_kind(func))
@@ -0,0 +1,318 @@
+"""
+Hooks called around the evaluation of each operation of a slipform graph.
+
+    class Logger(Hooks):
+        def on_op_end(self, info, error):
+            print(info.name, info.lineno, error)
+
+    graph.add_hooks(Logger())
+    graph.add_hooks(SpanExporter('spans.jsonl'))
+
+Graphs without hooks are evaluated without any per-operation overhead,
+hooks are only looked at once per call to choose how to evaluate it.
+"""
+
+import json
+import secrets
+import threading
+import time
+from typing import NamedTuple, Optional
+
+import pythonflow as pf
+
+from slipform import __version__
+
+
+# ========================================================================= #
+# Hooks                                                                     #
+# ========================================================================= #
+
+
+class OperationInfo(NamedTuple):
+    operation: pf.Operation
+    # name assigned by the translator, or generated
+    name: str
+    # class of the operation, eg. ``'func_op'``
+    type: str
+    # ``'pure'``, ``'io'``, ``'cpu_heavy'``, ``'stochastic'`` or None
+    kind: Optional[str]
+    # original source that generated the operation, if known
+    filename: Optional[str]
+    lineno: Optional[int]
+    source: Optional[str]
+
+
+class Hooks:
+    """
+    Base class of hooks added to a graph with ``SlipformGraph.add_hooks``.
+    Override any of the methods, by default they do nothing.
+
+    The hooks of lazy operations, conditionals and try blocks, enclose
+    those of the operations in the branches that they evaluate.
+    """
+
+    def on_call_start(self, graph, fetches):
+        pass
+
+    def on_call_end(self, graph, fetches, error):
+        pass
+
+    def on_op_start(self, info: OperationInfo):
+        pass
+
+    def on_op_end(self, info: OperationInfo, error: Optional[BaseException]):
+        pass
+
+
+def get_operation_info(graph, op) -> OperationInfo:
+    from slipform._explain import get_source
+    from slipform._runtime import func_op
+    source = get_source(graph, op)
+    return OperationInfo(
+        operation=op,
+        name=op.name,
+        type=type(op).__name__,
+        kind=op.kind if isinstance(op, func_op) else None,
+        filename=None if (source is None) else source[0],
+        lineno=None if (source is None) else source[1],
+        source=None if (source is None) else source[2],
+    )
+
+
+class _HookScope:
+    __slots__ = ('hooks', 'info')
+
+    def __init__(self, hooks, info):
+        self.hooks = hooks
+        self.info = info
+
+    def __enter__(self):
+        for hook in self.hooks:
+            hook.on_op_start(self.info)
+
+    def __exit__(self, type_, error, traceback):
+        for hook in reversed(self.hooks):
+            hook.on_op_end(self.info, error)
+
+
+class HooksCallback:
+    """
+    Pythonflow style callback that calls the hooks of a graph around each
+    operation, with the information about the operation cached.
+    """
+
+    __slots__ = ('graph', 'hooks', '_infos')
+
+    def __init__(self, graph, hooks):
+        self.graph = graph
+        self.hooks = tuple(hooks)
+        # looking up the source of an operation is slow
+        self._infos = {}
+
+    def get_info(self, op) -> OperationInfo:
+        info = self._infos.get(op)
+        if info is None:
+            self._infos[op] = info = get_operation_info(self.graph, op)
+        return info
+
+    def __call__(self, operation, context):
+        return _HookScope(self.hooks, self.get_info(operation))
+
+    def call(self, fetches, evaluate):
+        for hook in self.hooks:
+            hook.on_call_start(self.graph, fetches)
+        try:
+            values = evaluate()
+        except BaseException as error:
+            for hook in reversed(self.hooks):
+                hook.on_call_end(self.graph, fetches, error)
+            raise
+        for hook in reversed(self.hooks):
+            hook.on_call_end(self.graph, fetches, None)
+        return values
+
+
+class ChainedCallback:
+    """
+    Callback that enters several pythonflow style callbacks in order.
+    """
+
+    __slots__ = ('callbacks',)
+
+    def __init__(self, *callbacks):
+        self.callbacks = callbacks
+
+    def __call__(self, operation, context):
+        return _ChainedScope([callback(operation, context) for callback in self.callbacks])
+
+
+class _ChainedScope:
+    __slots__ = ('scopes', 'entered')
+
+    def __init__(self, scopes):
+        self.scopes = scopes
+        self.entered = 0
+
+    def __enter__(self):
+        for scope in self.scopes:
+            scope.__enter__()
+            self.entered += 1
+
+    def __exit__(self, *exc_info):
+        suppress = False
+        for scope in reversed(self.scopes[:self.entered]):
+            if scope.__exit__(*exc_info):
+                suppress, exc_info = True, (None, None, None)
+        return suppress
+
+
+# ========================================================================= #
+# OpenTelemetry Spans                                                       #
+# ========================================================================= #
+
+
+# https://opentelemetry.io/docs/specs/otlp/#json-protobuf-encoding
+_SPAN_KIND_INTERNAL = 1
+_STATUS_CODE_ERROR = 2
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        # 64 bit integers are encoded as strings
+        return {'key': key, 'value': {'intValue': str(value)}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+class _Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'start', 'attributes')
+
+    def __init__(self, trace_id, parent_id, name, attributes):
+        self.trace_id = trace_id
+        # the global generator is never used, so seeded runs are not affected
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time_ns()
+
+    def to_json(self, error):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id,
+            'name': self.name,
+            'kind': _SPAN_KIND_INTERNAL,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(time.time_ns()),
+            'attributes': [_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+            'status': {},
+        }
+        if error is not None:
+            span['status'] = {'code': _STATUS_CODE_ERROR, 'message': f'{type(error).__name__}: {error}'}
+        return span
+
+
+class SpanExporter(Hooks):
+    """
+    Hooks recording a span for each call of a graph, and a child span
+    for each of the operations that it evaluates.
+
+    Spans are encoded like the JSON protobuf encoding of the OpenTelemetry
+    protocol (OTLP), the spans of each call of a graph are exported together
+    as one ``ExportTraceServiceRequest``. They are either written to ``file``,
+    a path or a file-like object, as one request per line, which is the format
+    read by the ``otlpjsonfile`` receiver of the OpenTelemetry collector, or
+    passed to ``export``, a function taking a request, eg. to post it to an
+    OTLP/HTTP endpoint.
+    """
+
+    def __init__(self, file=None, export=None, service_name='slipform'):
+        if (file is None) == (export is None):
+            raise ValueError('exactly one of `file` or `export` must be given')
+        # paths are opened on the first export
+        self.path = file if isinstance(file, str) else None
+        self._file = None if isinstance(file, str) else file
+        self._export = export
+        self.service_name = service_name
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        # spans of each thread are nested separately
+        local = self._local
+        if not hasattr(local, 'stack'):
+            local.stack, local.finished = [], []
+        return local.stack
+
+    def _start(self, name, attributes):
+        stack = self._stack()
+        if stack:
+            trace_id, parent_id = stack[-1].trace_id, stack[-1].span_id
+        else:
+            trace_id, parent_id = secrets.token_hex(16), ''
+        stack.append(_Span(trace_id, parent_id, name, attributes))
+
+    def _end(self, error):
+        stack, finished = self._stack(), self._local.finished
+        finished.append(stack.pop().to_json(error))
+        # export once the root span of the trace ends
+        if not stack:
+            spans = finished[:]
+            finished.clear()
+            self.export_spans(spans)
+
+    def on_call_start(self, graph, fetches):
+        fn = getattr(graph, '_orig_fn', None)
+        self._start(getattr(fn, '__qualname__', type(graph).__name__), {
+            'slipform.fetches': ','.join(fetch.name for fetch in fetches),
+            'code.function': getattr(fn, '__name__', None),
+            'code.namespace': getattr(fn, '__module__', None),
+        })
+
+    def on_call_end(self, graph, fetches, error):
+        self._end(error)
+
+    def on_op_start(self, info):
+        self._start(info.name, {
+            'slipform.op': info.type,
+            'slipform.kind': info.kind,
+            'code.filepath': info.filename,
+            'code.lineno': info.lineno,
+            'code.source': info.source,
+        })
+
+    def on_op_end(self, info, error):
+        self._end(error)
+
+    def export_spans(self, spans):
+        request = {'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', self.service_name)]},
+            'scopeSpans': [{
+                'scope': {'name': 'slipform', 'version': __version__},
+                'spans': spans,
+            }],
+        }]}
+        if self._export is not None:
+            self._export(request)
+            return
+        line = json.dumps(request, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')  # pylint: disable=R1732
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            # files that were given are closed by the caller
+            if (self.path is not None) and (self._file is not None):
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
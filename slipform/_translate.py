@@ -1,6 +1,11 @@
 import ast
-from astmonkey.transformers import ParentChildNodeTransformer
-from slipform._ast_utils import ast_dfs_walk
+from slipform._ast_utils import ast_dfs_walk, ast_parse_unlocated
+from slipform._kernel import BINARY_OPS, UNARY_OPS
+from slipform._runtime import ACCESS_ATTR, ACCESS_ITEM, INPUT_SUFFIX, RUNTIME_NAME
+
+
+# prefix of all names generated by slipform
+INTERNAL_PREFIX = '_slipform_'
 
 
 # ========================================================================= #
@@ -43,18 +48,6 @@ def get_assign_target_names(assign_node: ast.Assign, flat=True):
 # ========================================================================= #
 
 
-def walk_parents(node, include_self=False):
-    if include_self:
-        yield node
-    while True:
-        if not hasattr(node, 'parent'):
-            raise AttributeError('node not visited by astmonkey.ParentChildNodeTransformer')
-        if node.parent is None:
-            break
-        node = node.parent
-        yield node
-
-
 def walk_calls(node, include_self=True):
     if include_self:
         yield node
@@ -78,6 +71,286 @@ def get_root_call(node):
     return root_node
 
 
+# ========================================================================= #
+# Context Tracking                                                          #
+# ========================================================================= #
+
+
+class ContextNodeTransformer(ast.NodeTransformer):
+    """
+    Node transformer that keeps track of the chain of nodes
+    enclosing the node that is currently being visited.
+    """
+
+    def __init__(self):
+        self.parents = []
+
+    def visit(self, node):
+        self.parents.append(node)
+        try:
+            return super().visit(node)
+        finally:
+            self.parents.pop()
+
+    @property
+    def parent(self):
+        # the current node is the last entry
+        return self.parents[-2] if (len(self.parents) > 1) else None
+
+
+# ========================================================================= #
+# Branch Renaming                                                           #
+# ========================================================================= #
+
+
+class _RenameLoads(ast.NodeTransformer):
+    """
+    Rename all loaded names according to a mapping, respecting
+    the scope introduced by the arguments of lambda functions.
+    """
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load) and (node.id in self.mapping):
+            return ast.copy_location(ast.Name(id=self.mapping[node.id], ctx=ast.Load()), node)
+        return node
+
+    def visit_Lambda(self, node):
+        shadowed = {arg.arg for arg in ast.walk(node.args) if isinstance(arg, ast.arg)}
+        visitor = _RenameLoads({k: v for k, v in self.mapping.items() if k not in shadowed})
+        node.body = visitor.visit(node.body)
+        return node
+
+
+class _RenameStores(ast.NodeTransformer):
+    """
+    Rename all stored names to fresh names, recording the renames.
+    """
+
+    def __init__(self, prefix, mapping, counts):
+        self.prefix, self.mapping, self.counts = prefix, mapping, counts
+
+    def visit_Name(self, node):
+        # names generated by slipform are already unique
+        if not isinstance(node.ctx, ast.Store) or node.id.startswith(INTERNAL_PREFIX):
+            return node
+        i = self.counts[node.id] = self.counts.get(node.id, -1) + 1
+        self.mapping[node.id] = f'{self.prefix}_{node.id}' + (f'_{i}' if i else '')
+        return ast.copy_location(ast.Name(id=self.mapping[node.id], ctx=ast.Store()), node)
+
+
+def desugar_assignment(stmt):
+    """
+    Convert augmented and annotated assignments to names into normal assignments.
+    """
+    # a += b -> a = a + b
+    if isinstance(stmt, ast.AugAssign) and isinstance(stmt.target, ast.Name):
+        stmt = ast.copy_location(ast.Assign(
+            targets=[ast.Name(id=stmt.target.id, ctx=ast.Store())],
+            value=ast.BinOp(left=ast.Name(id=stmt.target.id, ctx=ast.Load()), op=stmt.op, right=stmt.value),
+        ), stmt)
+    # a: int = b -> a = b
+    if isinstance(stmt, ast.AnnAssign) and isinstance(stmt.target, ast.Name) and (stmt.value is not None):
+        stmt = ast.copy_location(ast.Assign(targets=[stmt.target], value=stmt.value), stmt)
+    return stmt
+
+
+def rename_branch_assignments(stmts, prefix):
+    """
+    Rename all names assigned in a straight-line list of statements
+    to fresh names starting with ``prefix`` so that the statements
+    can be hoisted out of their branch without clobbering the names
+    visible to the other branches. Loads after an assignment refer
+    to the renamed version.
+
+    Returns the renamed statements and a mapping from the original
+    names to the final renamed version of each name.
+    """
+    mapping, counts = {}, {}
+    renamed = []
+    for stmt in stmts:
+        stmt = desugar_assignment(stmt)
+        # rename the loads before the stores, eg. ``a = a + 1``
+        if isinstance(stmt, ast.Assign):
+            stmt.value = _RenameLoads(dict(mapping)).visit(stmt.value)
+            stmt.targets = [_RenameStores(prefix, mapping, counts).visit(_RenameLoads(dict(mapping)).visit(t)) for t in stmt.targets]
+        elif isinstance(stmt, ast.With):
+            stmt.items = [_RenameLoads(dict(mapping)).visit(item) for item in stmt.items]
+            stmt.body, body_mapping = rename_branch_assignments(stmt.body, prefix)
+            mapping.update(body_mapping)
+        else:
+            stmt = _RenameLoads(dict(mapping)).visit(stmt)
+        renamed.append(stmt)
+    return renamed, mapping
+
+
+def make_branch_value(name, mapping, out_name, unbound=None):
+    """
+    Get the name holding the value of ``name`` at the end of a branch,
+    and the statements needed to compute it. Names that are never
+    assigned in the branch refer to their outer value, which might
+    not exist, in which case evaluation fails like python would.
+
+    from:
+        <name not assigned in branch>
+    to:
+        try:
+            out_name = name
+        except NameError:
+            out_name = __slipform__.unbound('name')
+    """
+    if name in mapping:
+        return mapping[name], []
+    if unbound is None:
+        unbound = f"{RUNTIME_NAME}.unbound('{name}')"
+    stmts = ast_parse_unlocated(
+        f"try:\n"
+        f"    {out_name} = {name}\n"
+        f"except NameError:\n"
+        f"    {out_name} = {unbound}\n"
+    ).body
+    return out_name, stmts
+
+
+# ========================================================================= #
+# Validation                                                                #
+# ========================================================================= #
+
+
+class SlipformSyntaxError(SyntaxError):
+    """
+    Raised before translation if a slipform function uses constructs
+    that cannot be translated, ``errors`` lists all of them as
+    ``(lineno, col_offset, message)``.
+    """
+
+    def __init__(self, func_name, errors):
+        self.errors = errors
+        lines = '\n'.join(f'  line {lineno}, column {col + 1}: {message}' for lineno, col, message in errors)
+        lineno, col, _ = errors[0]
+        super().__init__(f'unsupported syntax in slipform function {func_name!r}:\n{lines}', (None, lineno, col + 1, None))
+
+    def __str__(self):
+        return self.msg
+
+
+class SlipformValidator(ast.NodeVisitor):
+    """
+    Find all constructs that cannot be translated in a single pass over
+    the function, before any of it is rewritten. Nested functions, lambdas
+    and classes are plain python and are not checked.
+    """
+
+    UNSUPPORTED = {
+        ast.For: 'for loops are not supported',
+        ast.AsyncFor: 'for loops are not supported',
+        ast.While: 'while loops are not supported',
+        ast.Return: 'return statements are not supported, all assigned names are outputs',
+        ast.Raise: 'raise statements are not supported, use assert instead',
+        ast.Delete: 'del statements are not supported',
+        ast.Global: 'global statements are not supported',
+        ast.Nonlocal: 'nonlocal statements are not supported',
+        ast.AsyncWith: 'async with statements are not supported',
+        ast.Yield: 'yield expressions are not supported',
+        ast.YieldFrom: 'yield expressions are not supported',
+        ast.Await: 'await expressions are not supported',
+        # added in python 3.10 and 3.11
+        **({ast.Match: 'match statements are not supported'} if hasattr(ast, 'Match') else {}),
+        **({ast.TryStar: 'try statements with except* are not supported'} if hasattr(ast, 'TryStar') else {}),
+    }
+
+    def __init__(self):
+        self.errors = []
+
+    def validate(self, node):
+        self.errors = []
+        self.visit(node)
+        if self.errors:
+            func = next((n for n in ast.walk(node) if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))), None)
+            raise SlipformSyntaxError(getattr(func, 'name', '<unknown>'), sorted(self.errors, key=lambda e: e[:2]))
+        return node
+
+    def error(self, node, message):
+        self.errors.append((getattr(node, 'lineno', 0), getattr(node, 'col_offset', 0), message))
+
+    def visit(self, node):
+        if type(node) in self.UNSUPPORTED:
+            self.error(node, self.UNSUPPORTED[type(node)])
+        return super().visit(node)
+
+    def visit_Module(self, node):
+        for stmt in node.body:
+            if isinstance(stmt, ast.AsyncFunctionDef):
+                self.error(stmt, 'async functions are not supported')
+            self.visit_function(stmt)
+
+    def visit_function(self, node):
+        args = node.args
+        for default in (*args.defaults, *(d for d in args.kw_defaults if d is not None)):
+            self.visit(default)
+        for stmt in node.body:
+            self.visit(stmt)
+
+    def visit_FunctionDef(self, node):
+        # nested functions are plain python
+        for expr in (*node.decorator_list, *node.args.defaults, *(d for d in node.args.kw_defaults if d is not None)):
+            self.visit(expr)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        for expr in (*node.decorator_list, *node.bases, *(k.value for k in node.keywords)):
+            self.visit(expr)
+
+    def visit_Lambda(self, node):
+        for expr in (*node.args.defaults, *(d for d in node.args.kw_defaults if d is not None)):
+            self.visit(expr)
+
+    def visit_Assign(self, node):
+        for target in node.targets:
+            self.check_target(target)
+        self.generic_visit(node)
+
+    def visit_AugAssign(self, node):
+        self.check_target(node.target)
+        self.generic_visit(node)
+
+    def visit_AnnAssign(self, node):
+        if node.value is not None:
+            self.check_target(node.target)
+        self.generic_visit(node)
+
+    def check_target(self, target):
+        if isinstance(target, (ast.Tuple, ast.List)):
+            for elt in target.elts:
+                self.check_target(elt)
+        elif isinstance(target, ast.Starred):
+            self.error(target, f'starred assignment targets are not supported: {ast.unparse(target)}')
+        elif isinstance(target, ast.Attribute):
+            self.error(target, f'assigning to attributes is not supported: {ast.unparse(target)}')
+        elif isinstance(target, ast.Subscript):
+            self.error(target, f'assigning to items is not supported: {ast.unparse(target)}')
+        elif not isinstance(target, ast.Name):
+            self.error(target, f'unsupported assignment target: {ast.unparse(target)}')
+
+    def visit_Try(self, node):
+        if node.orelse:
+            self.error(node.orelse[0], 'try statements with an else block are not supported')
+        for handler in node.handlers:
+            if handler.name is not None:
+                self.error(handler, f'binding exceptions with "except ... as {handler.name}" is not supported')
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node):
+        if node.level:
+            self.error(node, 'relative imports are not supported')
+        if any(alias.name == '*' for alias in node.names):
+            self.error(node, 'wildcard imports are not supported')
+        self.generic_visit(node)
+
+
 # ========================================================================= #
 # Transform                                                                 #
 # ========================================================================= #
@@ -85,12 +358,21 @@ def get_root_call(node):
 
 class SlipformTransformer(ast.NodeTransformer):
 
+    def __init__(self, optimize=False):
+        self.optimize = optimize
+
     def visit(self, node):
-        node = ParentChildNodeTransformer().visit(node)
+        node = SlipformValidator().validate(node)  # report all unsupported constructs before rewriting
         node = SlipformConstants().visit(node)     # pf.constant
+        node = SlipformCalls().visit(node)         # f(a) -> __slipform__.call(f, a)
+        node = SlipformAccess().visit(node)        # a.b[0] -> __slipform__.access(a, ('attr', 'b'), ('item', 0))
+        node = SlipformElementwise().visit(node)   # a * b + 1 -> __slipform__.elementwise(('Add', ('Mult', 0, 1), 2), a, b, 1)
+        node = SlipformBranches().visit(node)      # if & try statements -> pf.conditional & pf.try_
+        node = SlipformAssert(optimize=self.optimize).visit(node)  # assert c -> with pf.control_dependencies([pf.assert_(c)]): ...
+        node = SlipformSSA().visit(node)           # a = f(a); a += 1 -> _slipform_ssa_a_0 = f(a); a = _slipform_ssa_a_0 + 1
         node = SlipformSetNames().visit(node)      # a.set_name('a')
         node = SlipformPlaceholders().visit(node)  # def func(a) ->  def func(): pl.placeholder('a')
-        node = SlipformIn().visit(node)
+        node = SlipformCompare().visit(node)       # a < b < c -> __slipform__.compare(a, ('Lt', b), ('Lt', c))
         node = SlipformCondition().visit(node)
         return node
 
@@ -122,7 +404,7 @@ class SlipformSetNames(ast.NodeTransformer):
     def make_set_name_node(cls, name):
         assert str.isidentifier(name), f'{name=} is not a valid python identifier.'
         # make the ast node for setting the name
-        set_name_node = ast.parse(f"{name}.set_name('{name}')").body[0]
+        set_name_node = ast_parse_unlocated(f"{name}.set_name('{name}')").body[0]
         return set_name_node
 
     @classmethod
@@ -132,29 +414,37 @@ class SlipformSetNames(ast.NodeTransformer):
         names = get_assign_target_names(node.targets[0])
         if skip_underscores:
             names = (name for name in names if not name.startswith('_'))
-        nodes = [cls.make_set_name_node(name) for i, name in enumerate(names)]
+        nodes = [ast.copy_location(cls.make_set_name_node(name), node) for i, name in enumerate(names)]
         return nodes
 
 
-class SlipformConstants(ast.NodeTransformer):
+class SlipformConstants(ContextNodeTransformer):
     """
-    Replace constants ``value`` with a call
-    to ``pl.constant(value)``
+    Replace constants ``value`` with a call to ``pl.constant(value)``.
+    Constants that are not assigned to a name directly are interned, all
+    uses of equal constants share a single operation of the graph.
 
     from:
-        value
+        a = 1
+        b = a + 1
     to:
-        pl.constant(value)
+        a = pl.constant(1)
+        b = a + __slipform__.constant(1)
     """
 
+    def visit_arg(self, node):
+        # annotations are never wrapped
+        return node
+
     def visit_Constant(self, node):
-        if not self.constant_needs_wrapper(node):
+        if not self.constant_needs_wrapper(node, self.parent):
             return node
         # wrap the actual constant
         # node -> pf.constant(node)
         return ast.Call(
             func=ast.Attribute(
-                value=ast.Name(id='pf', ctx=ast.Load()),
+                # assigned constants are renamed, so they cannot be shared
+                value=ast.Name(id='pf' if self.is_assigned() else RUNTIME_NAME, ctx=ast.Load()),
                 attr='constant',
                 ctx=ast.Load(),
             ),
@@ -162,17 +452,30 @@ class SlipformConstants(ast.NodeTransformer):
             keywords=[],
         )
 
+    def is_assigned(self):
+        # the current node is the last entry, unpacked tuples are assigned too
+        node, parents = self.parents[-1], self.parents[-2::-1]
+        for parent in parents:
+            if isinstance(parent, (ast.Assign, ast.AnnAssign, ast.NamedExpr)):
+                return node is parent.value
+            if not isinstance(parent, (ast.Tuple, ast.List, ast.Starred)):
+                return False
+            node = parent
+        return False
+
     @classmethod
-    def constant_needs_wrapper(cls, node):
+    def constant_needs_wrapper(cls, node, parent):
         """
         check if we can skip the node based on the call tree.
         eg. we can skip ``pf.constant(5)`` so it doesn't
         become ``pf.constant(pf.constant(5))``
         TODO: the rules for this need to be fleshed out.
         """
+        if parent is None:
+            return True
         try:
-            root_call = get_root_call(node.parent)
-        except:
+            root_call = get_root_call(parent)
+        except TypeError:
             return True
         if isinstance(root_call, ast.Name):
             if root_call.id == 'pf':
@@ -182,54 +485,570 @@ class SlipformConstants(ast.NodeTransformer):
 
 class SlipformPlaceholders(ast.NodeTransformer):
     """
+    Arguments with annotations or defaults become typed placeholders,
+    defaults are evaluated if no value is given for the placeholder.
+    Variable positional arguments become a placeholder for a sequence
+    and variable keyword arguments a placeholder for a mapping, which
+    are empty by default. The placeholders of arguments that are
+    reassigned are named ``'<argument>:input'``, the name of the argument
+    belongs to its last version, but values are still given by argument.
+
     from:
-        def func(a):
+        def func(a, b: float = 1.0, *xs, c=2, **kw):
     to:
         def func():
             a = pl.placeholder('a')
+            b = __slipform__.placeholder('b', annotation=float, default=1.0)
+            xs = __slipform__.placeholder('xs', default=())
+            c = __slipform__.placeholder('c', default=2)
+            kw = __slipform__.placeholder('kw', default={})
     """
 
     def visit_FunctionDef(self, node):
-        assert not node.args.posonlyargs, f'FunctionDef.args.posonlyargs is not yet supported: {node.args.posonlyargs}'
-        assert not node.args.vararg,      f'FunctionDef.args.vararg is not yet supported: {node.args.vararg}'
-        assert not node.args.kwonlyargs,  f'FunctionDef.args.kwonlyargs is not yet supported: {node.args.kwonlyargs}'
-        assert not node.args.kw_defaults, f'FunctionDef.args.kw_defaults is not yet supported: {node.args.kw_defaults}'
-        assert not node.args.kwarg,       f'FunctionDef.args.kwarg is not yet supported: {node.args.kwarg}'
-        assert not node.args.defaults,    f'FunctionDef.args.defaults is not yet supported: {node.args.defaults}'
+        # defaults are aligned to the last positional arguments
+        positional = [*node.args.posonlyargs, *node.args.args]
+        args = [*positional, *node.args.kwonlyargs]
+        defaults = [None] * (len(positional) - len(node.args.defaults)) + [*node.args.defaults, *node.args.kw_defaults]
+        if node.args.vararg:
+            args.insert(len(positional), node.args.vararg)
+            defaults.insert(len(positional), ast.Tuple(elts=[], ctx=ast.Load()))
+        if node.args.kwarg:
+            args.append(node.args.kwarg)
+            defaults.append(ast.Dict(keys=[], values=[]))
+        reassigned = set(SlipformSSA.iter_stores(node.body))
         # convert arguments to placeholders
         # at the start of the function
-        for arg in node.args.args[::-1]:
-            assert str.isidentifier(arg.arg)
-            placeholder = ast.parse(f"{arg.arg} = pf.placeholder('{arg.arg}')").body[0]
-            node.body.insert(0, placeholder)
+        for arg, default in reversed(list(zip(args, defaults))):
+            node.body.insert(0, ast.copy_location(self.make_placeholder_node(arg, default, reassigned=arg.arg in reassigned), arg))
         # clear the arguments from the function definition
-        node.args.args.clear()
+        node.args = ast.arguments(posonlyargs=[], args=[], kwonlyargs=[], kw_defaults=[], defaults=[])
+        node.returns = None
         return node
 
+    @classmethod
+    def make_placeholder_node(cls, arg: ast.arg, default=None, reassigned=False):
+        assert str.isidentifier(arg.arg)
+        placeholder = ast_parse_unlocated(f"{arg.arg} = pf.placeholder('{arg.arg}')").body[0]
+        if (arg.annotation is None) and (default is None) and not reassigned:
+            return placeholder
+        # typed placeholder
+        # a = __slipform__.placeholder('a', annotation=..., default=...)
+        placeholder.value.func.value.id = RUNTIME_NAME
+        if reassigned:
+            # a = __slipform__.placeholder('a:input', argument='a')
+            placeholder.value.args[0].value = f'{arg.arg}{INPUT_SUFFIX}'
+            placeholder.value.keywords.append(ast.keyword(arg='argument', value=ast.Constant(value=arg.arg)))
+        if arg.annotation is not None:
+            placeholder.value.keywords.append(ast.keyword(arg='annotation', value=arg.annotation))
+        if default is not None:
+            placeholder.value.keywords.append(ast.keyword(arg='default', value=default))
+        return placeholder
 
-class SlipformIn(ast.NodeTransformer):
 
-    def visit_Compare(self, node):
-        # basic checks
-        if len(node.comparators) != 1 or len(node.ops) != 1:
-            print('WARNING: skipped in node, this is a bug, better checks are needed!')
-            return
-        if not isinstance(node.ops[0], ast.In):
-            return
-        # wrap the in comparator
-        # a in B -> pf.contains(B, a)
+class SlipformCalls(ast.NodeTransformer):
+    """
+    Route function calls through the slipform runtime, which converts
+    calls to functions marked as ``pure``, ``io`` or ``cpu_heavy``
+    into explicit operations. Calls into ``pf`` are left untouched.
+
+    Calls that unpack arguments are unpacked by the runtime, which
+    defers the call until the unpacked values are known if needed.
+
+    from:
+        b = f(a, key=c)
+        d = f(a, *xs, key=c, **kw)
+    to:
+        b = __slipform__.call(f, a, key=c)
+        d = __slipform__.call_unpacked(f, ((False, a), (True, xs)), (('key', c), (None, kw)))
+    """
+
+    SKIP_ROOTS = ('pf', RUNTIME_NAME)
+    # builtins that inspect the frame of their caller
+    SKIP_FUNCS = ('eval', 'exec', 'locals', 'globals', 'vars', 'dir', 'super')
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if not self.call_needs_wrapper(node):
+            return node
+        if any(isinstance(arg, ast.Starred) for arg in node.args) or any(kw.arg is None for kw in node.keywords):
+            return self.make_unpacked_call(node)
         return ast.Call(
             func=ast.Attribute(
-                value=ast.Name(id='pf', ctx=ast.Load()),
-                attr='contains',
+                value=ast.Name(id=RUNTIME_NAME, ctx=ast.Load()),
+                attr='call',
                 ctx=ast.Load(),
             ),
-            args=[
-                node.comparators[0],  # right
-                node.left,            # left
-            ],
+            args=[node.func, *node.args],
+            keywords=node.keywords,
+        )
+
+    @classmethod
+    def make_unpacked_call(cls, node):
+        def pair(a, b):
+            return ast.Tuple(elts=[ast.Constant(a), b], ctx=ast.Load())
+        args = [pair(True, arg.value) if isinstance(arg, ast.Starred) else pair(False, arg) for arg in node.args]
+        kwargs = [pair(kw.arg, kw.value) for kw in node.keywords]
+        return ast.Call(
+            func=ast.Attribute(
+                value=ast.Name(id=RUNTIME_NAME, ctx=ast.Load()),
+                attr='call_unpacked',
+                ctx=ast.Load(),
+            ),
+            args=[node.func, ast.Tuple(elts=args, ctx=ast.Load()), ast.Tuple(elts=kwargs, ctx=ast.Load())],
+            keywords=[],
+        )
+
+    @classmethod
+    def call_needs_wrapper(cls, node):
+        if isinstance(node.func, ast.Name) and node.func.id in cls.SKIP_FUNCS:
+            return False
+        try:
+            root_call = get_root_call(node.func)
+        except TypeError:
+            return True
+        if isinstance(root_call, ast.Name):
+            if root_call.id in cls.SKIP_ROOTS:
+                return False
+        return True
+
+
+class SlipformAccess(ast.NodeTransformer):
+    """
+    Collapse chains of two or more attributes and subscripts into a
+    single call to the slipform runtime, which evaluates the chain as
+    one operation instead of one operation per step. Chains on ``pf``
+    and the runtime itself are left untouched.
+
+    from:
+        b = batch['x'][0].shape
+    to:
+        b = __slipform__.access(batch, ('item', 'x'), ('item', 0), ('attr', 'shape'))
+    """
+
+    SKIP_ROOTS = ('pf', RUNTIME_NAME)
+
+    def visit_Attribute(self, node):
+        return self.visit_chain(node)
+
+    def visit_Subscript(self, node):
+        return self.visit_chain(node)
+
+    def visit_chain(self, node):
+        # collect the steps of the chain, outermost last
+        steps, root = [], node
+        while isinstance(root, (ast.Attribute, ast.Subscript)) and isinstance(root.ctx, ast.Load):
+            steps.insert(0, root)
+            root = root.value
+        skip = isinstance(root, ast.Name) and (root.id in self.SKIP_ROOTS)
+        if (len(steps) < 2) or skip or any(isinstance(n, ast.Starred) for n in ast.walk(node) if n is not root):
+            return self.generic_visit(node)
+        path = []
+        for step in steps:
+            if isinstance(step, ast.Attribute):
+                path.append(ast.Tuple(elts=[ast.Constant(value=ACCESS_ATTR), ast.Constant(value=step.attr)], ctx=ast.Load()))
+            else:
+                key = self.make_key(self.visit(step.slice))
+                path.append(ast.Tuple(elts=[ast.Constant(value=ACCESS_ITEM), key], ctx=ast.Load()))
+        return ast.copy_location(ast.Call(
+            func=ast.Attribute(value=ast.Name(id=RUNTIME_NAME, ctx=ast.Load()), attr='access', ctx=ast.Load()),
+            args=[self.visit(root), *path],
+            keywords=[],
+        ), node)
+
+    @classmethod
+    def make_key(cls, node):
+        # slices are only valid inside subscripts
+        if isinstance(node, ast.Slice):
+            bounds = [ast.Constant(value=None) if (n is None) else cls.make_key(n) for n in (node.lower, node.upper, node.step)]
+            return ast.Call(func=ast.Name(id='slice', ctx=ast.Load()), args=bounds, keywords=[])
+        if isinstance(node, ast.Tuple):
+            return ast.Tuple(elts=[cls.make_key(elt) for elt in node.elts], ctx=ast.Load())
+        # literal keys do not need to be operations, pf.constant(0) -> 0
+        if is_constant_call(node):
+            return node.args[0]
+        return node
+
+
+class SlipformElementwise(ast.NodeTransformer):
+    """
+    Fuse trees of two or more arithmetic operators into a single call to
+    the slipform runtime, which evaluates the whole tree as one operation
+    and avoids allocating a temporary array for every operator. Operands
+    that are not operators themselves become the leaves of the tree.
+
+    from:
+        y = a * b + c - 1
+    to:
+        y = __slipform__.elementwise(('Sub', ('Add', ('Mult', 0, 1), 2), 3), a, b, c, 1)
+    """
+
+    def visit_Lambda(self, node):
+        # lambdas are plain python functions
+        return node
+
+    def visit_BinOp(self, node):
+        return self.visit_tree(node)
+
+    def visit_UnaryOp(self, node):
+        return self.visit_tree(node)
+
+    def visit_tree(self, node):
+        if self.count_ops(node) < 2:
+            return self.generic_visit(node)
+        leaves = []
+        tree = self.make_tree(node, leaves)
+        return ast.copy_location(ast.Call(
+            func=ast.Attribute(value=ast.Name(id=RUNTIME_NAME, ctx=ast.Load()), attr='elementwise', ctx=ast.Load()),
+            args=[ast.Constant(value=tree), *leaves],
             keywords=[],
+        ), node)
+
+    @classmethod
+    def get_op_name(cls, node):
+        if isinstance(node, ast.BinOp) and (type(node.op).__name__ in BINARY_OPS):
+            return type(node.op).__name__
+        if isinstance(node, ast.UnaryOp) and (type(node.op).__name__ in UNARY_OPS):
+            return type(node.op).__name__
+        return None
+
+    @classmethod
+    def count_ops(cls, node):
+        if cls.get_op_name(node) is None:
+            return 0
+        children = (node.left, node.right) if isinstance(node, ast.BinOp) else (node.operand,)
+        return 1 + sum(cls.count_ops(child) for child in children)
+
+    def make_tree(self, node, leaves):
+        name = self.get_op_name(node)
+        if isinstance(node, ast.BinOp) and (name is not None):
+            return name, self.make_tree(node.left, leaves), self.make_tree(node.right, leaves)
+        if isinstance(node, ast.UnaryOp) and (name is not None):
+            return name, self.make_tree(node.operand, leaves)
+        # literals do not need to be operations, pf.constant(1) -> 1
+        leaves.append(node.args[0] if is_constant_call(node) else self.visit(node))
+        return len(leaves) - 1
+
+
+def is_constant_call(node):
+    return (
+        isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and (node.func.attr == 'constant')
+        and isinstance(node.func.value, ast.Name) and (node.func.value.id in ('pf', RUNTIME_NAME))
+        and (len(node.args) == 1) and not node.keywords and isinstance(node.args[0], ast.Constant)
+    )
+
+
+class SlipformIf(ast.NodeTransformer):
+    """
+    Convert if statements into lazily evaluated conditional operations
+    for every name assigned in either branch. The statements of both
+    branches are still executed when the graph is built, but only the
+    operations of the selected branch are evaluated. Assertions in a
+    branch only fail if that branch is selected.
+
+    from:
+        if c:
+            a = f(x)
+            b = a + 1
+        else:
+            a = g(x)
+    to:
+        _slipform_if0_test = c
+        _slipform_if0_body_a = f(x)
+        _slipform_if0_body_b = _slipform_if0_body_a + 1
+        _slipform_if0_else_a = g(x)
+        a = __slipform__.select(_slipform_if0_test, _slipform_if0_body_a, _slipform_if0_else_a)
+        b = __slipform__.select(_slipform_if0_test, _slipform_if0_body_b, <b or unbound>)
+    """
+
+    def __init__(self):
+        self._count = 0
+
+    def visit_If(self, node):
+        # nested if statements (including elif) are converted first
+        self.generic_visit(node)
+        prefix, self._count = f'{INTERNAL_PREFIX}if{self._count}', self._count + 1
+        test_name = f'{prefix}_test'
+        # hoist the branches
+        body, body_mapping = rename_branch_assignments(node.body, f'{prefix}_body')
+        orelse, orelse_mapping = rename_branch_assignments(node.orelse, f'{prefix}_else')
+        self.guard_assertions(body, test_name, selected=True)
+        self.guard_assertions(orelse, test_name, selected=False)
+        stmts = [ast.Assign(targets=[ast.Name(id=test_name, ctx=ast.Store())], value=node.test), *body, *orelse]
+        # select the values of each assigned name
+        for name in {**body_mapping, **orelse_mapping}:
+            body_name, body_stmts = make_branch_value(name, body_mapping, f'{prefix}_phi_body_{name}')
+            orelse_name, orelse_stmts = make_branch_value(name, orelse_mapping, f'{prefix}_phi_else_{name}')
+            stmts.extend([*body_stmts, *orelse_stmts])
+            stmts.extend(ast_parse_unlocated(f"{name} = {RUNTIME_NAME}.select({test_name}, {body_name}, {orelse_name})").body)
+        return [ast.copy_location(stmt, node) for stmt in stmts]
+
+    @staticmethod
+    def guard_assertions(stmts, test_name, selected):
+        # assert a -> assert pf.conditional(test, a, True)
+        for stmt in stmts:
+            if isinstance(stmt, ast.Assert):
+                branches = [stmt.test, ast.Constant(value=True)]
+                stmt.test = ast.Call(
+                    func=ast.Attribute(value=ast.Name(id='pf', ctx=ast.Load()), attr='conditional', ctx=ast.Load()),
+                    args=[ast.Name(id=test_name, ctx=ast.Load()), *(branches if selected else branches[::-1])],
+                    keywords=[],
+                )
+
+
+class SlipformTry(ast.NodeTransformer):
+    """
+    Convert try statements into a single ``pf.try_`` operation over the
+    values of all names assigned in the try block. The operations of the
+    exception handlers are only evaluated if evaluating the try block
+    fails. Expressions in the finally block become the ``finally_``
+    operations, they only see values from before the try statement.
+    Assertions in the try block are not caught by its handlers.
+
+    from:
+        try:
+            a = x / y
+        except ZeroDivisionError:
+            a = 0
+        finally:
+            log(x)
+    to:
+        _slipform_try0_body_a = x / y
+        _slipform_try0_except0_a = 0
+        _slipform_try0_finally0 = log(x)
+        _slipform_try0 = pf.try_(
+            __slipform__.pack(_slipform_try0_body_a),
+            [(ZeroDivisionError, __slipform__.pack(_slipform_try0_except0_a))],
+            __slipform__.pack(_slipform_try0_finally0),
         )
+        a = __slipform__.unpack(_slipform_try0, 0, 'a')
+    """
+
+    def __init__(self):
+        self._count = 0
+
+    def visit_Try(self, node):
+        # nested try statements are converted first
+        self.generic_visit(node)
+        assert not node.orelse, 'try statements with an else block are not supported'
+        prefix, self._count = f'{INTERNAL_PREFIX}try{self._count}', self._count + 1
+        # hoist the try block & exception handlers
+        body, body_mapping = rename_branch_assignments(node.body, f'{prefix}_body')
+        handlers, stmts = [], [*body]
+        for i, handler in enumerate(node.handlers):
+            assert handler.name is None, f'binding exceptions with "except ... as {handler.name}" is not supported'
+            handler_body, handler_mapping = rename_branch_assignments(handler.body, f'{prefix}_except{i}')
+            exc_type = handler.type if (handler.type is not None) else ast.Name(id='BaseException', ctx=ast.Load())
+            handlers.append((exc_type, handler_mapping))
+            stmts.extend(handler_body)
+        # the finally block only contributes operations
+        finally_names = []
+        for i, stmt in enumerate(node.finalbody):
+            if isinstance(stmt, ast.Expr):
+                finally_names.append(f'{prefix}_finally{i}')
+                stmt = ast.Assign(targets=[ast.Name(id=finally_names[-1], ctx=ast.Store())], value=stmt.value)
+            stmts.append(stmt)
+        # select the values of each assigned name
+        names = list({**body_mapping, **{k: v for _, mapping in handlers for k, v in mapping.items()}})
+        body_values, body_stmts = self.make_values(names, body_mapping, f'{prefix}_phi_body')
+        stmts.extend(body_stmts)
+        except_values = []
+        for i, (exc_type, mapping) in enumerate(handlers):
+            values, handler_stmts = self.make_values(names, mapping, f'{prefix}_phi_except{i}')
+            stmts.extend(handler_stmts)
+            except_values.append(f'({ast.unparse(exc_type)}, {values})')
+        finally_values = f"{RUNTIME_NAME}.pack({', '.join(finally_names)})" if finally_names else 'None'
+        stmts.extend(ast_parse_unlocated(f"{prefix} = pf.try_({body_values}, [{', '.join(except_values)}], {finally_values})").body)
+        stmts.extend(ast_parse_unlocated(f"{name} = {RUNTIME_NAME}.unpack({prefix}, {i}, '{name}')").body[0] for i, name in enumerate(names))
+        return [ast.copy_location(stmt, node) for stmt in stmts]
+
+    @staticmethod
+    def make_values(names, mapping, prefix):
+        values, stmts = [], []
+        for name in names:
+            value, value_stmts = make_branch_value(name, mapping, f'{prefix}_{name}', unbound=f'{RUNTIME_NAME}.UNBOUND')
+            values.append(value)
+            stmts.extend(value_stmts)
+        return f"{RUNTIME_NAME}.pack({', '.join(values)})", stmts
+
+
+class SlipformBranches(SlipformIf, SlipformTry):
+    """
+    If and try statements can be nested inside each other,
+    so they are converted together, inner-most first.
+    """
+
+
+class SlipformAssert(ast.NodeTransformer):
+    """
+    Convert assert statements into ``pf.assert_`` operations that all
+    operations defined after the assertion in the same block depend on.
+    In optimized mode, like ``python -O``, assertions are removed.
+
+    from:
+        assert x > 0, 'message'
+        y = f(x)
+    to:
+        _slipform_assert0 = pf.assert_(x > 0, '%s', 'message')
+        with pf.control_dependencies([_slipform_assert0]):
+            y = f(x)
+    """
+
+    def __init__(self, optimize=False):
+        self.optimize = optimize
+        self._count = 0
+
+    def generic_visit(self, node):
+        node = super().generic_visit(node)
+        for field in ('body', 'orelse', 'finalbody'):
+            stmts = getattr(node, field, None)
+            if isinstance(stmts, list) and any(isinstance(stmt, ast.Assert) for stmt in stmts):
+                setattr(node, field, self.wrap_assertions(stmts) or [ast.Pass()])
+        return node
+
+    def wrap_assertions(self, stmts):
+        for i, stmt in enumerate(stmts):
+            if not isinstance(stmt, ast.Assert):
+                continue
+            rest = self.wrap_assertions(stmts[i+1:])
+            if self.optimize:
+                return stmts[:i] + rest
+            name, self._count = f'{INTERNAL_PREFIX}assert{self._count}', self._count + 1
+            args = [stmt.test] if (stmt.msg is None) else [stmt.test, ast.Constant(value='%s'), stmt.msg]
+            assertion = ast.Assign(
+                targets=[ast.Name(id=name, ctx=ast.Store())],
+                value=ast.Call(
+                    func=ast.Attribute(value=ast.Name(id='pf', ctx=ast.Load()), attr='assert_', ctx=ast.Load()),
+                    args=args,
+                    keywords=[],
+                ),
+            )
+            with_node = ast.With(
+                items=[ast.withitem(context_expr=ast_parse_unlocated(f"pf.control_dependencies([{name}])", mode='eval').body)],
+                body=rest or [ast.Pass()],
+            )
+            return stmts[:i] + [ast.copy_location(assertion, stmt), ast.copy_location(with_node, stmt)]
+        return stmts
+
+
+class _VersionStores(ast.NodeTransformer):
+    """
+    Rename stored names to the next version, except for their last assignment.
+    """
+
+    def __init__(self, mapping, remaining, versions):
+        self.mapping, self.remaining, self.versions = mapping, remaining, versions
+
+    def visit_Name(self, node):
+        if not isinstance(node.ctx, ast.Store) or node.id.startswith(INTERNAL_PREFIX):
+            return node
+        self.remaining[node.id] -= 1
+        # the last assignment keeps the name, also for reassigned arguments
+        if not self.remaining[node.id]:
+            self.mapping.pop(node.id, None)
+            return node
+        i = self.versions[node.id] = self.versions.get(node.id, -1) + 1
+        self.mapping[node.id] = f'{INTERNAL_PREFIX}ssa_{node.id}_{i}'
+        return ast.copy_location(ast.Name(id=self.mapping[node.id], ctx=ast.Store()), node)
+
+
+class SlipformSSA(ast.NodeTransformer):
+    """
+    Give every assignment to a name except the last one a fresh internal
+    name, so that names can be reassigned without clashing operation names,
+    and convert augmented assignments into normal assignments. Only the
+    last version of a name is named in the graph, earlier versions are
+    released like any other intermediate value. Like python, the name of
+    a reassigned argument refers to its last version, its placeholder is
+    renamed by ``SlipformPlaceholders``.
+
+    from:
+        total = x
+        total += y
+        total = total * 2
+    to:
+        _slipform_ssa_total_0 = x
+        _slipform_ssa_total_1 = _slipform_ssa_total_0 + y
+        total = _slipform_ssa_total_1 * 2
+    """
+
+    def visit_FunctionDef(self, node):
+        # nested functions are not visited, they see the final values like python
+        node.body = self.desugar(node.body)
+        remaining = {}
+        for name in self.iter_stores(node.body):
+            remaining[name] = remaining.get(name, 0) + 1
+        node.body = self.rename(node.body, _VersionStores({}, remaining, {}))
+        return node
+
+    @classmethod
+    def desugar(cls, stmts):
+        stmts = [desugar_assignment(stmt) for stmt in stmts]
+        for stmt in stmts:
+            if isinstance(stmt, ast.With):
+                stmt.body = cls.desugar(stmt.body)
+        return stmts
+
+    @classmethod
+    def iter_stores(cls, stmts):
+        for stmt in stmts:
+            if isinstance(stmt, ast.Assign):
+                for target in stmt.targets:
+                    yield from (n.id for n in ast.walk(target) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store) and not n.id.startswith(INTERNAL_PREFIX))
+            elif isinstance(stmt, ast.With):
+                yield from cls.iter_stores(stmt.body)
+
+    @classmethod
+    def rename(cls, stmts, stores: _VersionStores):
+        mapping, renamed = stores.mapping, []
+        for stmt in stmts:
+            # rename the loads before the stores, eg. ``a = a + 1``
+            if isinstance(stmt, ast.Assign):
+                stmt.value = _RenameLoads(dict(mapping)).visit(stmt.value)
+                stmt.targets = [stores.visit(_RenameLoads(dict(mapping)).visit(t)) for t in stmt.targets]
+            elif isinstance(stmt, ast.With):
+                stmt.items = [_RenameLoads(dict(mapping)).visit(item) for item in stmt.items]
+                stmt.body = cls.rename(stmt.body, stores)
+            elif not isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                stmt = _RenameLoads(dict(mapping)).visit(stmt)
+            renamed.append(stmt)
+        return renamed
+
+
+class SlipformCompare(ast.NodeTransformer):
+    """
+    Convert comparisons that pythonflow cannot overload, ie. chained
+    comparisons, membership and identity tests, into a single call to
+    the slipform runtime. All operands of a chain are evaluated, but
+    comparisons stop at the first false result like python.
+
+    from:
+        a < b <= c
+        a not in b
+        a is None
+    to:
+        __slipform__.compare(a, ('Lt', b), ('LtE', c))
+        __slipform__.compare(a, ('NotIn', b))
+        __slipform__.compare(a, ('Is', None))
+    """
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if (len(node.ops) == 1) and not isinstance(node.ops[0], (ast.In, ast.NotIn, ast.Is, ast.IsNot)):
+            return node
+        comparisons = [
+            ast.Tuple(elts=[ast.Constant(value=type(op).__name__), self.unwrap(comparator)], ctx=ast.Load())
+            for op, comparator in zip(node.ops, node.comparators)
+        ]
+        return ast.copy_location(ast.Call(
+            func=ast.Attribute(value=ast.Name(id=RUNTIME_NAME, ctx=ast.Load()), attr='compare', ctx=ast.Load()),
+            args=[self.unwrap(node.left), *comparisons],
+            keywords=[],
+        ), node)
+
+    @staticmethod
+    def unwrap(node):
+        # literals do not need to be operations, pf.constant(None) -> None
+        return node.args[0] if is_constant_call(node) else node
 
 
 class SlipformCondition(ast.NodeTransformer):
@@ -256,7 +1075,7 @@ class SlipformCondition(ast.NodeTransformer):
         name = alias.name
         asname = alias.asname if (alias.asname is not None) else name.split('.')[0]
         assert str.isidentifier(asname), 'This should never happen...'
-        import_node = ast.parse(f"{asname} = pf.import_('{name}')").body[0]
+        import_node = ast_parse_unlocated(f"{asname} = pf.import_('{name}')").body[0]
         return import_node
 
     @classmethod
@@ -276,10 +1095,10 @@ class SlipformCondition(ast.NodeTransformer):
         return assign_node
 
     def visit_Import(self, node):
-        return [self.ast_make_import_assign(alias) for alias in node.names]
+        return [ast.copy_location(self.ast_make_import_assign(alias), node) for alias in node.names]
 
     def visit_ImportFrom(self, node):
-        return [self.ast_make_import_from_assign(node, alias) for alias in node.names]
+        return [ast.copy_location(self.ast_make_import_from_assign(node, alias), node) for alias in node.names]
 
 if __name__ == '__main__':
     from slipform import slipform
@@ -0,0 +1,291 @@
+"""
+Serve slipform graphs from a pool of worker processes.
+
+Each worker rebuilds the graph once from the marshalled code of the
+translated function, so neither the graph nor the original function
+need to be pickled. The module of the function is imported by the
+workers, but the values of its closure and the names given with
+``add_scope`` are pickled, so they must be picklable unless the
+processes are forked. Large numpy arrays are passed to and from the
+workers through shared memory instead of being pickled.
+
+    runner = ProcessPoolGraphRunner(graph, max_workers=8)
+    future = runner.submit('loss', x=x, x_target=x_target)
+    loss = future.result()
+"""
+
+import concurrent.futures
+import importlib
+import marshal
+import types
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import NamedTuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from slipform import _runtime
+from slipform._ast_utils import FunctionScope
+from slipform._execute import Scheduler
+from slipform._graph import SlipformGraph, build_graph
+
+
+# arrays smaller than this are pickled as usual
+SHM_MIN_BYTES = 1 << 16
+
+
+# ========================================================================= #
+# Shared Arrays                                                             #
+# ========================================================================= #
+
+
+class _SharedArray(NamedTuple):
+    name: str
+    shape: tuple
+    dtype: str
+
+    @classmethod
+    def share(cls, array, min_bytes):
+        """
+        Copy a large enough array into a new shared memory block, returns
+        the block and its description, or ``None`` for everything else.
+        """
+        if (np is None) or (not isinstance(array, np.ndarray)) or (array.nbytes < min_bytes) or array.dtype.hasobject:
+            return None, None
+        shm = SharedMemory(create=True, size=array.nbytes)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        return shm, cls(shm.name, array.shape, array.dtype.str)
+
+    def attach(self):
+        shm = SharedMemory(name=self.name)
+        return shm, np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+
+def _close(shm, unlink=False):
+    # arrays that are still referenced keep the mapping alive until they are collected
+    try:
+        shm.close()
+    except BufferError:
+        pass
+    if unlink:
+        shm.unlink()
+
+
+def _encode(value, shms, min_bytes):
+    shm, shared = _SharedArray.share(value, min_bytes)
+    if shm is None:
+        return value
+    shms.append(shm)
+    return shared
+
+
+def _decode(value, shms):
+    if not isinstance(value, _SharedArray):
+        return value
+    shm, array = value.attach()
+    shms.append(shm)
+    return array
+
+
+def _unlink(value):
+    # release shared outputs that are never decoded
+    if not isinstance(value, _SharedArray):
+        return
+    try:
+        shm = SharedMemory(name=value.name)
+    except FileNotFoundError:
+        return
+    _close(shm, unlink=True)
+
+
+def _decode_copy(value):
+    if not isinstance(value, _SharedArray):
+        return value
+    shm, array = value.attach()
+    try:
+        return array.copy()
+    finally:
+        del array
+        _close(shm, unlink=True)
+
+
+def _owned(value):
+    # views may reference shared memory that is about to be closed
+    if (np is not None) and isinstance(value, np.ndarray) and (value.base is not None):
+        return value.copy()
+    return value
+
+
+# ========================================================================= #
+# Workers                                                                   #
+# ========================================================================= #
+
+
+_WORKER_OPS = None
+
+
+def _graph_payload(graph: SlipformGraph):
+    builder, orig_fn = graph._builder, graph._orig_fn
+    if builder is None:
+        raise TypeError(f'graph was not built by @slipform: {graph!r}')
+    # values of the closure of the original function, as seen by the builder
+    cells = dict(zip(orig_fn.__code__.co_freevars, orig_fn.__closure__ or ()))
+    closure = {}
+    for name, cell in cells.items():
+        try:
+            closure[name] = cell.cell_contents
+        except ValueError:
+            pass
+    return dict(
+        module=orig_fn.__module__,
+        add_scope=graph._add_scope,
+        closure=closure,
+        builder=(builder.__name__, marshal.dumps(builder.__code__)),
+        orig_fn=(orig_fn.__name__, marshal.dumps(orig_fn.__code__)),
+        inplace=graph.inplace,
+        num_ops=len(graph.operations),
+    )
+
+
+def _rebuild_graph(payload) -> SlipformGraph:
+    scope = vars(importlib.import_module(payload['module']))
+    closure = payload['closure']
+    name, code = payload['orig_fn']
+    code = marshal.loads(code)
+    # functions with empty cells in their closure cannot be rebuilt
+    orig_fn = None
+    if all(var in closure for var in code.co_freevars):
+        cells = tuple(types.CellType(closure[var]) for var in code.co_freevars)
+        orig_fn = types.FunctionType(code, scope, name, None, cells or None)
+    builder_scope = FunctionScope(scope, {_runtime.RUNTIME_NAME: _runtime, **payload['add_scope']}, {var: types.CellType(value) for var, value in closure.items()})
+    builder = types.FunctionType(marshal.loads(payload['builder'][1]), builder_scope, payload['builder'][0])
+    # workers are already processes, ``cpu_heavy`` operations run in the worker itself
+    graph = build_graph(builder, orig_fn=orig_fn, add_scope=payload['add_scope'], inplace=payload['inplace'], scheduler=Scheduler(cpu_heavy=False))
+    if len(graph.operations) != payload['num_ops']:
+        raise RuntimeError('graph generated by the worker does not match the original graph')
+    return graph
+
+
+def _init_worker(payload):
+    global _WORKER_OPS
+    _WORKER_OPS = tuple(_rebuild_graph(payload).operations.values())
+
+
+def _run_in_worker(fetches, context, min_bytes):
+    graph = _WORKER_OPS[0].graph
+    shms, out_shms, returned = [], [], False
+    try:
+        values = graph.apply(
+            [_WORKER_OPS[i] for i in fetches],
+            {_WORKER_OPS[i]: _decode(value, shms) for i, value in context},
+        )
+        values = tuple(_encode(_owned(value), out_shms, min_bytes) for value in values)
+        returned = True
+    finally:
+        for shm in shms:
+            _close(shm)
+        # outputs are unlinked by the parent, unless they are never returned
+        for shm in out_shms:
+            _close(shm, unlink=not returned)
+    return values
+
+
+# ========================================================================= #
+# Runner                                                                    #
+# ========================================================================= #
+
+
+class ProcessPoolGraphRunner:
+    """
+    Evaluate a slipform graph in a pool of worker processes,
+    working around the GIL for CPU bound graphs.
+
+    Values in the context are pickled, except for large numpy
+    arrays which are passed through shared memory. Functions
+    passed with ``add_scope``, and the values of the closure of
+    the original function, must be picklable unless the
+    processes are forked. Shared outputs of calls that are
+    cancelled while they run are released once they finish.
+    """
+
+    def __init__(self, graph: SlipformGraph, max_workers=None, *, mp_context=None, shm_min_bytes=SHM_MIN_BYTES):
+        self._graph = graph
+        self._shm_min_bytes = shm_min_bytes
+        # operations are identified by their position in the graph
+        self._indices = {id(op): i for i, op in enumerate(graph.operations.values())}
+        # workers need to share the resource tracker of the parent,
+        # otherwise they would clean up shared memory they do not own
+        resource_tracker.ensure_running()
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(_graph_payload(graph),),
+        )
+
+    def submit(self, fetches, context=None, **kwargs) -> concurrent.futures.Future:
+        """
+        Evaluate the graph in a worker process, the
+        arguments are the same as for ``graph(...)``.
+        """
+        fetches, single = self._graph.normalize_fetches(fetches)
+        context = self._graph.fill_context({}, context, **kwargs)
+        shms = []
+        try:
+            fetches = [self._indices[id(op)] for op in fetches]
+            context = [(self._indices[id(op)], _encode(value, shms, self._shm_min_bytes)) for op, value in context.items()]
+            inner = self._pool.submit(_run_in_worker, fetches, context, self._shm_min_bytes)
+        except BaseException:
+            for shm in shms:
+                _close(shm, unlink=True)
+            raise
+        # decode the outputs once the worker is done
+        future = concurrent.futures.Future()
+        def _done(inner):
+            for shm in shms:
+                _close(shm, unlink=True)
+            if inner.cancelled():
+                future.cancel()
+                return
+            error = inner.exception()
+            outputs = () if (error is not None) else inner.result()
+            if not future.set_running_or_notify_cancel():
+                # cancelled by the caller while the worker was running
+                for value in outputs:
+                    _unlink(value)
+                return
+            if error is not None:
+                future.set_exception(error)
+                return
+            try:
+                # copy shared outputs so that their memory can be released
+                values = tuple(_decode_copy(value) for value in outputs)
+            except BaseException as e:  # pylint: disable=W0703
+                for value in outputs:
+                    _unlink(value)
+                future.set_exception(e)
+            else:
+                future.set_result(values[0] if single else values)
+        inner.add_done_callback(_done)
+        # cancelling the future also cancels calls that have not started yet
+        future.add_done_callback(lambda future: inner.cancel() if future.cancelled() else None)
+        return future
+
+    def map(self, fetches, contexts):
+        """
+        Evaluate the graph for each context, yielding results in order.
+        """
+        for future in [self.submit(fetches, context) for context in contexts]:
+            yield future.result()
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
@@ -8,7 +8,7 @@ import uuid
 
 import pytest
 import pythonflow as pf
-from slipform import slipform
+from slipform import slipform, io as slipform_io
 
 
 def test_consistent_context():
@@ -250,6 +250,47 @@ def test_conditional():
         graph('z', condition=False)
 
 
+def test_conditional_lazy():
+    counts = {'sigmoid': 0, 'mse': 0, 'bce': 0}
+
+    def counted(key, func):
+        def wrapper(*args):
+            counts[key] += 1
+            return func(*args)
+        return slipform_io(wrapper)
+
+    scope = dict(
+        sigmoid=counted('sigmoid', lambda x: 1 / (1 + 2.718281828 ** -x)),
+        mse_loss=counted('mse', lambda x, y: (x - y) ** 2),
+        bce_loss=counted('bce', lambda x, y: abs(x - y)),
+    )
+
+    # structured like the README vae example
+    @slipform(add_scope=scope)
+    def graph(x_pre_recon, x_target, mse):
+        x_recon = x_pre_recon if mse else sigmoid(x_pre_recon)
+        loss = mse_loss(x_recon, x_target) if mse else bce_loss(x_pre_recon, x_target)
+
+    assert graph('loss', x_pre_recon=3, x_target=1, mse=True) == 4
+    assert counts == {'sigmoid': 0, 'mse': 1, 'bce': 0}
+    assert graph('loss', x_pre_recon=3, x_target=1, mse=False) == 2
+    assert counts == {'sigmoid': 0, 'mse': 1, 'bce': 1}
+    graph('x_recon', x_pre_recon=3, x_target=1, mse=False)
+    assert counts == {'sigmoid': 1, 'mse': 1, 'bce': 1}
+    # only the operations of the taken branch are traced
+    @slipform()
+    def graph(c):
+        a = 1
+        b = 2
+        d = a if c else b + 1
+    tracer = pf.Profiler()
+    assert graph('d', c=True, callback=tracer) == 1
+    assert len(tracer.times) == 2
+    tracer = pf.Profiler()
+    assert graph('d', c=False, callback=tracer) == 3
+    assert len(tracer.times) == 4
+
+
 # def test_conditional_with_length():
 #     def f(a):
 #         return a, a
@@ -265,26 +306,51 @@ def test_conditional():
 #     assert graph([z1, z2], condition=False, y=5) == (5, 5)
 #
 #
-# @pytest.mark.parametrize('message', [None, "x should be smaller than %d but got %d"])
-# def test_assert_with_dependencies(message):
-#     with pf.Graph() as graph:
-#         x = pf.placeholder(name='x')
-#         if message:
-#             assertion = pf.assert_(x < 10, message, 10, x)
-#         else:
-#             assertion = pf.assert_(x < 10)
-#         with pf.control_dependencies([assertion]):
-#             y = 2 * x
-#
-#     assert len(y.dependencies) == 1
-#     assert graph(y, x=9) == 18
-#     with pytest.raises(AssertionError) as exc_info:
-#         graph(y, x=11)
-#
-#     if message:
-#         exc_info.match(message % (10, 11))
-#
-#
+@pytest.mark.parametrize('message', [None, "x should be smaller than %d but got %d"])
+def test_assert_with_dependencies(message):
+    with pf.Graph() as graph:
+        x = pf.placeholder(name='x')
+        if message:
+            assertion = pf.assert_(x < 10, message, 10, x)
+        else:
+            assertion = pf.assert_(x < 10)
+        with pf.control_dependencies([assertion]):
+            y = 2 * x
+
+    assert len(y.dependencies) == 1
+    assert graph(y, x=9) == 18
+    with pytest.raises(AssertionError) as exc_info:
+        graph(y, x=11)
+
+    if message:
+        exc_info.match(message % (10, 11))
+    # ~=~=~=~=~=~=~=~=~=~=~=~=~=~=~=~ #
+    @slipform(add_scope={'message': message})
+    def graph(x):
+        if message:
+            assert x < 10, 'x should be smaller than %d but got %d' % (10, x)
+        else:
+            assert x < 10
+        y = 2 * x
+
+    assert graph('y', x=9) == 18
+    with pytest.raises(AssertionError) as exc_info:
+        graph('y', x=11)
+
+    if message:
+        exc_info.match(message % (10, 11))
+
+
+def test_assert_optimize():
+    @slipform(optimize=True)
+    def graph(x):
+        assert x < 10
+        y = 2 * x
+
+    assert graph('y', x=11) == 22
+    assert not graph['y'].dependencies
+
+
 # def test_assert_with_value():
 #     with pf.Graph() as graph:
 #         x = pf.placeholder(name='x')
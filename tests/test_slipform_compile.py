@@ -0,0 +1,109 @@
+import importlib
+import sys
+import textwrap
+
+import slipform._ast_utils
+from slipform.__main__ import main
+
+
+MODULE = '''
+import pythonflow as pf
+from slipform import slipform, inline
+
+
+@slipform
+def graph(x, y=2):
+    # comments are fine
+    z = x * y + 1
+
+
+@inline
+def block(x):
+    y = x - 1
+
+
+def outer():
+    @slipform(optimize=True)
+    def nested(x):
+        assert x > 0
+        y = x + 1
+    return nested
+'''
+
+
+def _import(tmp_path, monkeypatch, name):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    sys.modules.pop(name, None)
+    importlib.invalidate_caches()
+    return importlib.import_module(name)
+
+
+def test_compile_package(tmp_path, monkeypatch, capsys):
+    pkg = tmp_path / 'aot_pkg'
+    pkg.mkdir()
+    (pkg / '__init__.py').write_text('')
+    (pkg / 'mod.py').write_text(MODULE)
+    assert main(['compile', '--jobs', '1', str(pkg)]) == 0
+    assert 'compiled 3 slipform function(s)' in capsys.readouterr().out
+    assert list((pkg / '__pycache__').glob('mod.*.slipform'))
+    # precompiled functions are not translated again
+    translated = []
+    rewrite = slipform._ast_utils.ast_rewrite_function
+    monkeypatch.setattr(slipform._ast_utils, 'ast_rewrite_function', lambda func, *a, **k: translated.append(func.__name__) or rewrite(func, *a, **k))
+    mod = _import(tmp_path, monkeypatch, 'aot_pkg.mod')
+    assert mod.graph('z', x=2) == 5
+    assert mod.outer()('y', x=-1) == 0
+    assert slipform.slipform(mod.block)('y', x=3) == 2
+    assert translated == []
+    # changed functions are translated from their source
+    (pkg / 'mod.py').write_text(MODULE.replace('x * y + 1', 'x * y + 10'))
+    mod = _import(tmp_path, monkeypatch, 'aot_pkg.mod')
+    assert mod.graph('z', x=2) == 14
+    assert translated == ['graph']
+
+
+def test_compile_errors(tmp_path, capsys):
+    path = tmp_path / 'aot_broken.py'
+    path.write_text(textwrap.dedent('''
+        from slipform import slipform
+
+        @slipform()
+        def broken(x):
+            for i in x:
+                pass
+    '''))
+    assert main(['compile', '-q', '--jobs', '1', str(path)]) == 1
+    err = capsys.readouterr().err
+    assert 'aot_broken.py:4' in err and 'line 6, column 5: for loops are not supported' in err
+
+
+def test_compile_invalid_module(tmp_path, capsys):
+    pkg = tmp_path / 'aot_mixed'
+    pkg.mkdir()
+    (pkg / 'bad.py').write_text('import slipform\nprint "py2"\n')
+    (pkg / 'good.py').write_text(MODULE)
+    assert main(['compile', '--jobs', '1', str(pkg)]) == 1
+    out, err = capsys.readouterr()
+    assert 'bad.py:2: SyntaxError' in err
+    # the other modules are still compiled
+    assert 'compiled 3 slipform function(s) in 2 module(s), 1 error(s)' in out
+    assert list((pkg / '__pycache__').glob('good.*.slipform'))
+
+
+def test_compile_translator_changed(tmp_path, monkeypatch):
+    import slipform._cache
+    path = tmp_path / 'aot_stale.py'
+    path.write_text(MODULE)
+    assert main(['compile', '-q', '--jobs', '1', str(path)]) == 0
+    # builders compiled by another version of the translator are not used
+    slipform._cache.get_translator_digest.cache_clear()
+    monkeypatch.setattr(slipform._cache, '_TRANSLATOR_MODULES', slipform._cache._TRANSLATOR_MODULES[:-1])
+    translated = []
+    rewrite = slipform._ast_utils.ast_rewrite_function
+    monkeypatch.setattr(slipform._ast_utils, 'ast_rewrite_function', lambda func, *a, **k: translated.append(func.__name__) or rewrite(func, *a, **k))
+    try:
+        mod = _import(tmp_path, monkeypatch, 'aot_stale')
+        assert mod.graph('z', x=2) == 5
+        assert translated == ['graph']
+    finally:
+        slipform._cache.get_translator_digest.cache_clear()
@@ -0,0 +1,38 @@
+import subprocess
+import sys
+
+import pytest
+
+
+# cumulative import time budget for ``import slipform`` in microseconds,
+# the eager import of pythonflow and the translator took ~45ms.
+IMPORT_BUDGET_US = 20_000
+
+
+def _import_times(module):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_is_lazy():
+    times = _import_times('slipform')
+    # heavy dependencies are only imported on first decoration
+    assert not any(name.split('.')[0] in ('pythonflow', 'astunparse', 'inspect') for name in times)
+    assert not any(name.startswith('slipform.') for name in times)
+    # best of several runs, to be robust to noisy machines
+    best = min(_import_times('slipform')['slipform'] for _ in range(3))
+    assert best < IMPORT_BUDGET_US, f'import slipform took {best}us, budget is {IMPORT_BUDGET_US}us'
+
+
+def test_lazy_attributes():
+    import slipform
+    assert callable(slipform.pure)
+    assert 'Spec' in dir(slipform)
+    with pytest.raises(AttributeError):
+        slipform.does_not_exist
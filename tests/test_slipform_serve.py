@@ -0,0 +1,84 @@
+import os
+import time
+
+import pytest
+import pythonflow as pf
+from slipform import slipform, cpu_heavy, io
+from slipform.serve import ProcessPoolGraphRunner
+
+
+def test_process_pool_runner():
+    @cpu_heavy
+    def square(x):
+        return x * x
+
+    @slipform(add_scope=dict(square=square))
+    def func(x, y):
+        a = square(x)
+        b = a + y
+
+    with ProcessPoolGraphRunner(func, max_workers=2) as runner:
+        futures = [runner.submit(['a', 'b'], x=i, y=1) for i in range(20)]
+        assert [future.result() for future in futures] == [(i * i, i * i + 1) for i in range(20)]
+        # operations and context mappings are also supported
+        assert runner.submit(func['b'], {'x': 2}, y=3).result() == 7
+        assert list(runner.map('a', [{'x': 3}, {'x': 4}])) == [9, 16]
+        # errors are raised by the future
+        with pytest.raises(ValueError):
+            runner.submit('b', x=1).result()
+
+
+def test_process_pool_runner_closure():
+    def make_graph(offset):
+        @slipform()
+        def func(x):
+            y = x + offset
+        return func
+
+    with ProcessPoolGraphRunner(make_graph(10), max_workers=1) as runner:
+        assert runner.submit('y', x=1).result() == 11
+
+
+def test_process_pool_runner_shared_memory():
+    np = pytest.importorskip('numpy')
+
+    @slipform()
+    def func(x):
+        y = x * 2
+        z = x[:2]
+
+    x = np.arange(100_000, dtype='float64')
+    with ProcessPoolGraphRunner(func, max_workers=2, shm_min_bytes=1024) as runner:
+        y, z = runner.submit(['y', 'z'], x=x).result()
+    assert np.array_equal(y, x * 2)
+    assert np.array_equal(z, x[:2])
+
+
+@io
+def _slow_double(x, delay):
+    time.sleep(delay)
+    return x * 2
+
+
+def test_process_pool_runner_cancelled(caplog):
+    np = pytest.importorskip('numpy')
+    if not os.path.isdir('/dev/shm'):
+        pytest.skip('shared memory blocks are not listed in /dev/shm')
+
+    @slipform(add_scope=dict(double=_slow_double))
+    def func(x, delay):
+        y = double(x, delay)
+
+    def blocks():
+        return {name for name in os.listdir('/dev/shm') if name.startswith('psm_')}
+
+    x = np.arange(100_000, dtype='float64')
+    before = blocks()
+    with ProcessPoolGraphRunner(func, max_workers=1, shm_min_bytes=1024) as runner:
+        running = runner.submit('y', x=x, delay=0.5)
+        queued = runner.submit('y', x=x, delay=0)
+        # cancelled while the worker is running, and before it starts
+        assert running.cancel() and queued.cancel()
+    # the shared outputs are released once the worker finishes, without being decoded
+    assert blocks() <= before
+    assert not [record for record in caplog.records if record.name == 'concurrent.futures']
@@ -1,7 +1,16 @@
 import ast
+import contextlib
+import inspect
+import json
+import os
+import pickle
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import pytest
 import pythonflow as pf
-from slipform import slipform
+from slipform import slipform, pure as slipform_pure, io as slipform_io, cpu_heavy as slipform_cpu_heavy, inline as slipform_inline, Spec, get_placeholder_specs, FrozenGraphError, Profiler, fuse, memoize, SlipformSyntaxError, Hooks, SpanExporter, stochastic, seeded, record, replay, Trace, Scheduler
 from slipform._ast_utils import ast_decompile_func, ast_rewrite_function, ast_compile_func
 from slipform._translate import get_assign_target_names
 
@@ -63,4 +72,927 @@ def test_slipform_assign():
         b, c = pf.constant(2), pf.constant(3)
         d, e = [4, 5]
     a, b, c, d, e = func(['a', 'b', 'c', 'd', 'e'])
-    assert (a, b, c, d, e) == (1, 2, 3, 4, 5)
\ No newline at end of file
+    assert (a, b, c, d, e) == (1, 2, 3, 4, 5)
+
+def test_slipform_func_ops():
+    calls = []
+
+    @slipform_pure
+    def add(a, b):
+        calls.append((a, b))
+        return a + b
+
+    @slipform_io
+    def load(name):
+        return f'loaded:{name}'
+
+    def untouched(x):
+        return x * 2
+
+    @slipform(add_scope={'add': add, 'load': load, 'untouched': untouched})
+    def func(x):
+        y = add(x, 1)
+        z = load(name='file')
+        w = untouched(y)
+
+    assert isinstance(func['y'], pf.Operation) and func['y'].kind == 'pure'
+    assert isinstance(func['z'], pf.Operation) and func['z'].kind == 'io'
+    assert func(['y', 'z', 'w'], x=1) == (2, 'loaded:file', 4)
+    # pure functions are cached on their arguments
+    assert func('y', x=1) == 2
+    assert calls == [(1, 1)]
+    assert func('y', x=2) == 3
+    assert calls == [(1, 1), (2, 1)]
+    # copies of the graph do not share cached results
+    assert fuse(func)('func.y', x=1) == 2
+    assert calls == [(1, 1), (2, 1), (1, 1)]
+
+
+@slipform_cpu_heavy
+def _get_pid(x):
+    return os.getpid(), x
+
+
+def test_slipform_marked_functions():
+    def load(x):
+        return x
+
+    marked = slipform_io(load)
+    assert (marked is not load) and (not vars(load)) and (marked.kind == 'io')
+    assert (marked(1) == 1) and (marked.__name__ == 'load')
+    # marking a marked function replaces its kind
+    assert slipform_cpu_heavy(marked).__wrapped__ is load
+    # module level functions are pickled by reference
+    assert pickle.loads(pickle.dumps(_get_pid)) is _get_pid
+
+
+def test_slipform_schedule():
+    # both calls wait for each other, so they have to run concurrently
+    barrier = threading.Barrier(2, timeout=10)
+    calls = []
+
+    @slipform_io
+    def load(name):
+        calls.append(name)
+        barrier.wait()
+        return name, threading.get_ident()
+
+    @slipform_io
+    def fail(name):
+        raise KeyError(name)
+
+    @slipform(add_scope=dict(load=load, fail=fail))
+    def func(x):
+        a = load(x + 'a')
+        b = load(x + 'b')
+        c = a[0] + b[0]
+        d = fail(x)
+
+    (a, thread_a), (b, thread_b) = func(['a', 'b'], x='x')
+    assert (a, b) == ('xa', 'xb')
+    assert threading.get_ident() not in (thread_a, thread_b)
+    assert func('c', x='y') == 'yayb'
+    # errors are raised where the operation is needed
+    with pytest.raises(KeyError):
+        func(['c', 'd'], x='z')
+    # given values are not computed
+    calls.clear()
+    assert func('c', a=('a', None), b=('b', None), x='x') == 'ab'
+    assert calls == []
+    # without a scheduler, operations are evaluated in the calling thread
+    @slipform(add_scope=dict(get_ident=slipform_io(threading.get_ident)), scheduler=Scheduler(io=False))
+    def func():
+        a = get_ident()
+
+    assert func('a') == threading.get_ident()
+
+
+def test_slipform_schedule_processes():
+    offset = 1
+
+    @slipform_cpu_heavy
+    def local(x):
+        return threading.get_ident(), x + offset
+
+    with Scheduler(max_workers=2) as scheduler:
+        @slipform(add_scope=dict(get_pid=_get_pid, local=local), scheduler=scheduler)
+        def func(x):
+            a = get_pid(x)
+            b = local(x)
+
+        (pid, x), (thread, y) = func(['a', 'b'], x=1)
+    # functions that cannot be pickled run in threads instead
+    assert (pid != os.getpid()) and (x == 1)
+    assert (thread != threading.get_ident()) and (y == 2)
+
+
+def test_slipform_if_statement():
+    calls = []
+
+    @slipform_io
+    def f(x):
+        calls.append('f')
+        return x * 10
+
+    @slipform_io
+    def g(x):
+        calls.append('g')
+        return x - 1
+
+    @slipform(add_scope={'f': f, 'g': g})
+    def func(x, c, d):
+        if c:
+            a = f(x)
+            b = a + 1
+            a += 5
+        elif d:
+            a = g(x)
+        else:
+            a = 0
+            b = -1
+
+    # only the operations of the selected branch are evaluated
+    assert func(['a', 'b'], x=1, c=True, d=False) == (15, 11)
+    assert calls == ['f']
+    assert func('a', x=1, c=False, d=True) == 0
+    assert calls == ['f', 'g']
+    assert func(['a', 'b'], x=1, c=False, d=False) == (0, -1)
+    assert calls == ['f', 'g']
+    # names not assigned in the selected branch are unbound
+    with pytest.raises(UnboundLocalError):
+        func('b', x=1, c=False, d=True)
+
+
+@pytest.mark.parametrize('context, expected', [
+    ({'a': 1, 'b': 0}, 'zero-division'),
+    ({'a': 1, 'b': 2}, 0.5),
+])
+def test_slipform_try(context, expected):
+    finally_reached = []
+
+    @slipform(add_scope={'reached': slipform_io(lambda: finally_reached.append('done'))})
+    def graph(a, b):
+        try:
+            c = a / b
+        except ZeroDivisionError:
+            c = 'zero-division'
+        finally:
+            reached()
+
+    assert not finally_reached
+    assert graph('c', context) == expected
+    assert finally_reached
+
+
+def test_slipform_try_not_caught():
+    @slipform()
+    def graph(a, b):
+        try:
+            c = a / b
+        except ValueError:
+            c = 'value-error'
+
+    with pytest.raises(ZeroDivisionError):
+        graph('c', {'a': 1, 'b': 0})
+
+
+def test_slipform_reassignment():
+    @slipform()
+    def func(x, c, y=1):
+        a = x + 1
+        if c:
+            a = a * 2
+        total = a
+        total += y
+        total = total * 2
+        z = x * 2
+        x = x * 10
+        x += 1
+
+    assert func(['a', 'total', 'z'], x=1, c=True) == (4, 10, 2)
+    assert func(['a', 'total'], x=1, c=False, y=2) == (2, 8)
+    # only the last version of a name is visible, like python arguments refer to their last version
+    assert func(['x', 'z'], x=1, c=True) == (11, 2)
+    assert func(['x', 'z'], {'x': 2, 'c': True}) == (21, 4)
+    assert func['x:input'].argument == 'x'
+    assert not any(name.startswith('_slipform_ssa_') for name in func.operations)
+    # values of reassigned arguments are still given by argument
+    assert func.specialize(x=3)(['x', 'z'], c=True) == (31, 6)
+    assert fuse(func, other=func)(['func.x', 'other.z'], x=1, c=True) == (11, 2)
+
+    @slipform(add_scope=dict(func=func))
+    def outer(x):
+        inner = func(x + 1, True)
+        y = inner.x
+    assert outer('y', x=0) == 11
+
+
+def test_slipform_inplace_accumulation():
+    np = pytest.importorskip('numpy')
+
+    @slipform_io
+    def ones(n):
+        return np.ones(n)
+
+    @slipform(add_scope=dict(ones=ones), inplace=True)
+    def func(n):
+        total = ones(n)
+        total += 1
+        total *= 3
+        total -= 1
+
+    # earlier versions are released, so their buffer is reused
+    ids = set()
+    def record(op, context):
+        ids.update(id(v) for v in context.values() if isinstance(v, np.ndarray))
+        return contextlib.nullcontext()
+
+    assert np.array_equal(func('total', n=3, callback=record), [5, 5, 5])
+    assert len(ids) == 1
+
+
+def test_slipform_access_chains():
+    @slipform()
+    def func(batch, i):
+        a = batch['x'][0][1]
+        b = batch['x'][i:][0]
+        c = batch['y'].real.imag
+        d = batch['x'][i]
+
+    batch = {'x': [[1, 2], [3, 4]], 'y': 5}
+    assert func(['a', 'b', 'c', 'd'], batch=batch, i=1) == (2, [3, 4], 0, [3, 4])
+    # each chain is a single operation
+    profiler = pf.Profiler()
+    func(['a', 'b', 'c'], batch=batch, i=1, callback=profiler)
+    assert {op.name for op in profiler.times} == {'a', 'b', 'c'}
+
+
+def test_slipform_elementwise():
+    @slipform()
+    def func(a, b, c):
+        x = a * b + c - 1
+        y = -(a + 1) * 2
+        z = a + b
+
+    assert func(['x', 'y', 'z'], a=2, b=3, c=4) == (9, -6, 5)
+    # the whole expression is a single operation
+    profiler = pf.Profiler()
+    func('x', a=2, b=3, c=4, callback=profiler)
+    assert [op.name for op in profiler.times] == ['x']
+    assert '((v0 * v1) + v2) - v3' in repr(func['x'])
+
+
+def test_slipform_elementwise_arrays():
+    np = pytest.importorskip('numpy')
+
+    @slipform()
+    def func(a, b, i):
+        x = a * b + a - b / 2
+        y = i * 2 + 0.5
+        z = -(a * 2) * b
+
+    a, b, i = np.arange(4.0), np.ones(4), np.arange(4)
+    x, y, z = func(['x', 'y', 'z'], a=a, b=b, i=i)
+    assert np.array_equal(x, a * b + a - b / 2)
+    assert np.array_equal(y, i * 2 + 0.5) and y.dtype == np.float64
+    assert np.array_equal(z, -(a * 2) * b)
+    # inputs are never written into
+    assert np.array_equal(a, np.arange(4.0)) and np.array_equal(b, np.ones(4))
+
+    # true division of integer temporaries gives a new float array
+    @slipform()
+    def divide(i):
+        y = (i * 2) / 3
+
+    assert np.array_equal(divide('y', i=i), (i * 2) / 3)
+
+
+def test_slipform_comparisons():
+    @slipform()
+    def func(a, b, c):
+        x = a < b <= c
+        y = a not in c
+        z = a is None
+        w = b in c
+
+    assert func(['y', 'z', 'w'], a=1, b=2, c=[2, 3]) == (True, False, True)
+    assert func('x', a=1, b=2, c=2) is True
+    assert func('z', a=None, b=2, c=[None]) is True
+    assert func('x', a=3, b=2, c=1) is False
+    assert func('y', a=1, b=2, c=[1]) is False
+
+
+def test_slipform_unsupported_syntax():
+    with pytest.raises(SlipformSyntaxError) as info:
+        @slipform()
+        def func(x, *args):
+            for i in x:
+                y = i
+            x.y = 1
+            a, *b = [1, 2, 3]
+            return x
+
+    # all errors are reported at once, with their location in this file
+    lineno = inspect.getsourcelines(test_slipform_unsupported_syntax)[1]
+    assert [(e[0] - lineno, e[2].split()[0]) for e in info.value.errors] == [(4, 'for'), (6, 'assigning'), (7, 'starred'), (8, 'return')]
+    assert info.value.lineno == lineno + 4 and info.value.errors[1][1] == 12
+    assert "'func'" in str(info.value)
+
+
+def test_slipform_typed_placeholders():
+    @slipform()
+    def func(x: float, y: Spec(shape=(None, 3), dtype='float32') = None, *, scale: 'float' = 2.0, offset=1):
+        z = x * scale + offset
+
+    assert func('z', x=1) == 3.0
+    assert func('z', x=1, scale=3, offset=0) == 3
+    assert func(['y', 'scale'], x=1) == (None, 2.0)
+    with pytest.raises(ValueError):
+        func('z')
+    # annotations are kept as specs
+    specs = get_placeholder_specs(func)
+    assert set(specs) == {'x', 'y', 'scale'}
+    assert specs['x'].type is float and not specs['x'].is_array
+    assert specs['y'].shape == (None, 3) and specs['y'].dtype == 'float32' and specs['y'].is_array
+    assert specs['scale'].type == 'float'
+    assert func['offset'].has_default and not func['x'].has_default
+
+
+def test_slipform_variadic_placeholders():
+    @slipform_pure
+    def mean(*xs):
+        return sum(xs) / len(xs)
+
+    @slipform(add_scope=dict(mean=mean))
+    def func(a, /, b=2, *features: float, scale=1.0, **options):
+        avg = mean(*features)
+        total = sum(features) * scale
+        n = len(features)
+        pairs = zip(features, range(n))
+        largest = max(a, b)
+        config = dict(**options, seed=a)
+
+    # empty by default
+    assert func(['n', 'largest', 'config'], a=3) == (0, 3, {'seed': 3})
+    assert func(['avg', 'total', 'pairs', 'config'], a=1, features=[1, 2, 6], options={'lr': 0.1}, scale=2) == (3, 18, [(1, 0), (2, 1), (6, 2)], {'lr': 0.1, 'seed': 1})
+    assert get_placeholder_specs(func)['features'].type is float
+    # duplicate keywords are reported like python
+    with pytest.raises(TypeError):
+        func('config', a=1, options={'seed': 2})
+
+    # variadic arguments are bound when inlined
+    @slipform(add_scope=dict(func=func))
+    def outer(x, y):
+        out = func(x, 5, x, y, lr=0.1)
+        avg = out.avg
+        config = out.config
+
+    assert outer(['avg', 'config'], x=1, y=3) == (2, {'lr': 0.1, 'seed': 1})
+
+    # keywords of the builtins are never taken by the operation
+    @slipform()
+    def named(x):
+        d = dict(name=x, length=2, graph=x)
+
+    assert named('d', x=1) == {'name': 1, 'length': 2, 'graph': 1}
+
+
+def test_slipform_closures():
+    def make_model(scale):
+        @slipform_pure
+        def encode(x):
+            return x * scale
+
+        offset = 1
+
+        @slipform()
+        def model(x):
+            z = encode(x) + offset
+            # nested functions see the closure too
+            w = map(lambda v: v * scale, [z])
+
+        return model
+
+    assert make_model(2)(['z', 'w'], x=3) == (7, [14])
+    assert make_model(10)('z', x=3) == 31
+    model = make_model(2)
+    # the globals of the module are not copied
+    assert model._builder.__globals__.globals is globals()
+    assert 'test_slipform_closures' not in dict.keys(model._builder.__globals__)
+    assert model._builder.__globals__['test_slipform_closures'] is test_slipform_closures
+    # added names are looked up after the closure, and before the globals
+    json = 'closure'
+
+    @slipform(add_scope=dict(inspect='added', json='added'))
+    def func():
+        a = inspect + '!'
+        b = json + '!'
+
+    assert func(['a', 'b']) == ('added!', 'closure!')
+
+
+def test_slipform_constant_pool():
+    @slipform_pure
+    def reduce(x, axis, how):
+        return x + axis
+
+    @slipform(add_scope=dict(reduce=reduce))
+    def func(x, y):
+        a = reduce(x, 0, 'mean')
+        b = reduce(y, 0, 'mean')
+        c = reduce(x, 1, 'mean')
+        d = reduce(y, 1.0, 'mean')
+        one = 1
+        two, mean = 2, 'mean'
+
+    assert func(['a', 'b', 'c', 'd', 'one', 'two', 'mean'], x=1, y=2) == (1, 2, 2, 3.0, 1, 2, 'mean')
+    constants = {}
+    for op in func.operations.values():
+        if (type(op) is pf.func_op) and (op.target is pf.identity.__wrapped__) and (op.name != '_orig_fn'):
+            constants.setdefault((type(op.args[0]), op.args[0]), []).append(op.name)
+    # equal literals share an operation, 1 and 1.0 do not
+    args = {name: func[name].args[0] for name in 'abcd'}
+    assert args['a'][1] is args['b'][1] and args['a'][2] is args['c'][2] is args['d'][2]
+    assert args['c'][1] is not args['d'][1]
+    # assigned literals keep their own named operations
+    assert sorted(map(len, constants.values())) == [1, 1, 1, 2, 2]
+    assert constants[int, 1][1:] == ['one'] and constants[int, 2] == ['two'] and constants[str, 'mean'][1:] == ['mean']
+
+
+def test_slipform_frozen_graph():
+    @slipform()
+    def func(x):
+        y = x + 1
+
+    assert func.frozen
+    assert func._orig_fn(1) is None
+    assert func('_orig_fn') is func._orig_fn
+    # operations cannot be added or renamed after the graph is built
+    with pytest.raises(FrozenGraphError):
+        with func:
+            pf.constant(1)
+    with pytest.raises(FrozenGraphError):
+        func['y'].name = 'z'
+    with pytest.raises(AttributeError):
+        func._orig_fn = None
+    # the given context is not modified
+    context = {'x': 1}
+    assert func('y', context) == 2
+    assert context == {'x': 1}
+
+
+def test_slipform_concurrent_evaluation():
+    @slipform()
+    def func(x, y):
+        a = x * 2
+        b = a + y
+        c = b * b
+
+    def evaluate(i):
+        return func(['a', 'c'], x=i, y=1)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(evaluate, range(2000)))
+    assert results == [(i * 2, (i * 2 + 1) ** 2) for i in range(2000)]
+
+
+def test_slipform_reentrant_evaluation():
+    graphs = []
+
+    @slipform_io
+    def recurse(n):
+        return graphs[0]('total', n=n - 1)
+
+    # evaluating the graph from within one of its own operations
+    # must not share intermediate values with the outer evaluation
+    @slipform(add_scope=dict(recurse=recurse))
+    def func(n):
+        total = n + recurse(n) if n > 0 else 0
+
+    graphs.append(func)
+    assert func('total', n=4) == 10
+
+
+def test_slipform_releases_intermediate_values():
+    alive = {}
+
+    def record(op, context):
+        alive[op.name] = {o.name for o in context} & {'x', 'a', 'b', 'c', 'd'}
+        return contextlib.nullcontext()
+
+    @slipform()
+    def func(x):
+        a = x + 1
+        b = a * 2
+        c = b - 1
+        d = c if x > 0 else a
+
+    # values are dropped once their last consumer is evaluated
+    assert func('c', x=1, callback=record) == 3
+    assert alive['a'] == {'x'} and alive['b'] == {'a'} and alive['c'] == {'b'}
+    # fetches and values referenced by lazy operations are kept
+    assert func(['b', 'd'], x=1, callback=record) == (4, 3)
+    assert alive['d'] == {'a', 'b'} and alive['c'] == {'a', 'b'}
+
+
+def test_slipform_inplace():
+    np = pytest.importorskip('numpy')
+    ids = []
+
+    @slipform_io
+    def ones(n):
+        array = np.ones(n)
+        ids.append(id(array))
+        return array
+
+    @slipform(add_scope=dict(ones=ones), inplace=True)
+    def func(x, n):
+        a = ones(n)
+        b = a + 1
+        c = b * 2
+        y = x + 1
+
+    c = func('c', x=0, n=3)
+    assert id(c) == ids[-1] and np.array_equal(c, [4, 4, 4])
+    # fetched intermediate values are never overwritten
+    b, c = func(['b', 'c'], x=0, n=3)
+    assert np.array_equal(b, [2, 2, 2]) and np.array_equal(c, [4, 4, 4])
+    # neither are the inputs
+    x = np.zeros(3)
+    y = func('y', x=x, n=3)
+    assert np.array_equal(x, [0, 0, 0]) and np.array_equal(y, [1, 1, 1])
+
+    # true division of integers cannot be written into an integer buffer
+    @slipform(inplace=True)
+    def divide(x):
+        y = x * 2
+        z = y / 4
+
+    assert np.array_equal(divide('z', x=np.arange(4)), np.arange(4) / 2)
+
+
+def test_slipform_explain():
+    @slipform_pure
+    def norm(x, scale):
+        return x / scale
+
+    @slipform(add_scope=dict(norm=norm))
+    def func(x, mse):
+        # comments do not change line numbers
+        a = x * 2
+
+        b = norm(a, 10)
+        loss = b + 1 if mse else b - 1
+
+    # line of the decorator
+    lineno = inspect.getsourcelines(func._orig_fn)[1]
+    profiler = Profiler()
+    for i in range(3):
+        assert func('loss', x=i, mse=True, callback=profiler) == i / 5 + 1
+    # operations are listed in the order they are evaluated
+    plan = json.loads(func.explain('loss', format='json', profiler=profiler))
+    ops = {op['name']: op for op in plan['operations']}
+    assert plan['fetches'] == ['loss']
+    assert ops['x']['step'] < ops['a']['step'] < ops['b']['step'] < ops['loss']['step'] == len(ops)
+    assert ops['loss']['flags'] == ['fetch'] and ops['loss']['op'] == 'conditional'
+    assert ops['b']['flags'] == ['lazy', 'pure', 'cached'] and ops['b']['cache']['misses'] == 3
+    # source lines correspond to the original function
+    assert (ops['a']['line'], ops['a']['source']) == (lineno + 3, 'a = x * 2')
+    assert (ops['b']['line'], ops['b']['source']) == (lineno + 5, 'b = norm(a, 10)')
+    assert ops['x']['line'] == lineno + 1
+    # and are kept by copies of the graph
+    for copy, prefix in [(fuse(func), 'func.'), (func.specialize(mse=False), '')]:
+        copied = {op['name']: op for op in json.loads(copy.explain(f'{prefix}loss', format='json'))['operations']}
+        assert (copied[f'{prefix}a']['line'], copied[f'{prefix}a']['source']) == (lineno + 3, 'a = x * 2')
+        assert copied[f'{prefix}loss']['line'] == lineno + 6
+    # recorded timings
+    assert ops['b']['calls'] == 3 and ops['b']['total_ms'] > 0
+    assert {'source': 'a', 'target': 'b', 'lazy': False} in plan['edges']
+    # other formats
+    text = func.explain('loss', profiler=profiler)
+    assert text.splitlines()[0] == f"plan for ['loss']: {len(ops)} operations"
+    assert 'b = norm(a, 10)' in text and 'calls' in text
+    assert 'calls' not in func.explain('loss')
+    assert func.explain(['a', 'loss'], format='dot').startswith('digraph plan {')
+    with pytest.raises(ValueError):
+        func.explain('loss', format='html')
+
+
+def test_slipform_hooks():
+    class Recorder(Hooks):
+        def __init__(self):
+            self.events = []
+
+        def on_call_start(self, graph, fetches):
+            self.events.append(('call', [f.name for f in fetches]))
+
+        def on_op_start(self, info):
+            self.events.append(('start', info.name, info.lineno, info.source))
+
+        def on_op_end(self, info, error):
+            self.events.append(('end', info.name, type(error)))
+
+    @slipform
+    def func(x, y):
+        a = x + y
+        b = a / y
+
+    lineno = inspect.getsourcelines(func._orig_fn)[1]
+    recorder = func.add_hooks(Recorder())
+    requests = []
+    exporter = func.add_hooks(SpanExporter(export=requests.append))
+    profiler = Profiler()
+    assert func('b', x=4, y=2, callback=profiler) == 3
+    assert recorder.events == [
+        ('call', ['b']),
+        ('start', 'a', lineno + 2, 'a = x + y'),
+        ('end', 'a', type(None)),
+        ('start', 'b', lineno + 3, 'b = a / y'),
+        ('end', 'b', type(None)),
+    ]
+    # other callbacks are still called
+    assert set(op.name for op in profiler.times) == {'a', 'b'}
+    # one span per call, and one child span per operation
+    [spans] = [r['resourceSpans'][0]['scopeSpans'][0]['spans'] for r in requests]
+    root = spans[-1]
+    assert [s['name'] for s in spans] == ['a', 'b', func._orig_fn.__qualname__]
+    assert root['parentSpanId'] == '' and all(s['parentSpanId'] == root['spanId'] for s in spans[:-1])
+    assert len({s['traceId'] for s in spans}) == 1
+    assert {'key': 'code.lineno', 'value': {'intValue': str(lineno + 3)}} in spans[1]['attributes']
+    # errors are recorded
+    with pytest.raises(ZeroDivisionError):
+        func('b', x=4, y=0)
+    assert recorder.events[-1] == ('end', 'b', ZeroDivisionError)
+    assert requests[-1]['resourceSpans'][0]['scopeSpans'][0]['spans'][-1]['status']['code'] == 2
+    # removed hooks are no longer called
+    func.remove_hooks(recorder)
+    func.remove_hooks(exporter)
+    func('b', x=4, y=2)
+    assert len(recorder.events) == 10 and len(requests) == 2
+    # ids are unique and do not use the global generator
+    func.add_hooks(exporter)
+    state = random.getstate()
+    try:
+        for _ in range(2):
+            random.seed(0)
+            func('b', x=4, y=2)
+        assert random.random() == random.Random(0).random()
+    finally:
+        random.setstate(state)
+        func.remove_hooks(exporter)
+    assert len({r['resourceSpans'][0]['scopeSpans'][0]['spans'][-1]['traceId'] for r in requests[-2:]}) == 2
+    with pytest.raises(ValueError):
+        SpanExporter()
+
+
+def test_slipform_fuse():
+    calls = []
+
+    @slipform_io
+    def load(x):
+        calls.append('load')
+        return x
+
+    @slipform_cpu_heavy
+    def heavy(x):
+        calls.append('heavy')
+        return x * 10
+
+    scope = dict(load=load, heavy=heavy)
+
+    @slipform(add_scope=scope)
+    def encode(x, y):
+        a = heavy(x)
+        z = a + y
+        l = load(x)
+
+    @slipform(add_scope=scope)
+    def decode(x, s=2):
+        a = heavy(x)
+        x_recon = a * s
+        l = load(x)
+
+    fused = fuse(encode, decode)
+    assert fused.frozen
+    assert fused(['encode.z', 'decode.x_recon', 'encode.l', 'decode.l'], x=1, y=2) == (12, 20, 1, 1)
+    # shared operations are only evaluated once, but io operations are never merged
+    assert sorted(calls) == ['heavy', 'load', 'load']
+    # placeholders are shared and keep their names
+    assert fused['x'] is fused['encode.x'] is fused['decode.x']
+    assert fused['encode.a'] is fused['decode.a']
+    assert fused('decode.x_recon', x=1, s=3) == 30
+    # the original graphs are unchanged
+    assert encode('z', x=1, y=1) == 11
+    # graphs can be passed by name
+    fused = fuse(encode, other=encode)
+    assert fused(['encode.z', 'other.z'], x=1, y=1) == (11, 11)
+    with pytest.raises(ValueError):
+        fuse(encode, encode)
+
+
+def test_slipform_inline():
+    @slipform()
+    def encoder(x, scale=2):
+        h = x * scale
+        z = h + 1
+
+    @slipform_inline
+    def block(x):
+        y = x - 1
+
+    @slipform(add_scope=dict(encoder=encoder, block=block))
+    def model(x):
+        enc = encoder(x)
+        z = enc.z
+        out = block(z)
+        w = out.y * 2
+        big = encoder(x, scale=10)
+
+    assert model(['z', 'w', 'big.z'], x=1) == (3, 4, 11)
+    # operations are copied into the graph and prefixed with the assigned name
+    assert all(op.graph is model for op in model.operations.values())
+    assert model('enc.h', x=1) == 2
+    assert model('z', {'enc.scale': 3}, x=1) == 4
+    assert model('out.y', x=2) == 4
+    # arguments are bound like a function call
+    with pytest.raises(TypeError):
+        @slipform(add_scope=dict(encoder=encoder))
+        def missing(x):
+            enc = encoder(scale=x)
+
+
+def test_slipform_memoize():
+    calls = []
+
+    @slipform_io
+    def load(config):
+        calls.append(config)
+        return len(config)
+
+    @slipform(add_scope=dict(load=load))
+    def func(config, x):
+        n = load(config)
+        y = n + x
+
+    cached = memoize(func, maxsize=2)
+    assert cached('y', config='abc', x=1) == 4
+    assert cached('y', {'config': 'abc'}, x=1) == 4
+    assert cached(['n', 'y'], config='abc', x=1) == (3, 4)
+    assert calls == ['abc', 'abc']
+    assert cached.stats()[:3] == (1, 2, 0)
+    # least recently used results are evicted
+    cached('y', config='abc', x=1.0)
+    cached('y', config='abc', x=2)
+    cached('y', config='abc', x=1)
+    assert len(calls) == 5 and cached.stats().evictions == 3 and cached.stats().size == 2
+    # unhashable values are never cached
+    assert cached('y', config={'a'}, x=1) == 2
+    assert cached.stats().uncacheable == 1
+    # least frequently used results are evicted
+    cached = memoize(func, maxsize=2, policy='lfu')
+    for x in [1, 1, 1, 2, 3, 1, 2]:
+        cached('y', config='a', x=x)
+    assert cached.stats().misses == 4
+    # expired results are evaluated again
+    cached = memoize(func, ttl=0)
+    cached('y', config='a', x=1)
+    cached('y', config='a', x=1)
+    assert cached.stats().expirations == 1 and cached.stats().hits == 0
+
+
+def test_slipform_memoize_arrays():
+    np = pytest.importorskip('numpy')
+
+    @slipform()
+    def func(x):
+        y = x.sum()
+
+    x = np.ones(3)
+    cached = memoize(func)
+    assert cached('y', x=x) == 3
+    assert cached('y', x=np.ones(3)) == 3
+    x[0] = 2
+    assert cached('y', x=x) == 4
+    assert cached.stats().hits == 1
+    # arrays hashed by identity are much faster, but cannot be modified in-place
+    cached = memoize(func, array_hash='identity')
+    assert cached('y', x=x) == 4
+    assert cached('y', x=np.ones(3)) == 3
+    x[0] = 3
+    assert cached('y', x=x) == 4
+    # arrays with the same content but different shapes have different keys
+    @slipform()
+    def shape(x):
+        s = x.shape
+
+    cached = memoize(shape)
+    assert cached('s', x=np.array(1.0)) == ()
+    assert cached('s', x=np.array([1.0])) == (1,)
+
+
+def test_slipform_record_replay(tmp_path):
+    calls = []
+
+    @stochastic
+    def sample(n):
+        calls.append(n)
+        return [random.random() for _ in range(n)]
+
+    def build():
+        @slipform(add_scope=dict(sample=sample))
+        def func(n, noisy):
+            eps = sample(n)
+            y = (eps[0] + sample(1)[0]) * 2 if noisy else n
+        return func
+
+    func = build()
+    recording = record(func, seed=0)
+    recorded = [recording('y', n=2, noisy=True), recording('y', n=3, noisy=False), recording('y', n=1, noisy=True)]
+    assert calls == [2, 1, 1, 1]
+    # only evaluated operations are recorded, unnamed ones by their position
+    assert [len(values) for values in recording.trace] == [2, 0, 2]
+    (key,) = set(recording.trace[0]) - {'eps'}
+    assert key.startswith('#') and (set(recording.trace[2]) == {'eps', key})
+    # seeded calls are reproducible
+    assert record(func, seed=0)('y', n=2, noisy=True) == recorded[0]
+    with seeded(1):
+        expected = random.random()
+    with seeded(1):
+        assert random.random() == expected
+    # recorded operations are not evaluated again, also when the graph is built again
+    calls.clear()
+    recording.trace.save(tmp_path / 'func.trace')
+    replaying = replay(build(), Trace.load(tmp_path / 'func.trace'))
+    assert [replaying('y', n=2, noisy=True), replaying('y', n=3, noisy=False), replaying('y', n=1, noisy=True)] == recorded
+    assert calls == []
+    # traces of other formats are rejected when loaded
+    with open(tmp_path / 'old.trace', 'wb') as f:
+        pickle.dump(('0.0.1-alpha2', recording.trace.calls), f)
+    with pytest.raises(ValueError, match='format'):
+        Trace.load(tmp_path / 'old.trace')
+    with pytest.raises(RuntimeError):
+        replaying('y', n=2, noisy=True)
+    replaying.reset()
+    assert replaying('y', n=2, noisy=True) == recorded[0]
+    # given values take precedence
+    assert replay(func, recording.trace)('y', n=2, noisy=True, eps=[1]) == 2 * (1 + recording.trace[0][key][0])
+
+
+def test_slipform_record_random():
+    @slipform(add_scope=dict(rng=random.Random(0)))
+    def func(scale):
+        u = random.uniform(0, 1)
+        v = rng.random()
+        y = (u + v) * scale
+
+    # random functions are evaluated on every call, not once when building the graph
+    assert func['u'].kind == func['v'].kind == 'stochastic'
+    assert len({func('u', scale=1) for _ in range(5)}) == 5
+    _u, _v, _y = func(['u', 'v', 'y'], scale=2)
+    assert _y == (_u + _v) * 2
+    recording = record(func)
+    expected = recording('y', scale=2)
+    assert sorted(recording.trace[0]) == ['u', 'v']
+    assert replay(func, recording.trace)('y', scale=2) == expected
+
+    @slipform()
+    def deterministic(x):
+        y = x + 1
+
+    with pytest.raises(ValueError):
+        record(deterministic)
+
+
+def test_slipform_specialize():
+    calls = []
+
+    @slipform_pure
+    def encoder(x):
+        calls.append(x)
+        return x * 10
+
+    @slipform(add_scope=dict(encoder=encoder))
+    def func(x, y, mse, scale=2):
+        z = encoder(x)
+        if mse:
+            a = z + y
+        else:
+            a = z - y
+        loss = a * scale if mse else -a
+
+    fast = func.specialize(mse=True, x=3)
+    assert fast.frozen
+    assert fast('loss', y=1) == func('loss', x=3, y=1, mse=True) == 62
+    assert fast('loss', y=1, scale=3) == 93
+    # constant subtrees are precomputed once
+    assert calls == [3]
+    assert 'constant' in fast.explain('z').splitlines()[-1]
+    # resolved conditionals and dead branches are removed
+    assert not any(isinstance(op, pf.conditional) for op in fast.operations.values())
+    assert len(fast.operations) < len(func.operations)
+    # unknown values are still placeholders
+    slow = func.specialize(mse=False)
+    assert slow('loss', x=1, y=5) == func('loss', x=1, y=5, mse=False) == -5
+    assert slow['mse'] is not func['mse']
+    with pytest.raises(TypeError):
+        func.specialize(unknown=1)